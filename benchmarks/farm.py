@@ -0,0 +1,235 @@
+"""
+Simulated proxy farm for the benchmarks: local HTTP proxies with injected latency, failures, blocked
+responses and hangs, a target server and a stand-in for the icanhazip and proxydb checks.
+
+    python benchmarks/farm.py [--proxies 50] [--seed 1]
+
+Prints one JSON line with the addresses and serves until it is terminated.
+"""
+import argparse
+import http.client
+import http.server
+import json
+import random
+import socket
+import socketserver
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+class ProxyProfile:
+    """
+    Behaviour of one simulated proxy. Latencies are log-normally distributed around latency_median seconds
+    """
+    def __init__(self,
+                 name: str,
+                 latency_median: float = 0.02,
+                 latency_sigma: float = 0.5,
+                 failure_rate: float = 0.0,
+                 block_rate: float = 0.0,
+                 hang_rate: float = 0.0,
+                 hang_seconds: float = 30.0,
+                 leaking: bool = False,
+                 dead: bool = False):
+        self.name: str = name
+        self.latency_median: float = latency_median
+        self.latency_sigma: float = latency_sigma
+        self.failure_rate: float = failure_rate
+        self.block_rate: float = block_rate
+        self.hang_rate: float = hang_rate
+        self.hang_seconds: float = hang_seconds
+        self.leaking: bool = leaking
+        self.dead: bool = dead
+
+
+# Share of the farm and profile of each kind of proxy
+DEFAULT_MIX = (
+    (0.55, dict(name="fast", latency_median=0.02)),
+    (0.15, dict(name="slow", latency_median=0.2, latency_sigma=0.8)),
+    (0.10, dict(name="flaky", latency_median=0.05, failure_rate=0.3)),
+    (0.08, dict(name="blocked", latency_median=0.03, block_rate=0.5)),
+    (0.04, dict(name="hanging", latency_median=0.03, hang_rate=0.05)),
+    (0.03, dict(name="leaking", latency_median=0.02, leaking=True)),
+    (0.05, dict(name="dead", dead=True)),
+)
+
+
+def build_profiles(n: int, seed: int = 1, mix=DEFAULT_MIX):
+    rng = random.Random(seed)
+    profiles = []
+    for share, kwargs in mix:
+        profiles += [ProxyProfile(**kwargs) for _ in range(round(share * n))]
+    while len(profiles) < n:
+        profiles.append(ProxyProfile(**mix[0][1]))
+    rng.shuffle(profiles)
+    return profiles[:n]
+
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class _QuietHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status: int, body: bytes, headers: dict = None):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+
+# Headers passed through by the farm proxies in both directions
+FORWARDED_HEADERS = ("If-None-Match", "If-Modified-Since", "ETag", "Last-Modified", "Cache-Control")
+
+
+class TargetHandler(_QuietHandler):
+    """
+    Target of the benchmark requests, answers with body_size bytes.
+    Paths below /cached/ are cacheable: fresh for a second and revalidated with their ETag afterwards
+    """
+    body_size: int = 2048
+
+    def do_GET(self):
+        if not self.path.startswith("/cached/"):
+            self._reply(200, b"x" * self.body_size)
+            return
+        headers = {"ETag": '"v1"', "Cache-Control": "max-age=1"}
+        if self.headers.get("If-None-Match") == headers["ETag"]:
+            self._reply(304, b"", headers)
+        else:
+            self._reply(200, b"x" * self.body_size, headers)
+
+    do_HEAD = do_GET
+
+
+class CheckHandler(_QuietHandler):
+    """
+    Stand-in for icanhazip.com (/ip), the proxydb.net leak check (/anon) and the httpbin.org echo (/get).
+    The echo reports the exit address a farm proxy announced as origin, every client is local otherwise
+    """
+    def do_GET(self):
+        if self.path.startswith("/get"):
+            origin = self.headers.get("X-Farm-Exit", self.client_address[0])
+            body = json.dumps({"origin": origin, "headers": dict(self.headers)}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path.startswith("/anon"):
+            leaking = self.headers.get("X-Forwarded-For") is not None or self.headers.get("Via") is not None
+            self._reply(200, b'<span class="text-danger">' if leaking else b'<span class="text-success">')
+        else:
+            self._reply(200, f"{self.client_address[0]}\n".encode())
+
+
+class ProxyHandler(_QuietHandler):
+    """
+    Forwarding HTTP proxy with the behaviour of the ProxyProfile of its server
+    """
+    def do_GET(self):
+        profile, rng = self.server.profile, self.server.rng
+        if rng.random() < profile.hang_rate:
+            time.sleep(profile.hang_seconds)
+            self.close_connection = True
+            return
+        time.sleep(rng.lognormvariate(0, profile.latency_sigma) * profile.latency_median)
+        if rng.random() < profile.failure_rate:
+            # Drop the connection without an answer
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+
+        url = urlsplit(self.path)
+        if url.port == self.server.target_port and rng.random() < profile.block_rate:
+            self._reply(403, b"blocked")
+            return
+
+        port = self.server.server_address[1]
+        headers = {"Host": url.netloc, "X-Farm-Exit": f"10.255.{port >> 8}.{port & 255}"}
+        headers.update({h: self.headers[h] for h in FORWARDED_HEADERS if h in self.headers})
+        if profile.leaking:
+            headers["X-Forwarded-For"] = self.client_address[0]
+        connection = http.client.HTTPConnection(url.hostname, url.port, timeout=10)
+        try:
+            connection.request(self.command, url.path or "/", headers=headers)
+            res = connection.getresponse()
+            body = res.read()
+        except OSError:
+            self._reply(502, b"bad gateway")
+            return
+        finally:
+            connection.close()
+        self._reply(res.status, body, {h: res.getheader(h) for h in FORWARDED_HEADERS if res.getheader(h)})
+
+    do_HEAD = do_GET
+
+
+def _serve(handler, port: int = 0, **attributes) -> _Server:
+    server = _Server(("127.0.0.1", port), handler)
+    for k, v in attributes.items():
+        setattr(server, k, v)
+    instance = threading.Thread(target=server.serve_forever)
+    instance.daemon = True
+    instance.start()
+    return server
+
+
+def _closed_port() -> int:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def start_farm(n: int = 50, seed: int = 1, body_size: int = 2048):
+    """
+    Starts the farm in this process
+    :return: dict with the target and check urls and the (port, profile name) of every proxy
+    """
+    TargetHandler.body_size = body_size
+    target = _serve(TargetHandler)
+    check = _serve(CheckHandler)
+    proxies = []
+    for i, profile in enumerate(build_profiles(n, seed)):
+        if profile.dead:
+            proxies.append((_closed_port(), profile.name))
+            continue
+        server = _serve(ProxyHandler, profile=profile, rng=random.Random(seed * 100003 + i),
+                        target_port=target.server_address[1])
+        proxies.append((server.server_address[1], profile.name))
+    return {
+        "target": f"http://127.0.0.1:{target.server_address[1]}",
+        "check": f"http://127.0.0.1:{check.server_address[1]}",
+        "proxies": proxies,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--proxies", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--body-size", type=int, default=2048)
+    args = parser.parse_args()
+    print(json.dumps(start_farm(args.proxies, args.seed, args.body_size)), flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Memory per ProxyObject and cost of reading ProxyObject.state for large pools.
+
+    python benchmarks/proxy_object.py [sizes...]
+"""
+import datetime
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, ".")
+from pyproxyroulette.proxy import ProxyObject, ProxyState  # noqa: E402
+
+
+def build(n: int):
+    proxies = []
+    for i in range(n):
+        p = ProxyObject(f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", 8080)
+        p.response_time = 0.5
+        proxies.append(p)
+    return proxies
+
+
+def measure_memory(n: int) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    proxies = build(n)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del proxies
+    return (after - before) / n
+
+
+def measure_state_reads(proxies, rounds: int = 3) -> float:
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for p in proxies:
+            p.state
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(proxies) * 1e9
+
+
+def main(sizes):
+    print(f"{'proxies':>10} | {'bytes/proxy':>11} | {'ns/state (active)':>17} | {'ns/state (cooldown)':>19}")
+    for n in sizes:
+        per_proxy = measure_memory(n)
+        proxies = build(n)
+        active_ns = measure_state_reads(proxies)
+        for p in proxies:
+            p.cooldown = datetime.timedelta(hours=1)
+        assert proxies[0].state == ProxyState.COOLDOWN
+        cooldown_ns = measure_state_reads(proxies)
+        print(f"{n:>10} | {per_proxy:>11.0f} | {active_ns:>17.1f} | {cooldown_ns:>19.1f}")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [100000, 1000000])
@@ -0,0 +1,262 @@
+"""
+End-to-end benchmark against the simulated proxy farm of benchmarks/farm.py.
+The farm runs in a subprocess, so CPU time and memory are those of the client only.
+
+    python benchmarks/roulette.py [--proxies 50] [--requests 2000] [--concurrency 32] [--race 4] [--json results.json]
+
+Phases:
+    cold start   time until the first proxy is usable and until every proxy was checked once
+    first request  time until the first request on a fresh pool returned, waiting for the checker and racing
+                 unchecked proxies
+    requests     throughput and latency of fetch_many against the farm target
+    cache        throughput of fetch_many repeatedly fetching a few cacheable urls, with and without a response cache
+    selection    cost of selecting a proxy from a large synthetic active pool per strategy
+    contention   selections and latency updates per second from many threads sharing one pool
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, ".")
+from pyproxyroulette import ProxyRoulette, FastestFirst, PowerOfTwoChoices, WeightedRandom, LeastInFlight  # noqa: E402
+from pyproxyroulette.core import ProxyRouletteCore  # noqa: E402
+from pyproxyroulette.pool import ProxyPool  # noqa: E402
+from pyproxyroulette.validation import EchoValidator  # noqa: E402
+from pyproxyroulette.cache import ResponseCache  # noqa: E402
+
+
+def start_farm(proxies: int, seed: int):
+    farm = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(__file__), "farm.py"),
+                             "--proxies", str(proxies), "--seed", str(seed)],
+                            stdout=subprocess.PIPE, text=True)
+    return farm, json.loads(farm.stdout.readline())
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+def cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def max_rss_mb() -> float:
+    # kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def bench_cold_start(farm, max_timeout: int):
+    proxies = [("127.0.0.1", port, 0) for port, _ in farm["proxies"]]
+    started, cpu = time.monotonic(), cpu_seconds()
+    core = ProxyRouletteCore(func_proxy_pool_updater=lambda: proxies,
+                             func_proxy_validator=EchoValidator(url=f"{farm['check']}/get"),
+                             max_timeout=max_timeout)
+    pool = core.proxy_pool
+    pr = ProxyRoulette(proxy_core=core, max_timeout=max_timeout,
+                       func_proxy_response_validator=lambda res: res.status_code != 403)
+
+    pr.proxy_core.current_proxy(return_obj=True)
+    first_usable = time.monotonic() - started
+    while pool.checker.checks_total < len(proxies) and time.monotonic() - started < 4 * max_timeout + 60:
+        time.sleep(0.05)
+    all_checked = time.monotonic() - started
+    return pr, {
+        "time_to_first_usable_proxy": first_usable,
+        "time_to_all_checked": all_checked,
+        "checks_per_second": pool.checker.checks_total / all_checked,
+        "active_proxies": len(pool.pool_active),
+        "cpu_seconds": cpu_seconds() - cpu,
+    }
+
+
+def bench_first_request(farm, max_timeout: int, race_unchecked: int):
+    proxies = [("127.0.0.1", port, 0) for port, _ in farm["proxies"]]
+    started = time.monotonic()
+    core = ProxyRouletteCore(func_proxy_pool_updater=lambda: proxies,
+                             func_proxy_validator=EchoValidator(url=f"{farm['check']}/get"),
+                             max_timeout=max_timeout)
+    pr = ProxyRoulette(proxy_core=core, max_timeout=max_timeout, race_unchecked=race_unchecked,
+                       func_proxy_response_validator=lambda res: res.status_code != 403)
+    pr.get(f"{farm['target']}/first")
+    elapsed = time.monotonic() - started
+    core.proxy_pool.stop()
+    return elapsed
+
+
+def bench_requests(pr: ProxyRoulette, target: str, n: int, concurrency: int):
+    pr.metrics.enable()
+    started, cpu = time.monotonic(), cpu_seconds()
+    latencies, errors = [], 0
+    for result in pr.fetch_many((f"{target}/{i}" for i in range(n)), concurrency=concurrency):
+        if result.ok:
+            latencies.append(result.elapsed)
+        else:
+            errors += 1
+    elapsed = time.monotonic() - started
+    retries = pr.metrics.request_retries.snapshot()
+    pr.metrics.disable()
+    return {
+        "requests": n,
+        "errors": errors,
+        "requests_per_second": n / elapsed,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p99": percentile(latencies, 99),
+        "retries_per_request": retries["sum"] / max(1, retries["count"]),
+        "cpu_seconds": cpu_seconds() - cpu,
+        "cpu_seconds_per_request": (cpu_seconds() - cpu) / n,
+    }
+
+
+def bench_cache(pr: ProxyRoulette, target: str, n: int, concurrency: int, urls: int = 50):
+    cached = ProxyRoulette(proxy_core=pr.proxy_core, max_timeout=pr.max_timeout, response_cache=ResponseCache(),
+                           func_proxy_response_validator=pr.function_proxy_response_validator)
+    result = {}
+    for name, roulette in (("uncached", pr), ("cached", cached)):
+        started = time.monotonic()
+        errors = sum(not r.ok for r in roulette.fetch_many((f"{target}/cached/{i % urls}" for i in range(n)),
+                                                           concurrency=concurrency))
+        result[f"{name}_requests_per_second"] = n / (time.monotonic() - started)
+        result[f"{name}_errors"] = errors
+    stats = cached.response_cache.stats
+    result["proxied_fetches"] = stats["misses"] + stats["revalidations"]
+    result["hit_ratio"] = cached.response_cache.hit_ratio
+    result["cache"] = stats
+    return result
+
+
+def synthetic_pool(size: int) -> ProxyPool:
+    pool = ProxyPool(func_proxy_validator=lambda p, t: True)
+    pool.stop()
+    pool.add_many((f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", 8080, 0.01 + (i % 997) / 1000)
+                  for i in range(size))
+    # Publish every proxy as checked, like the checker would
+    while pool.pool_inactive:
+        pool._publish_check_result(pool.pool_inactive.popitem(last=False)[0])
+    return pool
+
+
+def bench_selection(size: int, rounds: int = 100000):
+    pool = synthetic_pool(size)
+    results = {}
+    for strategy in (FastestFirst(), PowerOfTwoChoices(), WeightedRandom(), LeastInFlight()):
+        pool.selection = strategy
+        started = time.perf_counter()
+        for _ in range(rounds):
+            pool.get_proxy_nowait()
+        results[repr(strategy)] = (time.perf_counter() - started) / rounds * 1e6
+    return results
+
+
+def bench_contention(size: int, threads: int = 256, duration: float = 3.0, update_share: int = 4):
+    """
+    Every thread selects proxies for a target host and reports a latency for every update_share-th selection,
+    like the request path does once per request
+    """
+    pool = synthetic_pool(size)
+    counts = [0] * threads
+    go, stop = threading.Event(), threading.Event()
+
+    def worker(n: int):
+        i = 0
+        go.wait()
+        while not stop.is_set():
+            proxy = pool.get_proxy_nowait(host="bench.test")
+            i += 1
+            if i % update_share == 0:
+                proxy.response_time = 0.01 + (i % 997) / 1000
+        counts[n] = i
+
+    instances = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    # All threads are started before any of them runs, busy threads would delay starting the others
+    for t in instances:
+        t.start()
+    started, cpu = time.monotonic(), cpu_seconds()
+    go.set()
+    time.sleep(duration)
+    stop.set()
+    for t in instances:
+        t.join()
+    elapsed = time.monotonic() - started
+    return {
+        "threads": threads,
+        "selections_per_second": sum(counts) / elapsed,
+        "cpu_seconds": cpu_seconds() - cpu,
+        "cpu_seconds_per_selection": (cpu_seconds() - cpu) / max(1, sum(counts)),
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--proxies", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--selection-pool", type=int, default=100000)
+    parser.add_argument("--threads", type=int, default=256)
+    parser.add_argument("--max-timeout", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--race", type=int, default=4, help="unchecked proxies raced by the first request")
+    parser.add_argument("--json", default=None, help="write the results to this file")
+    args = parser.parse_args()
+
+    farm_process, farm = start_farm(args.proxies, args.seed)
+    try:
+        pr, cold = bench_cold_start(farm, args.max_timeout)
+        print(f"cold start   first usable proxy {cold['time_to_first_usable_proxy']:.2f} s | "
+              f"all checked {cold['time_to_all_checked']:.2f} s | {cold['checks_per_second']:.1f} checks/s | "
+              f"{cold['active_proxies']} active | cpu {cold['cpu_seconds']:.2f} s")
+
+        first_request = {"waiting": bench_first_request(farm, args.max_timeout, 0),
+                         "racing": bench_first_request(farm, args.max_timeout, args.race)}
+        print(f"first request waiting {first_request['waiting']:.2f} s | "
+              f"racing {args.race} unchecked proxies {first_request['racing']:.2f} s")
+
+        load = bench_requests(pr, farm["target"], args.requests, args.concurrency)
+        print(f"requests     {load['requests_per_second']:.1f} req/s | p50 {load['latency_p50'] * 1000:.1f} ms | "
+              f"p99 {load['latency_p99'] * 1000:.1f} ms | errors {load['errors']} | "
+              f"retries/request {load['retries_per_request']:.2f} | "
+              f"cpu/request {load['cpu_seconds_per_request'] * 1000:.2f} ms")
+
+        cache = bench_cache(pr, farm["target"], args.requests, args.concurrency)
+        print(f"cache        {cache['uncached_requests_per_second']:.1f} req/s uncached | "
+              f"{cache['cached_requests_per_second']:.1f} req/s cached | hit ratio {cache['hit_ratio']:.2f} | "
+              f"{cache['proxied_fetches']} of {args.requests} requests proxied | "
+              f"{cache['cache']['coalesced']} coalesced")
+    finally:
+        farm_process.terminate()
+
+    selection = bench_selection(args.selection_pool)
+    print(f"selection    " + " | ".join(f"{k} {v:.2f} us" for k, v in selection.items()) +
+          f" ({args.selection_pool} active)")
+    contention = bench_contention(args.selection_pool, threads=args.threads)
+    print(f"contention   {contention['selections_per_second']:.0f} selections/s | "
+          f"cpu/selection {contention['cpu_seconds_per_selection'] * 1e6:.2f} us ({args.threads} threads)")
+    print(f"memory       max rss {max_rss_mb():.1f} MB")
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump({"revision": git_revision(), "arguments": vars(args), "cold_start": cold,
+                       "first_request": first_request,
+                       "requests": load, "cache": cache, "selection": selection, "contention": contention,
+                       "max_rss_mb": max_rss_mb()}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,8 @@
 __version__ = '0.4.9'
 
 from .app import ProxyRoulette
+from .aio import AsyncProxyRoulette
 from .defaults import defaults
+from .selection import SelectionStrategy, FastestFirst, PowerOfTwoChoices, WeightedRandom, LeastInFlight
+from .hedging import HedgePolicy
+from .cache import ResponseCache
@@ -0,0 +1,14 @@
+class AdmissionPolicy:
+    """
+    Limits of the load put on a single proxy. At most max_in_flight requests are sent through a proxy at once and,
+    if rate is set, at most rate requests per second with bursts of up to burst requests (token bucket).
+    Requests finding their proxy saturated are moved to another proxy instead of waiting for it.
+    None disables the respective limit.
+    """
+    def __init__(self,
+                 max_in_flight: int = 8,
+                 rate: float = None,
+                 burst: float = None):
+        self.max_in_flight: int = max_in_flight
+        self.rate: float = rate
+        self.burst: float = burst if burst is not None else (max(1.0, rate) if rate is not None else None)
@@ -0,0 +1,176 @@
+from .core import ProxyRouletteCore
+from .selection import SelectionStrategy
+from .exceptions import MaxRetriesExceeded
+from .defaults import defaults
+from .app import registered_pool_updater
+from .metrics import Metrics
+from .backoff import FailureKind
+import asyncio
+import time
+import logging
+from typing import Callable
+from urllib.parse import urlsplit
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncProxyRoulette(object):
+    """
+    asyncio counterpart of ProxyRoulette based on aiohttp.
+    Proxies are assigned per asyncio task instead of per thread. Passing the proxy_core of an existing
+    ProxyRoulette shares the proxy pool and its liveliness data between the sync and the async API.
+    The response validator receives an aiohttp.ClientResponse whose body has already been read.
+    """
+    def __init__(self,
+                 max_retries: int = 5,
+                 max_timeout: int = 15,
+                 func_proxy_validator=defaults.proxy_echo_check,
+                 func_proxy_response_validator=defaults.proxy_response_validator,
+                 max_connections: int = 1000,
+                 selection_strategy: SelectionStrategy = None,
+                 snapshot_path: str = None,
+                 proxy_core: ProxyRouletteCore = None):
+        if aiohttp is None:
+            raise ImportError("AsyncProxyRoulette requires aiohttp. Install it with 'pip install pyproxyroulette[async]'")
+
+        if proxy_core is None:
+            proxy_core = ProxyRouletteCore(max_timeout=max_timeout,
+                                           func_proxy_validator=func_proxy_validator,
+                                           func_proxy_pool_updater=registered_pool_updater(),
+                                           selection_strategy=selection_strategy,
+                                           snapshot_path=snapshot_path)
+        self.proxy_core: ProxyRouletteCore = proxy_core
+        self._max_retries: int = max_retries
+        self._max_connections: int = max_connections
+        self._session = None
+
+        # Functions
+        self.__default_proxy_response_validator: Callable = func_proxy_response_validator
+
+    async def get(self, url, **kwargs):
+        return await self._wrapper_kernel("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self._wrapper_kernel("POST", url, **kwargs)
+
+    async def put(self, url, **kwargs):
+        return await self._wrapper_kernel("PUT", url, **kwargs)
+
+    async def delete(self, url, **kwargs):
+        return await self._wrapper_kernel("DELETE", url, **kwargs)
+
+    async def head(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', False)
+        return await self._wrapper_kernel("HEAD", url, **kwargs)
+
+    async def options(self, url, **kwargs):
+        return await self._wrapper_kernel("OPTIONS", url, **kwargs)
+
+    async def _wrapper_kernel(self, req_type: str, url: str, **kwargs):
+        current_retry = 1
+        session = self._get_session()
+        host = urlsplit(url).hostname
+        host_health = self.proxy_core.proxy_pool.host_health
+        metrics = self.proxy_core.proxy_pool.metrics
+        while current_retry <= self.max_retries + 1 or self.max_retries == 0:
+            temp_proxy_obj = await self.proxy_core.acquire_proxy_async(host=host)
+            request_args = {
+                'proxy': f"http://{temp_proxy_obj.ip}:{temp_proxy_obj.port}",
+                'timeout': aiohttp.ClientTimeout(total=self.max_timeout)
+            }
+            request_args.update(kwargs)
+
+            try:
+                logger.debug("{} {} with arguments: {}".format(req_type, url, request_args))
+                started = time.monotonic()
+                try:
+                    async with session.request(req_type, url, **request_args) as res:
+                        await res.read()
+                finally:
+                    temp_proxy_obj.end_request()
+                elapsed = time.monotonic() - started
+                temp_proxy_obj.response_time = elapsed
+
+                if not self.__default_proxy_response_validator(res):  # If not valid response:
+                    logger.debug("Validator noticed a invalid response")
+                    if metrics.enabled:
+                        metrics.attempt(req_type, host, temp_proxy_obj, "rejected", elapsed)
+                    await self.proxy_core.force_update_async(blocked_host=host)
+                else:
+                    host_health.report_success(temp_proxy_obj, host, elapsed)
+                    if metrics.enabled:
+                        metrics.attempt(req_type, host, temp_proxy_obj, "ok", elapsed)
+                        metrics.request_retries.observe(current_retry - 1)
+                    return res
+
+            except (asyncio.TimeoutError,
+                    aiohttp.ClientError,
+                    ConnectionResetError) as e:
+                if metrics.enabled:
+                    metrics.attempt(req_type, host, temp_proxy_obj, type(e).__name__, time.monotonic() - started)
+                if isinstance(e, asyncio.TimeoutError):
+                    temp_proxy_obj.report_request_failed(FailureKind.TIMEOUT)
+                else:
+                    temp_proxy_obj.report_request_failed(FailureKind.PROXY_ERROR)
+                host_health.report_failure(temp_proxy_obj, host)
+                await self.proxy_core.force_update_async()
+                logger.warning("{req_type} request failed with reason: {t}".format(req_type=req_type,
+                                                                                   t=type(e).__name__))
+            current_retry += 1
+        if metrics.enabled:
+            metrics.request_retries.observe(current_retry - 1)
+        raise MaxRetriesExceeded('The maximum number of {}'
+                                 ' retries per request has been exceeded'.format(self.max_retries))
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._max_connections)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    @property
+    def function_proxy_response_validator(self) -> Callable:
+        return self.__default_proxy_response_validator
+
+    @function_proxy_response_validator.setter
+    def function_proxy_response_validator(self, value: Callable):
+        self.__default_proxy_response_validator = value
+
+    @property
+    def max_timeout(self) -> int:
+        return self.proxy_core.max_timeout
+
+    @max_timeout.setter
+    def max_timeout(self, value) -> int:
+        self.proxy_core.max_timeout = value
+
+    @property
+    def metrics(self) -> Metrics:
+        return self.proxy_core.proxy_pool.metrics
+
+    @property
+    def max_retries(self) -> int:
+        return self._max_retries
+
+    @max_retries.setter
+    def max_retries(self, value: int):
+        self._max_retries = value
+
+    def status(self):
+        return self.proxy_core.state()
@@ -1,94 +1,260 @@
 from .core import ProxyRouletteCore
+from .selection import SelectionStrategy
 from .exceptions import MaxRetriesExceeded
 import requests as requests_original
 from .defaults import defaults
+from .hedging import HedgePolicy
+from .cache import ResponseCache, CACHEABLE_METHODS
+from .batch import BatchFetch
+from .metrics import Metrics
+from .backoff import FailureKind
+from .timers import DeadlineScheduler
+import concurrent.futures
+import functools
+import queue
 import threading
-from typing import Union, Callable, List, Dict
+import time
+from typing import Union, Callable, List, Dict, Iterable, Iterator
 import logging
-from .proxy import ProxyState
+from urllib.parse import urlsplit
+from .proxy import ProxyState, ProxyObject
+from .sessions import SessionPool, AttemptHandle
 
 PROXY_POOL_UPDATERS = dict()
 logger = logging.getLogger(__name__)
 
+REQUEST_ERRORS = (requests_original.exceptions.Timeout,
+                  requests_original.exceptions.ProxyError,
+                  requests_original.exceptions.ConnectionError,
+                  ConnectionResetError,
+                  requests_original.exceptions.ChunkedEncodingError)
+
+# Methods which may be sent twice when hedging or racing unchecked proxies
+HEDGEABLE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def _close_abandoned(future: concurrent.futures.Future):
+    if future.exception() is None:
+        future.result().close()
+
+
+def _close_abandoned_race(future: concurrent.futures.Future):
+    if future.exception() is None:
+        future.result()[0].close()
+
+
+def registered_pool_updater() -> Callable:
+    """
+    Returns the pool update function combining all functions registered with ProxyRoulette.proxy_pool_updater
+    or the internal default if none were registered
+    """
+    if len(PROXY_POOL_UPDATERS) == 0:
+        logger.info("Using internal default as pool updater")
+        return defaults.get_proxies_from_web
+
+    logger.debug("Using decorator as pool updater origin")
+
+    def local_updater():
+        return merged_updaters(list(PROXY_POOL_UPDATERS.values()))
+
+    return local_updater
+
+
+def merged_updaters(funcs: List[Callable], chunk_size: int = 1024, max_chunks: int = 64) -> Iterator:
+    """
+    Runs the pool updaters concurrently and yields their proxies as they arrive.
+    Updaters may return a list or a generator. Failing updaters are logged and skipped
+    :param funcs: pool update functions
+    :param chunk_size: number of proxies handed over at once
+    :param max_chunks: chunks buffered before the updaters are paused
+    """
+    chunks = queue.Queue(maxsize=max_chunks)
+    finished = object()
+
+    def run(f: Callable):
+        logger.debug(f"calling pool updater: {f.__name__}")
+        try:
+            chunk = []
+            for p in f():
+                chunk.append(p)
+                if len(chunk) >= chunk_size:
+                    chunks.put(chunk)
+                    chunk = []
+            if chunk:
+                chunks.put(chunk)
+        except Exception as e:
+            logger.error(f"Pool updater {f.__name__} failed. {e}")
+        finally:
+            chunks.put(finished)
+
+    for f in funcs:
+        instance = threading.Thread(target=run, args=(f,))
+        instance.setDaemon(True)
+        instance.start()
+
+    running = len(funcs)
+    while running > 0:
+        chunk = chunks.get()
+        if chunk is finished:
+            running -= 1
+            continue
+        yield from chunk
+
 
 class ProxyRoulette(object):
     def __init__(self,
                  max_retries: int = 5,
                  max_timeout: int = 15,
-                 func_proxy_validator=defaults.proxy_is_working,
-                 func_proxy_response_validator=defaults.proxy_response_validator):
+                 func_proxy_validator=defaults.proxy_echo_check,
+                 func_proxy_response_validator=defaults.proxy_response_validator,
+                 max_sessions: int = 256,
+                 selection_strategy: SelectionStrategy = None,
+                 hedge_policy: HedgePolicy = None,
+                 hedge_workers: int = 64,
+                 race_unchecked: int = 0,
+                 race_workers: int = 64,
+                 response_cache: ResponseCache = None,
+                 snapshot_path: str = None,
+                 proxy_core: ProxyRouletteCore = None):
 
-        if len(PROXY_POOL_UPDATERS) == 0:
-            logger.info("Using internal default as pool updater")
-            func_proxy_pool_update = defaults.get_proxies_from_web
-
-        else:
-            logger.debug("Using decorator as pool updater origin")
-
-            def local_updater():
-                proxies = []
-                for fname, f in PROXY_POOL_UPDATERS.items():
-                    logger.debug("calling pool updater: {fname}".format(**locals()))
-                    proxies += f()
-                return proxies
-
-            func_proxy_pool_update = local_updater
-        self.proxy_core: ProxyRouletteCore = ProxyRouletteCore(max_timeout=max_timeout,
-                                                               func_proxy_validator=func_proxy_validator,
-                                                               func_proxy_pool_updater=func_proxy_pool_update)
+        if proxy_core is None:
+            proxy_core = ProxyRouletteCore(max_timeout=max_timeout,
+                                           func_proxy_validator=func_proxy_validator,
+                                           func_proxy_pool_updater=registered_pool_updater(),
+                                           selection_strategy=selection_strategy,
+                                           snapshot_path=snapshot_path)
+        self.proxy_core: ProxyRouletteCore = proxy_core
         self._max_retries: int = max_retries
 
+        # Keep-alive sessions per proxy, closed once the pool drops the proxy
+        self._sessions: SessionPool = SessionPool(max_size=max_sessions)
+        self.proxy_core.proxy_pool.on_proxy_dropped.append(self._sessions.close)
+
+        # Hedging of idempotent requests, disabled without a policy
+        self._hedge_policy: HedgePolicy = hedge_policy
+        self._hedge_executor = None
+        # Fires the hedges, independent of the timers of the pool, which may live in another process
+        self._hedge_timer: DeadlineScheduler = None
+        if hedge_policy is not None:
+            self._hedge_executor = concurrent.futures.ThreadPoolExecutor(max_workers=hedge_workers)
+            self._hedge_timer = DeadlineScheduler()
+            self._hedge_timer.start()
+
+        # Number of unchecked proxies an idempotent request is sent through at once while no proxy is active,
+        # 0 waits for the checker instead
+        self._race_unchecked: int = race_unchecked
+        self._race_executor = None
+        if race_unchecked > 0:
+            self._race_executor = concurrent.futures.ThreadPoolExecutor(max_workers=race_workers)
+
+        # Cache of GET and HEAD responses, disabled without a cache
+        self.response_cache: ResponseCache = response_cache
+        if response_cache is not None:
+            self.metrics.add_response_cache(response_cache)
+
         # Functions
         self.__default_proxy_response_validator: Callable = func_proxy_response_validator
 
     def get(self, url, **kwargs):
-        return self._wrapper_kernel(requests_original.get, "GET", url, **kwargs)
+        return self._send("GET", url, **kwargs)
 
     def post(self, url, **kwargs):
-        return self._wrapper_kernel(requests_original.post, "POST", url, **kwargs)
+        return self._wrapper_kernel("POST", url, **kwargs)
 
     def put(self, url, **kwargs):
-        return self._wrapper_kernel(requests_original.put, "PUT", url, **kwargs)
+        return self._wrapper_kernel("PUT", url, **kwargs)
 
     def delete(self, url, **kwargs):
-        return self._wrapper_kernel(requests_original.delete, "DELETE", url, **kwargs)
+        return self._wrapper_kernel("DELETE", url, **kwargs)
 
     def head(self, url, **kwargs):
-        return self._wrapper_kernel(requests_original.head, "HEAD", url, **kwargs)
+        kwargs.setdefault('allow_redirects', False)
+        return self._send("HEAD", url, **kwargs)
 
     def options(self, url, **kwargs):
-        return self._wrapper_kernel(requests_original.options, "OPTIONS", url, **kwargs)
+        return self._wrapper_kernel("OPTIONS", url, **kwargs)
+
+    def request(self, method: str, url: str, **kwargs):
+        method = method.upper()
+        if method == "HEAD":
+            kwargs.setdefault('allow_redirects', False)
+        return self._send(method, url, **kwargs)
+
+    def fetch_many(self, requests: Iterable, concurrency: int = 32, **kwargs) -> BatchFetch:
+        """
+        Runs many requests with bounded concurrency, each with the retries, validator and feedback of a single request.
+        :param requests: iterable of urls, (method, url), (method, url, kwargs) tuples or dicts with 'url',
+        an optional 'method' and request arguments. It is consumed lazily
+        :param concurrency: maximum number of requests in flight
+        :param kwargs: default request arguments for all requests
+        :return: iterable yielding a BatchResult per request in completion order, statistics are in its `stats`
+        """
+        return BatchFetch(self.request, requests, concurrency=concurrency, defaults=kwargs)
+
+    def map(self, urls: Iterable, method: str = "GET", concurrency: int = 32, **kwargs) -> BatchFetch:
+        """
+        Same as fetch_many with the same method and request arguments for all urls
+        """
+        return BatchFetch(self.request, urls, concurrency=concurrency, method=method, defaults=kwargs)
 
-    def _wrapper_kernel(self, method: Callable, req_type: str, url: str, **kwargs):
+    def _send(self, req_type: str, url: str, **kwargs):
+        if self.response_cache is not None and req_type in CACHEABLE_METHODS:
+            return self.response_cache.fetch(req_type, url, kwargs, self._wrapper_kernel)
+        return self._wrapper_kernel(req_type, url, **kwargs)
+
+    def _wrapper_kernel(self, req_type: str, url: str, **kwargs):
         current_retry = 1
+        host = urlsplit(url).hostname
+        host_health = self.proxy_core.proxy_pool.host_health
+        metrics = self.proxy_core.proxy_pool.metrics
+        hedge = self._hedge_policy is not None and req_type in HEDGEABLE_METHODS
+        race = self._race_unchecked > 0 and req_type in HEDGEABLE_METHODS
+        if hedge:
+            self._hedge_policy.request_started()
         try:
             while current_retry <= self.max_retries + 1 or self.max_retries == 0:
-                temp_proxy_obj = self.proxy_core.current_proxy(return_obj=True)
-                request_args = {
-                    'proxies': temp_proxy_obj.to_dict(),
-                    'timeout': self.max_timeout
-                }
-                request_args.update(kwargs)
-
+                if race and not self.proxy_core.proxy_pool.has_active_proxy:
+                    started = time.monotonic()
+                    raced = self._raced_attempt(req_type, url, host, kwargs)
+                    if raced is not None:
+                        proxy, res = raced
+                        if res is not None:
+                            if metrics.enabled:
+                                metrics.attempt(req_type, host, proxy, "ok", time.monotonic() - started)
+                                metrics.request_retries.observe(current_retry - 1)
+                            return res
+                        current_retry += 1
+                        continue
+                    # No unchecked proxy left, wait for the checker
+                temp_proxy_obj = self.proxy_core.acquire_proxy(host=host)
+                started = time.monotonic()
                 try:
-                    logger.debug("{} {} with arguments: {}".format(req_type, url, request_args))
-                    res = method(url, **request_args)
-                    temp_proxy_obj.response_time = res.elapsed.total_seconds()
+                    if hedge:
+                        proxy, res = self._hedged_attempt(req_type, url, host, temp_proxy_obj, kwargs)
+                    else:
+                        proxy, res = temp_proxy_obj, self._attempt(req_type, url, temp_proxy_obj, kwargs)
 
-                    if not self.__default_proxy_response_validator(res):  # If not valid response:
+                    if not self._is_valid(res, kwargs):  # If not valid response:
                         logger.debug("Validator noticed a invalid response")
-                        self.proxy_core.force_update(apply_cooldown=True)
+                        if metrics.enabled:
+                            metrics.attempt(req_type, host, proxy, "rejected", time.monotonic() - started)
+                        if proxy is temp_proxy_obj:
+                            self.proxy_core.force_update(blocked_host=host)
+                        else:
+                            host_health.report_blocked(proxy, host)
                     else:
+                        host_health.report_success(proxy, host, res.elapsed.total_seconds())
+                        if hedge:
+                            self._hedge_policy.record(res.elapsed.total_seconds())
+                        if metrics.enabled:
+                            metrics.attempt(req_type, host, proxy, "ok", time.monotonic() - started)
+                            metrics.request_retries.observe(current_retry - 1)
                         return res
 
-                except (requests_original.exceptions.Timeout,
-                        requests_original.exceptions.ProxyError,
-                        requests_original.exceptions.ConnectionError,
-                        ConnectionResetError,
-                        requests_original.exceptions.ChunkedEncodingError) as e:
-                    if type(e).__name__ == "ProxyError":
-                        temp_proxy_obj.report_request_failed()
-                    self.proxy_core.proxy_feedback(request_failure=True)
+                except REQUEST_ERRORS as e:
+                    if metrics.enabled:
+                        metrics.attempt(req_type, host, temp_proxy_obj, type(e).__name__, time.monotonic() - started)
+                    self._report_failure(temp_proxy_obj, host, e)
                     self.proxy_core.force_update()
                     logger.warning("{req_type} request failed with reason: {t}".format(req_type=req_type,
                                                                                        t=type(e).__name__))
@@ -98,11 +264,206 @@ class ProxyRoulette(object):
                         err.args = ('',)
                     raise
                 current_retry += 1
+            if metrics.enabled:
+                metrics.request_retries.observe(current_retry - 1)
             raise MaxRetriesExceeded('The maximum number of {}'
                                      ' retries per request has been exceeded'.format(self.max_retries))
         except KeyboardInterrupt:
             logger.error("Registered Keyboard Interrupt. Terminating all threads")
             self.proxy_core.proxy_pool.stop()
+            self._sessions.close_all()
+
+    def _attempt(self, req_type: str, url: str, proxy: ProxyObject, kwargs: Dict, record_latency: bool = True,
+                 handle: AttemptHandle = None):
+        """
+        Sends the request once through the given proxy, the request must have been admitted on it
+        :param handle: allows to abort the request from another thread
+        :return: the response, request errors are raised
+        """
+        request_args = {
+            'proxies': proxy.to_dict(),
+            'timeout': self.max_timeout
+        }
+        request_args.update(kwargs)
+        logger.debug("{} {} with arguments: {}".format(req_type, url, request_args))
+        session = self._sessions.get(proxy)
+        try:
+            if handle is None:
+                res = session.request(req_type, url, **request_args)
+            else:
+                with handle:
+                    res = session.request(req_type, url, **request_args)
+        finally:
+            proxy.end_request()
+        if record_latency:
+            proxy.response_time = res.elapsed.total_seconds()
+        return res
+
+    def _hedged_attempt(self, req_type: str, url: str, host: str, proxy: ProxyObject, kwargs: Dict):
+        """
+        Sends the request through the proxy from the calling thread and, if no response arrived within the hedge
+        delay, additionally through a second proxy from the hedge executor. The second proxy is selected on
+        the hedge executor as well, the timer thread only hands the hedge over. The first response wins,
+        the other attempt is aborted and recorded as slow.
+        :return: tuple of the proxy which answered first and its response. If all attempts fail,
+        the error of the first attempt is raised
+        """
+        policy = self._hedge_policy
+        primary = AttemptHandle()
+        lock = threading.Lock()
+        hedge = {}
+        # Holds the winning handle, or None once the first attempt failed and no hedge may be sent anymore
+        decided = []
+
+        def hedge_finished(future: concurrent.futures.Future):
+            if future.exception() is not None:
+                return
+            with lock:
+                if decided:
+                    return
+                decided.append(hedge['handle'])
+            primary.cancel()
+
+        def send_hedge():
+            with lock:
+                if decided:
+                    return
+                alternative = self.proxy_core.proxy_pool.get_proxy_nowait(host=host, exclude=proxy)
+                if alternative is None or not alternative.try_begin_request():
+                    return
+                if not policy.try_acquire():
+                    alternative.end_request()
+                    return
+                logger.debug(f"Hedging {req_type} {url} through {alternative}")
+                hedge.update(handle=AttemptHandle(), proxy=alternative, started=time.monotonic())
+                hedge['future'] = self._hedge_executor.submit(self._attempt, req_type, url, alternative, kwargs,
+                                                              False, hedge['handle'])
+            hedge['future'].add_done_callback(hedge_finished)
+
+        started = time.monotonic()
+        self._hedge_timer.schedule(policy.delay, self._hedge_executor.submit, send_hedge)
+        res, error = None, None
+        try:
+            res = self._attempt(req_type, url, proxy, kwargs, False, primary)
+        except REQUEST_ERRORS as e:
+            error = e
+        with lock:
+            if not decided:
+                decided.append(primary if res is not None else None)
+            winner = decided[0]
+
+        if winner is primary:
+            proxy.response_time = res.elapsed.total_seconds()
+            if 'future' in hedge:
+                hedge['proxy'].response_time = time.monotonic() - hedge['started']
+                hedge['handle'].cancel()
+                hedge['future'].add_done_callback(_close_abandoned)
+            return proxy, res
+
+        if winner is None:
+            # The first attempt failed, a hedge already sent may still answer
+            if 'future' not in hedge:
+                raise error
+            try:
+                hedge['future'].result()
+            except REQUEST_ERRORS as e:
+                self._report_failure(hedge['proxy'], host, e)
+                raise error
+            self._report_failure(proxy, host, error)
+            self.proxy_core.force_update()
+        else:
+            # The hedge answered first and aborted the first attempt
+            proxy.response_time = time.monotonic() - started
+            if res is not None:
+                res.close()
+
+        hedge_res = hedge['future'].result()
+        hedge['proxy'].response_time = hedge_res.elapsed.total_seconds()
+        policy.hedge_won()
+        return hedge['proxy'], hedge_res
+
+    def _raced_attempt(self, req_type: str, url: str, host: str, kwargs: Dict):
+        """
+        Sends the request through several unchecked proxies at once, used while no proxy is active.
+        The first valid response wins. Every attempt is handed back to the pool as the check of its proxy
+        once it finished, attempts still running when the winner arrived are abandoned.
+        :return: None if no unchecked proxy was available, otherwise a tuple of the winning proxy and its response,
+        both None if no attempt returned a valid response
+        """
+        pool = self.proxy_core.proxy_pool
+        candidates = pool.take_unchecked(self._race_unchecked)
+        if len(candidates) == 0:
+            return None
+        logger.debug(f"No active proxy, racing {req_type} {url} through {len(candidates)} unchecked proxies")
+        attempts = {}
+        for p in candidates:
+            p.begin_request()
+            f = self._race_executor.submit(self._race_one, req_type, url, host, p, kwargs)
+            f.add_done_callback(functools.partial(self._race_finished, p))
+            attempts[f] = p
+
+        pending = set(attempts)
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is not None:
+                    if not isinstance(f.exception(), REQUEST_ERRORS):
+                        raise f.exception()
+                    continue
+                res, valid = f.result()
+                if not valid:
+                    continue
+                for loser in pending:
+                    loser.add_done_callback(_close_abandoned_race)
+                return attempts[f], res
+        return None, None
+
+    def _race_one(self, req_type: str, url: str, host: str, proxy: ProxyObject, kwargs: Dict):
+        """
+        One attempt of a race through an unchecked proxy
+        :return: tuple of the response and whether the response validator accepted it, request errors are raised
+        """
+        try:
+            res = self._attempt(req_type, url, proxy, kwargs, record_latency=False)
+        except REQUEST_ERRORS:
+            self.proxy_core.proxy_pool.host_health.report_failure(proxy, host)
+            raise
+        if not self._is_valid(res, kwargs):
+            # The proxy works, it is only blocked by the host. The response is not used, its connection is released
+            self.proxy_core.proxy_pool.host_health.report_blocked(proxy, host)
+            res.close()
+            return res, False
+        self.proxy_core.proxy_pool.host_health.report_success(proxy, host, res.elapsed.total_seconds())
+        return res, True
+
+    def _race_finished(self, proxy: ProxyObject, future: concurrent.futures.Future):
+        pool = self.proxy_core.proxy_pool
+        error = future.exception()
+        if error is None:
+            pool.report_unchecked(proxy, True, future.result()[0].elapsed.total_seconds())
+        elif isinstance(error, REQUEST_ERRORS):
+            pool.report_unchecked(proxy, False)
+        else:
+            # Not caused by the proxy
+            pool.report_unchecked(proxy, None)
+
+    def _is_valid(self, res, kwargs: Dict) -> bool:
+        """
+        A 304 Not Modified answering a conditional request is always valid, validators checking the body
+        would reject it otherwise
+        """
+        if res.status_code == 304:
+            headers = requests_original.structures.CaseInsensitiveDict(kwargs.get('headers') or {})
+            if "If-None-Match" in headers or "If-Modified-Since" in headers:
+                return True
+        return self.__default_proxy_response_validator(res)
+
+    def _report_failure(self, proxy: ProxyObject, host: str, error: Exception):
+        if isinstance(error, requests_original.exceptions.Timeout):
+            proxy.report_request_failed(FailureKind.TIMEOUT)
+        else:
+            proxy.report_request_failed(FailureKind.PROXY_ERROR)
+        self.proxy_core.proxy_pool.host_health.report_failure(proxy, host)
 
     @staticmethod
     def proxy_pool_updater(func: Callable):
@@ -141,6 +502,10 @@ class ProxyRoulette(object):
     def max_timeout(self, value) -> int:
         self.proxy_core.max_timeout = value
 
+    @property
+    def metrics(self) -> Metrics:
+        return self.proxy_core.proxy_pool.metrics
+
     @property
     def max_retries(self) -> int:
         return self._max_retries
@@ -0,0 +1,47 @@
+import random
+from enum import Enum
+from typing import Dict
+
+
+class FailureKind(Enum):
+    TIMEOUT = 0
+    PROXY_ERROR = 1
+    CHECK_FAILED = 2
+    BLOCKED = 3
+
+
+class BackoffPolicy:
+    """
+    Cooldowns of the per-proxy circuit breaker. A failure opens the breaker for a cooldown which starts at
+    the base of the failure kind and doubles (factor) with every further consecutive failure, up to max_cooldown.
+    The cooldown is shortened by a random share of at most `jitter` so proxies failing together do not return
+    together. Once the cooldown expired the proxy is probed by the checker before it serves requests again,
+    after max_failures consecutive failures it is considered dead.
+    """
+    def __init__(self,
+                 base: Dict[FailureKind, float] = None,
+                 factor: float = 2.0,
+                 max_cooldown: float = 3600,
+                 jitter: float = 0.5,
+                 max_failures: int = 6):
+        self.base: Dict[FailureKind, float] = {
+            FailureKind.TIMEOUT: 5,
+            FailureKind.PROXY_ERROR: 30,
+            FailureKind.CHECK_FAILED: 60,
+            FailureKind.BLOCKED: 120,
+        }
+        if base is not None:
+            self.base.update(base)
+        self.factor: float = factor
+        self.max_cooldown: float = max_cooldown
+        self.jitter: float = jitter
+        self.max_failures: int = max_failures
+
+    def cooldown(self, kind: FailureKind, failures: int) -> float:
+        """
+        :param kind: kind of the latest failure
+        :param failures: consecutive failures including the latest one
+        :return: cooldown in seconds
+        """
+        cooldown = min(self.max_cooldown, self.base[kind] * self.factor ** max(0, failures - 1))
+        return cooldown * (1 - self.jitter * random.random())
@@ -0,0 +1,176 @@
+import collections
+import concurrent.futures
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, Tuple
+
+
+class BatchResult:
+    """
+    Outcome of one request of a batch: either a response or the error raised after all retries
+    """
+    __slots__ = ('request', 'method', 'url', 'response', 'error', 'elapsed')
+
+    def __init__(self, request: Any, method: str, url: str, response=None, error: Exception = None,
+                 elapsed: float = 0.0):
+        self.request = request
+        self.method: str = method
+        self.url: str = url
+        self.response = response
+        self.error: Exception = error
+        self.elapsed: float = elapsed
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        outcome = type(self.error).__name__ if self.error is not None else self.response
+        return f"BatchResult[{self.method} {self.url}|{outcome}]"
+
+
+class BatchStats:
+    """
+    Statistics of one batch. Only a bounded window of latencies is kept for the percentiles
+    """
+    def __init__(self, window: int = 4096):
+        self.submitted: int = 0
+        self.succeeded: int = 0
+        self.failed: int = 0
+        self.errors: collections.Counter = collections.Counter()
+        self.started: float = None
+        self.finished: float = None
+        self._latencies: collections.deque = collections.deque(maxlen=window)
+
+    def record(self, result: BatchResult):
+        if result.ok:
+            self.succeeded += 1
+            self._latencies.append(result.elapsed)
+        else:
+            self.failed += 1
+            self.errors[type(result.error).__name__] += 1
+
+    @property
+    def completed(self) -> int:
+        return self.succeeded + self.failed
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def requests_per_second(self) -> float:
+        elapsed = self.elapsed
+        return self.completed / elapsed if elapsed > 0 else 0.0
+
+    def latency_percentile(self, q: float) -> float:
+        """
+        :param q: percentile between 0 and 100
+        :return: latency of successful requests in seconds, 0 if none succeeded yet
+        """
+        if len(self._latencies) == 0:
+            return 0.0
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+    def as_dict(self) -> Dict:
+        return {
+            'submitted': self.submitted,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'errors': dict(self.errors),
+            'elapsed': self.elapsed,
+            'requests_per_second': self.requests_per_second,
+            'latency_p50': self.latency_percentile(50),
+            'latency_p99': self.latency_percentile(99),
+        }
+
+    def __repr__(self):
+        return (f"BatchStats[{self.completed}/{self.submitted}|ok: {self.succeeded}|failed: {self.failed}|"
+                f"{self.requests_per_second:.1f} req/s]")
+
+
+class BatchFetch:
+    """
+    Runs an iterable of requests with bounded concurrency and yields BatchResults in completion order.
+    The input is consumed lazily, at most `concurrency` requests are in flight or buffered at any time.
+    Requests may be given as url, (method, url), (method, url, kwargs) or dict with 'url' and optionally
+    'method' plus request arguments. Statistics are available through `stats` during and after iteration.
+    """
+    def __init__(self,
+                 func_request: Callable,
+                 requests: Iterable,
+                 concurrency: int = 32,
+                 method: str = "GET",
+                 defaults: Dict = None):
+        self._func_request: Callable = func_request
+        self._requests: Iterable = requests
+        self.concurrency: int = max(1, concurrency)
+        self.method: str = method
+        self.defaults: Dict = defaults or {}
+        self.stats: BatchStats = BatchStats()
+        self._started = threading.Event()
+
+    def _normalise(self, request) -> Tuple[str, str, Dict]:
+        if isinstance(request, str):
+            return self.method, request, dict(self.defaults)
+        if isinstance(request, dict):
+            kwargs = dict(self.defaults)
+            kwargs.update(request)
+            method = kwargs.pop('method', self.method)
+            return method, kwargs.pop('url'), kwargs
+        kwargs = dict(self.defaults)
+        if len(request) > 2:
+            kwargs.update(request[2])
+        return request[0], request[1], kwargs
+
+    def _run(self, request) -> BatchResult:
+        try:
+            method, url, kwargs = self._normalise(request)
+            method = method.upper()
+        except (TypeError, KeyError, IndexError, AttributeError) as e:
+            return BatchResult(request, None, None, error=e)
+        started = time.monotonic()
+        try:
+            res = self._func_request(method, url, **kwargs)
+        except Exception as e:
+            return BatchResult(request, method, url, error=e, elapsed=time.monotonic() - started)
+        return BatchResult(request, method, url, response=res, elapsed=time.monotonic() - started)
+
+    def __iter__(self) -> Iterator[BatchResult]:
+        if self._started.is_set():
+            raise RuntimeError("A BatchFetch can only be iterated once")
+        self._started.set()
+        self.stats.started = time.monotonic()
+
+        requests = iter(self._requests)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency,
+                                                         thread_name_prefix="pyproxyroulette-batch")
+        pending = set()
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < self.concurrency:
+                    try:
+                        request = next(requests)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending.add(executor.submit(self._run, request))
+                    self.stats.submitted += 1
+                if not pending:
+                    break
+
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for f in done:
+                    result = f.result()
+                    self.stats.record(result)
+                    yield result
+        finally:
+            # Closing the generator early abandons the requests which are still running
+            for f in pending:
+                f.cancel()
+            executor.shutdown(wait=False)
+            self.stats.finished = time.monotonic()
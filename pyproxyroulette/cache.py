@@ -0,0 +1,567 @@
+import datetime
+import email.utils
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+import requests as requests_original
+from requests.structures import CaseInsensitiveDict
+
+logger = logging.getLogger(__name__)
+
+# Methods whose responses are cached
+CACHEABLE_METHODS = ("GET", "HEAD")
+
+# Status codes which may be cached without explicit freshness information (RFC 9111 4.2.2)
+HEURISTIC_STATUS = (200, 203, 204, 300, 301, 308, 404, 405, 410, 414, 501)
+
+# Headers describing the transfer of the body, they do not apply to the decoded body which is stored
+_TRANSFER_HEADERS = ("content-encoding", "content-length", "transfer-encoding", "connection", "keep-alive")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    reason TEXT,
+    headers TEXT NOT NULL,
+    vary TEXT NOT NULL,
+    content BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    stored REAL NOT NULL,
+    expires REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+"""
+
+
+def _cache_control(value: str) -> Dict[str, str]:
+    """
+    :return: directives of a Cache-Control header, directives without argument map to an empty string
+    """
+    directives = {}
+    for part in (value or "").split(","):
+        name, _, argument = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = argument.strip().strip('"')
+    return directives
+
+
+def _http_date(value: str) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def _seconds(value: str) -> Optional[float]:
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def freshness_lifetime(status_code: int, headers, default_ttl: float = 0) -> float:
+    """
+    Seconds a response may be served from the cache without revalidation: max-age, else Expires,
+    else 10% of the time since Last-Modified for heuristically cacheable responses, else default_ttl.
+    The Age of the response is subtracted
+    :param headers: response headers, case insensitive
+    """
+    directives = _cache_control(headers.get("Cache-Control"))
+    if "no-cache" in directives:
+        return 0.0
+    lifetime = _seconds(directives.get("max-age"))
+    if lifetime is None:
+        expires, date = _http_date(headers.get("Expires")), _http_date(headers.get("Date"))
+        if headers.get("Expires") is not None:
+            # Invalid dates like "0" mean already expired
+            lifetime = max(0.0, expires - (date or time.time())) if expires is not None else 0.0
+    if lifetime is None and status_code in HEURISTIC_STATUS:
+        modified, date = _http_date(headers.get("Last-Modified")), _http_date(headers.get("Date"))
+        if modified is not None:
+            lifetime = min(24 * 3600.0, 0.1 * max(0.0, (date or time.time()) - modified))
+    if lifetime is None:
+        lifetime = default_ttl
+    return max(0.0, lifetime - (_seconds(headers.get("Age")) or 0.0))
+
+
+class CacheEntry:
+    """
+    A stored response. Points in time are on the wall clock, so entries of the disk tier survive restarts
+    """
+    __slots__ = ('url', 'status_code', 'reason', 'headers', 'vary', 'content', 'stored', 'expires', 'last_used')
+
+    def __init__(self,
+                 url: str,
+                 status_code: int,
+                 reason: str,
+                 headers: Dict[str, str],
+                 vary: Dict[str, str],
+                 content: bytes,
+                 stored: float,
+                 expires: float):
+        self.url: str = url
+        self.status_code: int = status_code
+        self.reason: str = reason
+        self.headers: CaseInsensitiveDict = CaseInsensitiveDict(headers)
+        # Values of the request headers named by the Vary header of the response
+        self.vary: Dict[str, str] = vary
+        self.content: bytes = content
+        self.stored: float = stored
+        self.expires: float = expires
+        self.last_used: float = stored
+
+    @classmethod
+    def from_response(cls, response, request_headers, default_ttl: float = 0) -> 'CacheEntry':
+        now = time.time()
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in _TRANSFER_HEADERS}
+        vary = {name: request_headers.get(name) for name in cls._vary_names(response.headers)}
+        return cls(response.url, response.status_code, response.reason, headers, vary, response.content, now,
+                   now + freshness_lifetime(response.status_code, response.headers, default_ttl))
+
+    @staticmethod
+    def _vary_names(headers) -> list:
+        return [n.strip().lower() for n in headers.get("Vary", "").split(",") if n.strip()]
+
+    @property
+    def size(self) -> int:
+        return len(self.content)
+
+    @property
+    def etag(self) -> str:
+        return self.headers.get("ETag")
+
+    @property
+    def last_modified(self) -> str:
+        return self.headers.get("Last-Modified")
+
+    @property
+    def storable(self) -> bool:
+        """
+        Whether the response may be stored at all. Responses without a freshness lifetime are only worth storing
+        if they can be revalidated
+        """
+        if "*" in self.vary or self.status_code in (206, 304):
+            return False
+        directives = _cache_control(self.headers.get("Cache-Control"))
+        if "no-store" in directives or "private" in directives:
+            # The cache is shared, responses meant for a single user are not stored
+            return False
+        if self.status_code not in HEURISTIC_STATUS:
+            return self.expires > self.stored
+        return self.expires > self.stored or self.etag is not None or self.last_modified is not None
+
+    def fresh(self, now: float = None) -> bool:
+        return (now or time.time()) < self.expires
+
+    def matches(self, request_headers) -> bool:
+        """
+        :return: True if the request sends the same values of the headers named by Vary as the stored request
+        """
+        return all(request_headers.get(name) == value for name, value in self.vary.items())
+
+    def revalidated(self, response, default_ttl: float = 0) -> 'CacheEntry':
+        """
+        :param response: 304 Not Modified response to a conditional request for this entry
+        :return: new entry with the headers updated from the response and a new freshness lifetime
+        """
+        headers = CaseInsensitiveDict(self.headers)
+        headers.update({k: v for k, v in response.headers.items() if k.lower() not in _TRANSFER_HEADERS})
+        now = time.time()
+        entry = CacheEntry(self.url, self.status_code, self.reason, headers, self.vary, self.content, now, now)
+        entry.expires = now + freshness_lifetime(self.status_code, entry.headers, default_ttl)
+        return entry
+
+    def to_response(self) -> requests_original.Response:
+        """
+        :return: a new response with the stored content, its attribute from_cache is True
+        """
+        response = requests_original.Response()
+        response.status_code = self.status_code
+        response.reason = self.reason
+        response.headers = CaseInsensitiveDict(self.headers)
+        response._content = self.content
+        response._content_consumed = True
+        response.url = self.url
+        response.encoding = requests_original.utils.get_encoding_from_headers(response.headers)
+        response.elapsed = datetime.timedelta(0)
+        response.from_cache = True
+        return response
+
+
+class DiskCache:
+    """
+    Disk tier of the ResponseCache in a SQLite file. At most max_bytes of content are kept, the least recently used
+    entries are evicted first. Entries stored more than max_age seconds ago are purged
+    """
+    def __init__(self, path: str, max_bytes: int = 1024 ** 3, max_age: float = 7 * 24 * 3600):
+        self.path: str = path
+        self.max_bytes: int = max_bytes
+        self.max_age: float = max_age
+        self.evictions: int = 0
+        self._lock = threading.Lock()
+        self._connection: sqlite3.Connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(_SCHEMA)
+        self._puts: int = 0
+        self.bytes: int = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.purge()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT url, status, reason, headers, vary, content, stored, expires FROM responses WHERE key = ?",
+                (key,)).fetchone()
+            if row is None:
+                return None
+            url, status, reason, headers, vary, content, stored, expires = row
+            if stored + self.max_age <= time.time():
+                self._delete(key)
+                return None
+            with self._connection:
+                self._connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        return CacheEntry(url, status, reason, json.loads(headers), json.loads(vary), content, stored, expires)
+
+    def put(self, key: str, entry: CacheEntry):
+        with self._lock:
+            previous = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            with self._connection:
+                self._connection.execute("INSERT OR REPLACE INTO responses VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+                                         (key, entry.url, entry.status_code, entry.reason,
+                                          json.dumps(dict(entry.headers)), json.dumps(entry.vary),
+                                          entry.content, entry.size, entry.stored, entry.expires, time.time()))
+            self.bytes += entry.size - (previous[0] if previous else 0)
+            self._puts += 1
+            if self.bytes > self.max_bytes:
+                self._evict()
+        if self._puts % 1024 == 0:
+            self.purge()
+
+    def discard(self, key: str):
+        with self._lock:
+            self._delete(key)
+
+    def purge(self) -> int:
+        """
+        Deletes all entries older than max_age
+        :return: number of deleted entries
+        """
+        with self._lock:
+            cutoff = time.time() - self.max_age
+            size, count = self._connection.execute(
+                "SELECT COALESCE(SUM(size), 0), COUNT(*) FROM responses WHERE stored <= ?", (cutoff,)).fetchone()
+            with self._connection:
+                self._connection.execute("DELETE FROM responses WHERE stored <= ?", (cutoff,))
+            self.bytes -= size
+            self.evictions += count
+            return count
+
+    def clear(self):
+        with self._lock:
+            with self._connection:
+                self._connection.execute("DELETE FROM responses")
+            self.bytes = 0
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _delete(self, key: str):
+        row = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return
+        with self._connection:
+            self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+        self.bytes -= row[0]
+        self.evictions += 1
+
+    def _evict(self):
+        # Frees a tenth of the capacity at once, so not every put evicts
+        target = 0.9 * self.max_bytes
+        rows = self._connection.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall()
+        evicted = []
+        for key, size in rows:
+            if self.bytes <= target:
+                break
+            evicted.append((key,))
+            self.bytes -= size
+        with self._connection:
+            self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self.evictions += len(evicted)
+
+
+class _Flight:
+    """
+    A fetch in progress which identical requests wait for instead of sending their own
+    """
+    def __init__(self):
+        self._done = threading.Event()
+        self._entry: CacheEntry = None
+        self._error: BaseException = None
+
+    def finish(self, entry: CacheEntry = None, error: BaseException = None):
+        self._entry, self._error = entry, error
+        self._done.set()
+
+    def wait(self) -> requests_original.Response:
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._entry.to_response()
+
+
+class ResponseCache:
+    """
+    Cache of GET and HEAD responses shared by all threads of a ProxyRoulette, so repeated requests for the same
+    url do not occupy a proxy. Responses are kept in memory (least recently used evicted first once the content
+    exceeds max_bytes) and, if path is given, in a SQLite file on disk as second tier.
+
+    Responses are served while they are fresh according to their Cache-Control or Expires headers, default_ttl
+    applies to responses without any. Stale responses with an ETag or Last-Modified header are revalidated with
+    a conditional request, a 304 Not Modified renews them. Entries are evicted max_age seconds after they were
+    stored or last revalidated. Requests for the same url with the same headers which arrive while it is being
+    fetched wait for that fetch instead of sending their own.
+    Requests with a body, streamed requests, requests sending Cache-Control: no-store and requests carrying
+    credentials or cookies bypass the cache, responses marked private are not stored.
+    """
+    def __init__(self,
+                 max_bytes: int = 64 * 1024 ** 2,
+                 max_entry_bytes: int = None,
+                 max_age: float = 24 * 3600,
+                 default_ttl: float = 0,
+                 path: str = None,
+                 max_disk_bytes: int = 1024 ** 3):
+        self.max_bytes: int = max_bytes
+        self.max_entry_bytes: int = max_entry_bytes if max_entry_bytes is not None else max_bytes // 8
+        self.max_age: float = max_age
+        self.default_ttl: float = default_ttl
+        self.disk: DiskCache = DiskCache(path, max_bytes=max_disk_bytes, max_age=max_age) \
+            if path is not None else None
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes: int = 0
+        self._flights: Dict[Tuple, _Flight] = {}
+        self._lock = threading.Lock()
+
+        # Statistics
+        self.hits: int = 0
+        self.memory_hits: int = 0
+        self.disk_hits: int = 0
+        self.misses: int = 0
+        self.revalidations: int = 0
+        self.not_modified: int = 0
+        self.coalesced: int = 0
+        self.bypassed: int = 0
+        self.stores: int = 0
+        self.evictions: int = 0
+
+    def fetch(self, method: str, url: str, kwargs: Dict, send: Callable) -> requests_original.Response:
+        """
+        Answers the request from the cache or sends it with send and stores the response
+        :param method: request method
+        :param url: request url
+        :param kwargs: request arguments
+        :param send: function called as send(method, url, **kwargs) to fetch the response
+        :return: response, responses served from the cache have the attribute from_cache set to True
+        """
+        key = self.key(method, url, kwargs)
+        request_headers = CaseInsensitiveDict(kwargs.get('headers') or {})
+        directives = _cache_control(request_headers.get("Cache-Control"))
+        if key is None or "no-store" in directives:
+            with self._lock:
+                self.bypassed += 1
+            return send(method, url, **kwargs)
+
+        entry, tier = self._lookup(key, request_headers)
+        if entry is not None and entry.fresh() and "no-cache" not in directives and directives.get("max-age") != "0":
+            with self._lock:
+                self.hits += 1
+                if tier == "memory":
+                    self.memory_hits += 1
+                else:
+                    self.disk_hits += 1
+            return entry.to_response()
+
+        flight_key = (key, tuple(sorted((k.lower(), v) for k, v in request_headers.items())))
+        with self._lock:
+            flight = self._flights.get(flight_key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[flight_key] = _Flight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return flight.wait()
+
+        try:
+            response, shared = self._fetch(method, url, kwargs, key, request_headers, entry, send)
+            flight.finish(entry=shared)
+            return response
+        except BaseException as e:
+            flight.finish(error=e)
+            raise
+        finally:
+            with self._lock:
+                del self._flights[flight_key]
+
+    def _fetch(self, method: str, url: str, kwargs: Dict, key: str, request_headers, entry: CacheEntry,
+               send: Callable) -> Tuple[requests_original.Response, CacheEntry]:
+        """
+        Sends the request, conditionally if a stale entry can be revalidated
+        :return: tuple of the response for the caller and the entry to answer coalesced requests with
+        """
+        conditional = entry is not None and (entry.etag is not None or entry.last_modified is not None)
+        if conditional:
+            headers = CaseInsensitiveDict(request_headers)
+            if entry.etag is not None:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified is not None:
+                headers["If-Modified-Since"] = entry.last_modified
+            kwargs = dict(kwargs, headers=headers)
+            with self._lock:
+                self.revalidations += 1
+        else:
+            with self._lock:
+                self.misses += 1
+
+        response = send(method, url, **kwargs)
+        if conditional and response.status_code == 304:
+            entry = entry.revalidated(response, self.default_ttl)
+            with self._lock:
+                self.not_modified += 1
+            self.put(key, entry)
+            return entry.to_response(), entry
+
+        fetched = CacheEntry.from_response(response, request_headers, self.default_ttl)
+        if fetched.storable and fetched.size <= self.max_entry_bytes:
+            self.put(key, fetched)
+        elif entry is not None:
+            self.discard(key)
+        return response, fetched
+
+    @staticmethod
+    def key(method: str, url: str, kwargs: Dict) -> Optional[str]:
+        """
+        :return: cache key of the request or None if it must not be answered from the cache
+        """
+        method = method.upper()
+        if method not in CACHEABLE_METHODS or kwargs.get('stream') or \
+                any(kwargs.get(k) is not None for k in ('data', 'json', 'files', 'auth')) or kwargs.get('cookies'):
+            return None
+        headers = CaseInsensitiveDict(kwargs.get('headers') or {})
+        if "Authorization" in headers or "Cookie" in headers:
+            # Responses to authenticated requests must not be served to other callers
+            return None
+        prepared = requests_original.models.PreparedRequest()
+        prepared.prepare_url(url, kwargs.get('params'))
+        if urlsplit(prepared.url).username is not None:
+            return None
+        redirects = kwargs.get('allow_redirects', method != "HEAD")
+        return f"{method} {prepared.url}" + ("" if redirects else " noredirect")
+
+    def get(self, key: str, request_headers=None) -> Optional[CacheEntry]:
+        """
+        :return: the entry stored for key, looked up in memory first and then on disk, or None.
+        Entries stored for other values of the headers named by Vary are not returned
+        """
+        return self._lookup(key, CaseInsensitiveDict(request_headers or {}))[0]
+
+    def _lookup(self, key: str, request_headers) -> Tuple[Optional[CacheEntry], str]:
+        """
+        :return: tuple of the entry or None and the tier it was found in, "memory" or "disk"
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.stored + self.max_age <= now:
+                self._remove(key)
+                self.evictions += 1
+                entry = None
+            if entry is not None:
+                if not entry.matches(request_headers):
+                    return None, "memory"
+                self._entries.move_to_end(key)
+                entry.last_used = now
+                return entry, "memory"
+        if self.disk is None:
+            return None, "disk"
+        try:
+            entry = self.disk.get(key)
+        except sqlite3.Error as e:
+            logger.error(f"Could not read response from {self.disk.path}. {e}")
+            return None, "disk"
+        if entry is None or not entry.matches(request_headers):
+            return None, "disk"
+        self._put_memory(key, entry)
+        return entry, "disk"
+
+    def put(self, key: str, entry: CacheEntry):
+        self._put_memory(key, entry)
+        with self._lock:
+            self.stores += 1
+        if self.disk is not None:
+            try:
+                self.disk.put(key, entry)
+            except sqlite3.Error as e:
+                logger.error(f"Could not store response in {self.disk.path}. {e}")
+
+    def discard(self, key: str):
+        with self._lock:
+            self._remove(key)
+        if self.disk is not None:
+            self.disk.discard(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+        if self.disk is not None:
+            self.disk.clear()
+
+    def _put_memory(self, key: str, entry: CacheEntry):
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses + self.revalidations
+        return self.hits / lookups if lookups else 0.0
+
+    @property
+    def stats(self) -> Dict:
+        return {
+            'hits': self.hits,
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'revalidations': self.revalidations,
+            'not_modified': self.not_modified,
+            'coalesced': self.coalesced,
+            'bypassed': self.bypassed,
+            'stores': self.stores,
+            'evictions': self.evictions + (self.disk.evictions if self.disk is not None else 0),
+            'entries': len(self._entries),
+            'memory_bytes': self._bytes,
+            'disk_bytes': self.disk.bytes if self.disk is not None else 0,
+        }
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
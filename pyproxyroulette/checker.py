@@ -0,0 +1,269 @@
+from .proxy import ProxyObject
+import collections
+import threading
+import time
+import logging
+from typing import Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes of the checker: new proxies and probes after a cooldown are checked before re-checks
+LANE_NEW = 0
+LANE_RECHECK = 1
+
+
+class ProxyChecker:
+    """
+    Long-lived liveliness checking engine. A fixed number of worker threads pull proxies from two priority lanes,
+    check them and publish each result as soon as it is available, so a slow check only occupies one worker.
+
+    At most `limit` checks run at once. If adaptive, a controller adjusts the limit every control_interval seconds:
+    it grows while proxies are waiting and all running checks are busy, and shrinks when the latency of successful
+    checks rises well above its baseline or the share of failed checks jumps, both signs of local saturation.
+    Running requests (ProxyObject.requests_in_flight) take precedence, each one lowers the limit by load_share.
+    Optionally the checks per second are capped by a token bucket.
+    """
+    def __init__(self,
+                 func_check: Callable[[ProxyObject], bool],
+                 func_publish: Callable[[ProxyObject], None],
+                 concurrency: int = 50,
+                 rate_window: int = 60,
+                 min_concurrency: int = 4,
+                 max_checks_per_second: float = None,
+                 adaptive: bool = True,
+                 load_share: float = 0.5,
+                 recheck_share: int = 4,
+                 control_interval: float = 1.0):
+        self._check: Callable = func_check
+        self._publish: Callable = func_publish
+        self._concurrency: int = concurrency
+        self.min_concurrency: int = min(min_concurrency, concurrency)
+        self.limit: int = concurrency if not adaptive else max(self.min_concurrency, concurrency // 2)
+        self.adaptive: bool = adaptive
+        self.load_share: float = load_share
+        # Every recheck_share-th check is taken from the re-check lane even if new proxies are waiting
+        self.recheck_share: int = recheck_share
+        self.control_interval: float = control_interval
+        self.latency_tolerance: float = 2.0
+
+        self._lanes = (collections.deque(), collections.deque())
+        self._lock = threading.Lock()
+        self._work = threading.Condition(self._lock)
+        self._space = threading.Condition(self._lock)
+        self._workers: List[threading.Thread] = []
+        self._controller: threading.Thread = None
+        self._stopped: bool = False
+        self._taken: int = 0
+
+        # Token bucket of the rate cap
+        self.max_checks_per_second: float = max_checks_per_second
+        self._tokens: float = 1.0
+        self._tokens_updated: float = time.monotonic()
+        self._bucket_lock = threading.Lock()
+
+        # Observations of the current control interval and their long-term averages
+        self._interval_latencies: List[float] = []
+        self._interval_checks: int = 0
+        self._interval_failures: int = 0
+        self._saturated: bool = False
+        self.latency: float = None
+        self.latency_baseline: float = None
+        self.error_rate: float = None
+
+        # Statistics
+        self._in_flight: int = 0
+        self.checks_total: int = 0
+        self.checks_succeeded: int = 0
+        self._rate_window: int = rate_window
+        self._completions: collections.deque = collections.deque()
+
+    def start(self):
+        self._stopped = False
+        self._workers = [w for w in self._workers if w.is_alive()]
+        while len(self._workers) < self._concurrency:
+            w = threading.Thread(target=self._worker)
+            w.setDaemon(True)
+            w.start()
+            self._workers.append(w)
+        if self.adaptive and (self._controller is None or not self._controller.is_alive()):
+            self._controller = threading.Thread(target=self._control_worker)
+            self._controller.setDaemon(True)
+            self._controller.start()
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._work.notify_all()
+            self._space.notify_all()
+        for w in self._workers:
+            w.join()
+        if self._controller is not None:
+            self._controller.join()
+
+    def submit(self, proxy: ProxyObject, timeout: float = None, lane: int = LANE_NEW) -> bool:
+        """
+        Queues a proxy for checking. Blocks while the lane is full
+        :param proxy: proxy object to check
+        :param timeout: seconds to wait for a free queue slot, None to wait indefinitely
+        :param lane: LANE_NEW or LANE_RECHECK
+        :return: True if the proxy was queued
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while len(self._lanes[lane]) >= self._concurrency and not self._stopped:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._space.wait(remaining)
+            self._lanes[lane].append(proxy)
+            self._work.notify()
+        return True
+
+    def wait_for_space(self, timeout: float = None) -> int:
+        """
+        Blocks until the lanes have room for at least one more proxy
+        :param timeout: seconds to wait, None to wait indefinitely
+        :return: number of free slots, 0 if the timeout passed or the checker was stopped
+        """
+        with self._lock:
+            if self.free_slots == 0 and not self._stopped:
+                self._space.wait_for(lambda: self.free_slots > 0 or self._stopped, timeout)
+            return self.free_slots if not self._stopped else 0
+
+    @property
+    def free_slots(self) -> int:
+        return max(0, self._concurrency - len(self._lanes[LANE_NEW]) - len(self._lanes[LANE_RECHECK]))
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def effective_limit(self) -> int:
+        """
+        Limit of concurrent checks after subtracting the share of the running requests
+        """
+        reserved = int(self.load_share * ProxyObject.requests_in_flight)
+        return max(self.min_concurrency, min(self.limit, self._concurrency) - reserved)
+
+    @property
+    def setpoints(self) -> Dict:
+        return {
+            'limit': self.limit,
+            'effective_limit': self.effective_limit,
+            'min_concurrency': self.min_concurrency,
+            'max_concurrency': self._concurrency,
+            'max_checks_per_second': self.max_checks_per_second,
+            'in_flight': self._in_flight,
+            'queued_new': len(self._lanes[LANE_NEW]),
+            'queued_recheck': len(self._lanes[LANE_RECHECK]),
+            'requests_in_flight': ProxyObject.requests_in_flight,
+            'latency': self.latency,
+            'latency_baseline': self.latency_baseline,
+            'error_rate': self.error_rate,
+        }
+
+    @property
+    def checks_per_second(self) -> float:
+        with self._lock:
+            self._expire_completions(time.monotonic())
+            return len(self._completions) / self._rate_window
+
+    def _expire_completions(self, now: float):
+        while self._completions and self._completions[0] < now - self._rate_window:
+            self._completions.popleft()
+
+    def _next(self) -> ProxyObject:
+        new, recheck = self._lanes
+        self._taken += 1
+        if recheck and (not new or self._taken % self.recheck_share == 0):
+            return recheck.popleft()
+        return new.popleft()
+
+    def _take_token(self):
+        while self.max_checks_per_second:
+            with self._bucket_lock:
+                now = time.monotonic()
+                rate = self.max_checks_per_second
+                self._tokens = min(max(1.0, rate), self._tokens + (now - self._tokens_updated) * rate)
+                self._tokens_updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / rate
+            time.sleep(wait)
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                while not self._stopped and \
+                        (self._in_flight >= self.effective_limit or not (self._lanes[0] or self._lanes[1])):
+                    self._work.wait(1)
+                if self._stopped:
+                    return
+                proxy = self._next()
+                self._in_flight += 1
+                if self._in_flight >= self.effective_limit:
+                    self._saturated = True
+                self._space.notify_all()
+
+            self._take_token()
+            started = time.monotonic()
+            try:
+                result = self._check(proxy)
+            except Exception as e:
+                logger.error(f"An unexpected error occured while checking {proxy}. {e}")
+                result = False
+            duration = time.monotonic() - started
+            try:
+                self._publish(proxy)
+            except Exception as e:
+                logger.error(f"An unexpected error occured while publishing {proxy}. {e}")
+            with self._lock:
+                self._in_flight -= 1
+                self.checks_total += 1
+                self._interval_checks += 1
+                if result:
+                    self.checks_succeeded += 1
+                    self._interval_latencies.append(duration)
+                else:
+                    self._interval_failures += 1
+                now = time.monotonic()
+                self._completions.append(now)
+                self._expire_completions(now)
+                self._work.notify()
+
+    def _control_worker(self):
+        while not self._stopped:
+            time.sleep(self.control_interval)
+            with self._lock:
+                self._adjust()
+
+    def _adjust(self):
+        checks, failures = self._interval_checks, self._interval_failures
+        latencies = sorted(self._interval_latencies)
+        saturated = self._saturated or self._in_flight >= self.effective_limit
+        backlog = len(self._lanes[LANE_NEW]) + len(self._lanes[LANE_RECHECK]) > 0
+        self._interval_checks, self._interval_failures = 0, 0
+        self._interval_latencies = []
+        self._saturated = False
+
+        overloaded = False
+        if latencies:
+            latency = latencies[len(latencies) // 2]
+            self.latency = latency if self.latency is None else 0.7 * self.latency + 0.3 * latency
+            # The baseline follows decreases at once and increases slowly
+            self.latency_baseline = latency if self.latency_baseline is None else \
+                min(latency, self.latency_baseline * 1.02)
+            overloaded = self.latency > self.latency_tolerance * self.latency_baseline
+        if checks >= 20:
+            error_rate = failures / checks
+            if self.error_rate is not None and error_rate > self.error_rate + 0.25:
+                overloaded = True
+            self.error_rate = error_rate if self.error_rate is None else 0.9 * self.error_rate + 0.1 * error_rate
+
+        if overloaded:
+            self.limit = max(self.min_concurrency, int(self.limit * 0.75))
+        elif backlog and saturated:
+            self.limit = min(self._concurrency, self.limit + max(1, self.limit // 10))
+            self._work.notify(self.limit)
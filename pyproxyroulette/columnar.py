@@ -0,0 +1,376 @@
+from .defaults import defaults
+from .proxy import ProxyObject, ProxyState
+from .pool import ProxyPool, _batches
+from .selection import SelectionStrategy
+import threading
+import time
+import warnings
+import logging
+from typing import Callable, Dict, Iterable, List, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+_STATES: List[ProxyState] = sorted(ProxyState, key=lambda s: s.value)
+_COLUMNS = ('port', 'max_timeout', 'last_checked', 'fails', 'max_fails', 'cooldown_until', 'died_at',
+            'to_be_removed', 'response_counter', 'ewma', 'ewma_updated', 'samples', 'sample_pos', 'tail',
+            'state', 'deleted')
+_OPTIONAL_COLUMNS = ('last_checked', 'cooldown_until', 'died_at', 'ewma', 'ewma_updated', 'tail')
+
+
+class ProxyTable:
+    """
+    Statistics of many proxies kept in parallel numpy arrays, one row per proxy.
+    Points in time are monotonic timestamps, NaN stands for "not set".
+    Writes through views take the lock of the table, so they are not lost while the arrays are grown.
+    Rows of deleted proxies are reused, views still referring to them are detached first.
+    """
+    def __init__(self, capacity: int = 1024):
+        if np is None:
+            raise ImportError("ProxyTable requires numpy. Install it with 'pip install pyproxyroulette[columnar]'")
+        self._lock = threading.RLock()
+        self._size: int = 0
+        self._keys: Dict[Tuple[str, int], int] = {}
+        # Rows of deleted proxies, reused by extend
+        self._free: List[int] = []
+        self.ip: List[str] = []
+        self.port = np.zeros(capacity, dtype=np.uint16)
+        self.max_timeout = np.zeros(capacity, dtype=np.float32)
+        self.last_checked = np.full(capacity, np.nan)
+        self.fails = np.zeros(capacity, dtype=np.int32)
+        self.max_fails = np.zeros(capacity, dtype=np.int32)
+        self.cooldown_until = np.full(capacity, np.nan)
+        self.died_at = np.full(capacity, np.nan)
+        self.to_be_removed = np.zeros(capacity, dtype=bool)
+        self.response_counter = np.zeros(capacity, dtype=np.int64)
+        self.ewma = np.full(capacity, np.nan)
+        self.ewma_updated = np.full(capacity, np.nan)
+        # Encoded like ProxyObject samples: milliseconds + 1, 0 marks an empty slot
+        self.samples = np.zeros((capacity, ProxyObject.latency_samples), dtype=np.uint16)
+        self.sample_pos = np.zeros(capacity, dtype=np.int32)
+        self.tail = np.full(capacity, np.nan)
+        self.state = np.zeros(capacity, dtype=np.int8)
+        self.deleted = np.zeros(capacity, dtype=bool)
+
+    def __len__(self) -> int:
+        return self._size - len(self._free)
+
+    def extend(self, proxies: Iterable[Tuple], max_timeout: int = 8, max_fails: int = None) -> List[int]:
+        """
+        Adds proxies given as (ip, port, init_responsetime) tuples to free rows or appends them.
+        Proxies already in the table and malformed entries are skipped
+        :return: rows of the added proxies
+        """
+        entries = []
+        for p in proxies:
+            try:
+                key = (str(p[0]).strip(" "), int(p[1]))
+                assert (0 <= key[1] <= 65535)
+                response_time = float(p[2]) if len(p) > 2 and p[2] else 0.0
+            except (ValueError, TypeError, IndexError, AssertionError):
+                logger.debug(f"Skipping malformed proxy entry {p}")
+                continue
+            entries.append((key, response_time))
+
+        with self._lock:
+            ips, ports, response_times = [], [], []
+            for key, response_time in entries:
+                if key in self._keys:
+                    continue
+                self._keys[key] = -1
+                ips.append(key[0])
+                ports.append(key[1])
+                response_times.append(response_time)
+
+            reused = [self._free.pop() for _ in range(min(len(self._free), len(ips)))]
+            start, end = self._size, self._size + len(ips) - len(reused)
+            self._reserve(end)
+            rows = np.asarray(reused + list(range(start, end)), dtype=np.intp)
+            self._clear(rows)
+            self.ip.extend(ips[len(reused):])
+            for row, ip, port in zip(rows.tolist(), ips, ports):
+                self.ip[row] = ip
+                self._keys[(ip, port)] = row
+
+            rt = np.asarray(response_times, dtype=float)
+            self.port[rows] = ports
+            self.max_timeout[rows] = max_timeout
+            self.max_fails[rows] = ProxyObject.backoff.max_failures if max_fails is None else max_fails
+            known = rt != 0
+            self.response_counter[rows] = known
+            self.ewma[rows] = np.where(known, rt, np.nan)
+            self.ewma_updated[rows] = np.where(known, time.monotonic(), np.nan)
+            self.samples[rows, 0] = np.where(known, np.minimum(65535, rt * 1000 + 1), 0)
+            self.sample_pos[rows] = known
+            self.tail[rows] = np.where(known, rt, np.nan)
+            self.state[rows] = np.where(rt != 0, ProxyState.ACTIVE.value, ProxyState.UNKNOWN.value)
+            self._size = end
+            return rows.tolist()
+
+    def row_of(self, ip: str, port: int) -> int:
+        return self._keys.get((str(ip).strip(" "), int(port)), -1)
+
+    def delete(self, row: int, view: 'ProxyRow' = None):
+        """
+        Excludes the row from all statistics and frees it for reuse
+        :param view: view of the row which may outlive the proxy, it is moved to a private copy of the row
+        """
+        with self._lock:
+            if self.deleted[row]:
+                return
+            if view is not None and view._table is self:
+                copy = ProxyTable(capacity=1)
+                for name in _COLUMNS:
+                    getattr(copy, name)[0] = getattr(self, name)[row]
+                copy.ip.append(self.ip[row])
+                copy._size = 1
+                view._table, view._row = copy, 0
+            self.deleted[row] = True
+            self._keys.pop((self.ip[row], int(self.port[row])), None)
+            self._free.append(row)
+
+    def _clear(self, rows):
+        for name in _COLUMNS:
+            getattr(self, name)[rows] = np.nan if name in _OPTIONAL_COLUMNS else 0
+
+    def _reserve(self, size: int):
+        capacity = len(self.port)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name in _COLUMNS:
+            old = getattr(self, name)
+            shape = (capacity,) + old.shape[1:]
+            if name in _OPTIONAL_COLUMNS:
+                new = np.full(shape, np.nan, dtype=old.dtype)
+            else:
+                new = np.zeros(shape, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def states(self, now: float = None):
+        """
+        Vectorised ProxyObject.state over all rows, expired cooldowns are resolved on the fly
+        :return: int8 array of ProxyState values, deleted rows are -1
+        """
+        n = self._size
+        now = time.monotonic() if now is None else now
+        codes = self.state[:n].copy()
+        expired = (codes == ProxyState.COOLDOWN.value) & (self.cooldown_until[:n] <= now)
+        codes[expired] = np.where(self.response_counter[:n][expired] == 0,
+                                  ProxyState.UNKNOWN.value,
+                                  ProxyState.ACTIVE.value)
+        codes[self.deleted[:n]] = -1
+        return codes
+
+    def summary(self) -> Dict[ProxyState, int]:
+        counts = np.bincount(self.states() + 1, minlength=len(_STATES) + 1)
+        return {s: int(counts[s.value + 1]) for s in _STATES}
+
+    def response_times(self):
+        n = self._size
+        return np.where(self.response_counter[:n] != 0, self.ewma[:n], 0.0)
+
+    def ranking_latencies(self):
+        """
+        Vectorised ProxyObject.ranking_latency over all rows
+        """
+        rt = self.response_times()
+        tail = self.tail[:self._size]
+        raised = rt + ProxyObject.tail_weight * (tail - rt)
+        return np.where(tail > rt, raised, rt)
+
+    def latency_percentiles(self, percentile: float):
+        """
+        Vectorised ProxyObject.latency_percentile over all rows, NaN for rows without samples
+        """
+        n = self._size
+        samples = np.where(self.samples[:n] != 0, (self.samples[:n].astype(float) - 1) / 1000, np.nan)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # All-NaN rows
+            return np.nanpercentile(samples, percentile, axis=1, method="lower")
+
+    def ranked(self, limit: int = None) -> List[int]:
+        """
+        Rows of the ACTIVE proxies ordered by their ranking latency, fastest first
+        :param limit: number of rows to return, all if None
+        """
+        rows = np.flatnonzero(self.states() == ProxyState.ACTIVE.value)
+        rt = self.ranking_latencies()[rows]
+        if limit is not None and limit < len(rows):
+            part = np.argpartition(rt, limit)[:limit]
+            rows, rt = rows[part], rt[part]
+        return rows[np.argsort(rt, kind="stable")].tolist()
+
+
+def _column(name: str, convert: Callable, optional: bool = False) -> property:
+    def fget(self):
+        value = getattr(self._table, name)[self._row]
+        if optional and value != value:  # NaN
+            return None
+        return convert(value)
+
+    def fset(self, value):
+        with self._table._lock:
+            getattr(self._table, name)[self._row] = np.nan if value is None else value
+
+    return property(fget, fset)
+
+
+class ProxyRow(ProxyObject):
+    """
+    ProxyObject whose statistics live in a row of a ProxyTable.
+    Behaves like a ProxyObject for pools, validators and the request path.
+    """
+    __slots__ = ('_table', '_row')
+
+    def __init__(self, table: ProxyTable, row: int):
+        self._table: ProxyTable = table
+        self._row: int = row
+        self._observer: Callable = None
+        self.in_flight: int = 0
+        self._tokens: float = None
+        self._tokens_updated: float = None
+
+    @property
+    def ip(self) -> str:
+        return self._table.ip[self._row]
+
+    port = _column('port', int)
+    _max_timeout = _column('max_timeout', float)
+    last_checked = _column('last_checked', float, optional=True)
+    counter_consequtive_request_fails = _column('fails', int)
+    max_c_request_fails = _column('max_fails', int)
+    cooldown_until = _column('cooldown_until', float, optional=True)
+    died_at = _column('died_at', float, optional=True)
+    to_be_removed = _column('to_be_removed', bool)
+    _response_counter = _column('response_counter', int)
+    _ewma = _column('ewma', float, optional=True)
+    _ewma_updated = _column('ewma_updated', float, optional=True)
+    _sample_pos = _column('sample_pos', int)
+    _tail = _column('tail', float, optional=True)
+
+    def _record_latency(self, value: float):
+        # The samples are written through a view of the row, which must not be replaced meanwhile
+        with self._table._lock:
+            super()._record_latency(value)
+
+    @property
+    def _samples(self):
+        return self._table.samples[self._row]
+
+    @_samples.setter
+    def _samples(self, value):
+        with self._table._lock:
+            self._table.samples[self._row] = 0 if value is None else value
+
+    @property
+    def _state(self) -> ProxyState:
+        return _STATES[self._table.state[self._row]]
+
+    @_state.setter
+    def _state(self, value: ProxyState):
+        with self._table._lock:
+            self._table.state[self._row] = value.value
+
+
+class ColumnarProxyPool(ProxyPool):
+    """
+    ProxyPool keeping the statistics of all proxies in a ProxyTable.
+    Bulk ingest, the state summary and the ranking are single vectorised passes over the table.
+    """
+    def __init__(self,
+                 func_proxy_validator: Callable = defaults.proxy_echo_check,
+                 max_timeout: int = 8,
+                 check_concurrency: int = 50,
+                 max_checks_per_second: float = None,
+                 selection_strategy: SelectionStrategy = None):
+        self.table: ProxyTable = ProxyTable()
+        # View of every row, indexed by row, None for free rows
+        self._views: List[ProxyRow] = []
+        super().__init__(func_proxy_validator=func_proxy_validator,
+                         max_timeout=max_timeout,
+                         check_concurrency=check_concurrency,
+                         max_checks_per_second=max_checks_per_second,
+                         selection_strategy=selection_strategy)
+
+    def add(self, ip: str, port: int, init_responsetime: int = 0):
+        self.add_many([(ip, port, init_responsetime)])
+
+    def add_many(self, proxies: Iterable[Tuple], batch_size: int = 65536) -> int:
+        """
+        Adds proxies given as (ip, port) or (ip, port, init_responsetime) tuples. Known proxies are skipped.
+        The iterable is consumed lazily, the pool is locked once per batch
+        :return: number of added proxies
+        """
+        added = 0
+        for batch in _batches(proxies, batch_size):
+            self._acquire()
+            try:
+                views = self._create_views(self.table.extend(batch, max_timeout=self._max_timeout))
+                for v in views:
+                    v._observer = self._proxy_changed
+                    self.pool_inactive[v] = None
+                    self._due[v] = None
+            finally:
+                self._lock.release()
+            self._inactive_added.set()
+            added += len(views)
+        return added
+
+    def _restored_proxies(self, records: Iterable[Tuple[str, int, Dict]]):
+        fields = {(str(ip).strip(" "), int(port)): f for ip, port, f in records}
+        self._acquire()
+        try:
+            # Only proxies unknown to the table get a row
+            views = self._create_views(self.table.extend(((ip, port, 0) for ip, port in fields),
+                                                         max_timeout=self._max_timeout))
+        finally:
+            self._lock.release()
+        for v in views:
+            yield v, fields[(v.ip, v.port)]
+
+    def _create_views(self, rows: List[int]) -> List[ProxyRow]:
+        """
+        Creates the views of new rows, must be called with the lock held
+        """
+        views = [ProxyRow(self.table, r) for r in rows]
+        if rows and max(rows) >= len(self._views):
+            self._views.extend([None] * (max(rows) + 1 - len(self._views)))
+        for v in views:
+            self._views[v._row] = v
+        return views
+
+    def _delete(self, proxy: ProxyObject):
+        super()._delete(proxy)
+        if isinstance(proxy, ProxyRow) and proxy._table is self.table:
+            self._acquire()
+            try:
+                row = proxy._row
+                if self._views[row] is proxy:
+                    self._views[row] = None
+                self.table.delete(row, proxy)
+            finally:
+                self._lock.release()
+
+    def _state_counts(self) -> Dict[str, int]:
+        return {s.name: n for s, n in self.table.summary().items()}
+
+    def ranked(self, limit: int = None) -> List[ProxyObject]:
+        views = [self._views[r] for r in self.table.ranked(limit)]
+        # Rows deleted after the ranking was computed have no view anymore
+        return [v for v in views if v is not None]
+
+    def state(self):
+        summary = self.table.summary()
+        return f"Total: {sum(summary.values())} | " + \
+               f"Active: {summary[ProxyState.ACTIVE]} | " + \
+               f"Dead: {summary[ProxyState.DEAD]} | " + \
+               f"Cooldown: {summary[ProxyState.COOLDOWN]} | " + \
+               f"Unknown: {summary[ProxyState.UNKNOWN]} | " + \
+               f"Checks/s: {self.checker.checks_per_second:.2f}"
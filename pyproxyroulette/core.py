@@ -1,10 +1,16 @@
+import asyncio
 import datetime
 import time
 import threading
+import weakref
 from .pool import ProxyPool, ProxyState, ProxyObject
+from .snapshot import PoolSnapshot
+from .backoff import FailureKind
+from .selection import SelectionStrategy
 from .defaults import defaults
 import logging
-from typing import List, Union, Dict, Callable
+import sqlite3
+from typing import List, Union, Dict, Callable, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -12,84 +18,203 @@ logger = logging.getLogger(__name__)
 class ProxyRouletteCore:
     def __init__(self,
                  func_proxy_pool_updater: Callable = defaults.get_proxies_from_web,
-                 func_proxy_validator: Callable = defaults.proxy_is_working,
-                 max_timeout: int = 15):
-        self.proxy_pool: ProxyPool = ProxyPool(func_proxy_validator=func_proxy_validator,
-                                               max_timeout=max_timeout)
-        self._current_proxy: Dict = {}
+                 func_proxy_validator: Callable = defaults.proxy_echo_check,
+                 max_timeout: int = 15,
+                 check_concurrency: int = 50,
+                 selection_strategy: SelectionStrategy = None,
+                 proxy_pool: ProxyPool = None,
+                 snapshot_path: str = None):
+        if proxy_pool is None:
+            proxy_pool = ProxyPool(func_proxy_validator=func_proxy_validator,
+                                   max_timeout=max_timeout,
+                                   check_concurrency=check_concurrency,
+                                   selection_strategy=selection_strategy)
+        self.proxy_pool: ProxyPool = proxy_pool
+        # Warm start: the pool is restored from and periodically saved to this snapshot
+        self.snapshot: PoolSnapshot = PoolSnapshot(snapshot_path) if snapshot_path is not None else None
+        # Proxy assigned to each thread, released together with the thread
+        self._thread_proxy: threading.local = threading.local()
+        # Proxies assigned to asyncio tasks, released together with the task
+        self._task_proxy: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
         self.proxy_pool_update_fnc = func_proxy_pool_updater
         self.update_interval: datetime.timedelta = datetime.timedelta(minutes=20)
         self.update_instance = threading.Thread(target=self._proxy_pool_update_thread)
         self.update_instance.setDaemon(True)
         self.update_instance.start()
         self.cooldown: datetime = datetime.timedelta(hours=1, minutes=5)
+        # Seconds to wait for a free slot before retrying when all proxies are saturated
+        self.admission_wait: float = 0.05
 
-    def current_proxy(self, return_obj: bool = False) -> Union[Dict, ProxyObject]:
+    def current_proxy(self, return_obj: bool = False, host: str = None) -> Union[Dict, ProxyObject]:
         """
-        Returns the proxy of the current thread. THe proxy is changed if the proxy state changes
+        Returns the proxy of the current thread or asyncio task. THe proxy is changed if the proxy state changes
         The proxy state may change if feedback from this or another thread is submitted which changes the state.
         :param return_obj: bool if the returned proxy is already a dict or a proxy object
+        :param host: target host of the request, proxies blocked by this host are not returned
         :return:  proxy object or proxy dict
         """
-        current_thread = threading.currentThread().ident
-        if current_thread not in self._current_proxy.keys():
-            self._current_proxy[current_thread] = None
-
-        if self._current_proxy[current_thread] is not None and \
-                self._current_proxy[current_thread].state == ProxyState.ACTIVE:
-            logger.debug(f"Unchanged proxy returned for thread {current_thread}")
-        elif self._current_proxy[current_thread] is not None:
-            logger.debug(f"Assigned proxy of thread {current_thread} not in state ACTIVE. Assigning new proxy")
-            self._current_proxy[current_thread].cooldown = self.cooldown
-            self._current_proxy[current_thread] = self.proxy_pool.get_best_proxy()
+        store, key = self._assignment_slot()
+        if self._requires_new_proxy(store, key, host):
+            store[key] = self.proxy_pool.get_best_proxy(host=host)
         else:
-            logging.error(f"No proxy set for thread {current_thread}. Assigning new proxy")
-            self._current_proxy[current_thread] = self.proxy_pool.get_best_proxy()
+            self._rebalance(store, key, host)
+        return store[key] if return_obj else store[key].to_dict()
 
-        if return_obj:
-            result = self._current_proxy[current_thread]
+    def acquire_proxy(self, host: str = None) -> ProxyObject:
+        """
+        Returns the proxy of the current thread with a request admitted on it, see ProxyObject.try_begin_request.
+        If the proxy is saturated the thread is moved to another proxy with capacity, it only waits if all
+        proxies are saturated. The request must be finished with end_request
+        :param host: target host of the request, proxies blocked by this host are not returned
+        """
+        store, key = self._assignment_slot()
+        while True:
+            proxy = self.current_proxy(return_obj=True, host=host)
+            if proxy.try_begin_request():
+                return proxy
+            if self._rebalance(store, key, host) and store[key].try_begin_request():
+                return store[key]
+            ProxyObject.wait_for_capacity(self.admission_wait)
+
+    async def acquire_proxy_async(self, host: str = None) -> ProxyObject:
+        """
+        Coroutine counterpart of acquire_proxy
+        """
+        store, key = self._assignment_slot()
+        while True:
+            proxy = await self.current_proxy_async(return_obj=True, host=host)
+            if proxy.try_begin_request():
+                return proxy
+            if self._rebalance(store, key, host) and store[key].try_begin_request():
+                return store[key]
+            await asyncio.sleep(self.admission_wait)
+
+    async def current_proxy_async(self, return_obj: bool = False, host: str = None) -> Union[Dict, ProxyObject]:
+        """
+        Coroutine counterpart of current_proxy. Waiting for a usable proxy does not block the event loop
+        :param return_obj: bool if the returned proxy is already a dict or a proxy object
+        :param host: target host of the request, proxies blocked by this host are not returned
+        :return:  proxy object or proxy dict
+        """
+        store, key = self._assignment_slot()
+        if self._requires_new_proxy(store, key, host):
+            store[key] = await self.proxy_pool.get_best_proxy_async(host=host)
         else:
-            result = self._current_proxy[current_thread].to_dict()
-        return result
+            self._rebalance(store, key, host)
+        return store[key] if return_obj else store[key].to_dict()
 
-    def force_update(self, apply_cooldown: bool = False) -> Union[Dict, ProxyObject]:
+    def force_update(self, apply_cooldown: bool = False, blocked_host: str = None) -> Union[Dict, ProxyObject]:
         """
         Force the system to assign a new proxy to the thread. The old proxy may get a cooldown
         :param apply_cooldown: Apply a cooldown the the old proxy which prevents it from beeing used for the set cooldown period
+        :param blocked_host: Only apply the cooldown for requests to this host
         :return: the new proxy object
         """
-        current_thread = threading.currentThread().ident
-        if apply_cooldown:
-            if self._current_proxy[current_thread] is not None:
-                self._current_proxy[current_thread].cooldown = self.cooldown
-
-        self._current_proxy[current_thread] = self.proxy_pool.get_best_proxy()
-        return self._current_proxy
+        store, key = self._assignment_slot()
+        self._release(store, key, apply_cooldown, blocked_host)
+        store[key] = self.proxy_pool.get_best_proxy(host=blocked_host)
+        return store[key]
+
+    async def force_update_async(self,
+                                 apply_cooldown: bool = False,
+                                 blocked_host: str = None) -> Union[Dict, ProxyObject]:
+        """
+        Coroutine counterpart of force_update
+        :param apply_cooldown: Apply a cooldown the the old proxy which prevents it from beeing used for the set cooldown period
+        :param blocked_host: Only apply the cooldown for requests to this host
+        :return: the new proxy object
+        """
+        store, key = self._assignment_slot()
+        self._release(store, key, apply_cooldown, blocked_host)
+        store[key] = await self.proxy_pool.get_best_proxy_async(host=blocked_host)
+        return store[key]
+
+    def _assignment_slot(self) -> Tuple[Dict, object]:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is not None:
+            return self._task_proxy, task
+        # Every thread has its own store holding only its own assignment
+        store = getattr(self._thread_proxy, 'store', None)
+        if store is None:
+            store = self._thread_proxy.store = {}
+        return store, threading.get_ident()
+
+    def _requires_new_proxy(self, store: Dict, key, host: str = None) -> bool:
+        proxy = store.get(key)
+        if proxy is not None and proxy.state == ProxyState.ACTIVE:
+            if self.proxy_pool.host_health.is_usable(proxy, host):
+                logger.debug(f"Unchanged proxy returned for {key}")
+                return False
+            logger.debug(f"Assigned proxy of {key} is blocked by {host}. Assigning new proxy")
+        elif proxy is not None:
+            logger.debug(f"Assigned proxy of {key} not in state ACTIVE. Assigning new proxy")
+        else:
+            logger.debug(f"No proxy set for {key}. Assigning new proxy")
+        return True
 
-    def proxy_feedback(self, request_success: bool = False, request_failure: bool = False):
+    def _rebalance(self, store: Dict, key, host: str = None) -> bool:
+        """
+        Moves the assignment to another proxy if the assigned proxy is saturated and another one has capacity
+        :return: True if the assignment was changed
+        """
+        proxy = store[key]
+        if proxy.has_capacity():
+            return False
+        alternative = self.proxy_pool.get_proxy_nowait(host=host, exclude=proxy)
+        if alternative is None or not alternative.has_capacity():
+            return False
+        logger.debug(f"Assigned proxy of {key} is saturated. Moving to {alternative}")
+        store[key] = alternative
+        return True
+
+    def _release(self, store: Dict, key, apply_cooldown: bool, blocked_host: str = None):
+        proxy = store.get(key)
+        if proxy is None:
+            return
+        if blocked_host is not None:
+            self.proxy_pool.host_health.report_blocked(proxy, blocked_host)
+        elif apply_cooldown:
+            proxy.cooldown = self.cooldown
+
+    def proxy_feedback(self,
+                       request_success: bool = False,
+                       request_failure: bool = False,
+                       failure_kind: FailureKind = FailureKind.PROXY_ERROR):
         """
         Provide feedback on the proxies performance after a request
         :param request_success: request using the proxy was successfull
         :param request_failure: request using the proxy failed
+        :param failure_kind: kind of the failure, determines the cooldown of the proxy
         :return:
         """
-        current_thread = threading.currentThread().ident
-        if self._current_proxy[current_thread] is not None:
-            proxy_obj = self._current_proxy[current_thread]
-        else:
+        store, key = self._assignment_slot()
+        proxy_obj = store.get(key)
+        if proxy_obj is None:
             return None
 
         if request_success and not request_failure:
             proxy_obj.report_success()
         elif request_failure and not request_success:
-            proxy_obj.cooldown = datetime.timedelta(minutes=30)
-            proxy_obj.report_request_failed()
+            proxy_obj.report_request_failed(failure_kind)
 
     def _proxy_pool_update_thread(self):
+        if self.snapshot is not None:
+            # Restored before the first update, so known proxies keep their statistics
+            try:
+                self.snapshot.load(self.proxy_pool)
+            except (sqlite3.Error, ValueError, KeyError, TypeError, IndexError) as e:
+                # A corrupt snapshot must not keep the pool from being filled by the updater
+                logger.error(f"Could not load proxy snapshot {self.snapshot.path}. {e}")
+            self.snapshot.start(self.proxy_pool)
         while True:
-            proxy_list = self.proxy_pool_update_fnc()
-            for p in proxy_list:
-                self.add_proxy(p[0], p[1], init_responsetime=p[2])
+            try:
+                added = self.proxy_pool.add_many(self.proxy_pool_update_fnc())
+                logger.info(f"Pool update added {added} new proxies")
+            except Exception as e:
+                logger.error(f"An unexpected error occured while updating the proxy pool. {e}")
             time.sleep(self.update_interval.total_seconds())
 
     def add_proxy(self, ip: str, port: int, init_responsetime: int = 0):
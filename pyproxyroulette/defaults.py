@@ -1,9 +1,16 @@
 import requests as requests_original
 from .proxy import ProxyObject
-from typing import List, Tuple
+from .validation import EchoValidator
+import re
+from typing import Iterator, Tuple
+
+_PROXY_LINE = re.compile(r"^\s*(\d{1,3}(?:\.\d{1,3}){3}):(\d{1,5})\b")
 
 
 class defaults:
+    # Decides liveness and anonymity of a proxy with a single request
+    proxy_echo_check: EchoValidator = EchoValidator()
+
     @staticmethod
     def proxy_is_working(proxy: ProxyObject, timeout: int = 5) -> bool:
         try:
@@ -11,23 +18,23 @@ class defaults:
             proxy.response_time = res.elapsed.total_seconds()
         except (requests_original.exceptions.ProxyError,
             requests_original.exceptions.ConnectTimeout):
-            proxy.response_time = timeout
             return False
         return True
 
     @staticmethod
-    def get_proxies_from_web() -> List[Tuple[str, int, int]]:
+    def get_proxies_from_web() -> Iterator[Tuple[str, int, int]]:
         """
         Downloads a list containing proxy ip's and their ports with the security details
-        Returns a list of proxyies matching the security requirements
+        Yields the proxies line by line while the list is streamed, header and footer lines are skipped
         """
-        proxy_list = requests_original.get(
-            "https://raw.githubusercontent.com/clarketm/proxy-list/master/proxy-list.txt")
-        proxy_processed = []
-        for i in str(proxy_list.content).split("\\n")[10:-2]:
-            i_uri, i_port = i.split(" ")[0].split(":")
-            proxy_processed.append((i_uri, i_port, 0))
-        return proxy_processed
+        with requests_original.get("https://raw.githubusercontent.com/clarketm/proxy-list/master/proxy-list.txt",
+                                   stream=True, timeout=30) as proxy_list:
+            proxy_list.raise_for_status()
+            proxy_list.encoding = proxy_list.encoding or 'utf-8'
+            for line in proxy_list.iter_lines(decode_unicode=True):
+                match = _PROXY_LINE.match(line)
+                if match is not None:
+                    yield match.group(1), int(match.group(2)), 0
 
     @staticmethod
     def proxy_response_validator(response) -> bool:
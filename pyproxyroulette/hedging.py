@@ -0,0 +1,71 @@
+import collections
+import threading
+
+
+class HedgePolicy:
+    """
+    Decides when a second request is sent through another proxy.
+    The hedge delay follows the given percentile of the recently observed response times,
+    the budget limits hedges to a fraction of all requests: every request adds `budget` tokens to a bucket
+    holding at most `burst` tokens and every hedge takes one, so quiet periods do not save up more than the burst.
+    A policy may be shared by several ProxyRoulette instances to enforce one global budget.
+    """
+    def __init__(self,
+                 percentile: float = 95,
+                 budget: float = 0.05,
+                 burst: int = 10,
+                 min_delay: float = 0.05,
+                 initial_delay: float = 1.0,
+                 window: int = 512):
+        self.percentile: float = percentile
+        self.budget: float = budget
+        self.burst: int = burst
+        self.min_delay: float = min_delay
+        self.initial_delay: float = initial_delay
+        self._latencies: collections.deque = collections.deque(maxlen=window)
+        self._delay: float = initial_delay
+        self._since_update: int = 0
+        self._tokens: float = float(burst)
+        self._lock = threading.Lock()
+
+        # Statistics
+        self.requests: int = 0
+        self.hedges: int = 0
+        self.hedges_won: int = 0
+
+    @property
+    def delay(self) -> float:
+        """
+        Seconds to wait for the first attempt before a hedge is sent
+        """
+        return self._delay
+
+    def record(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+            self._since_update += 1
+            if self._since_update >= 16 or len(self._latencies) < 16:
+                self._since_update = 0
+                ordered = sorted(self._latencies)
+                value = ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))]
+                self._delay = max(self.min_delay, value)
+
+    def request_started(self):
+        with self._lock:
+            self.requests += 1
+            self._tokens = min(self.burst, self._tokens + self.budget)
+
+    def try_acquire(self) -> bool:
+        """
+        :return: True if the budget allows one more hedge, which is then counted
+        """
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.hedges += 1
+                return True
+            return False
+
+    def hedge_won(self):
+        with self._lock:
+            self.hedges_won += 1
@@ -0,0 +1,139 @@
+from .proxy import ProxyObject
+from .backoff import FailureKind
+import functools
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Set
+
+
+class HostRecord:
+    """
+    Health of one proxy towards one target host
+    """
+    __slots__ = ('blocked_until', 'blocks', 'failures', 'latency')
+
+    def __init__(self):
+        self.blocked_until: float = None
+        self.blocks: int = 0
+        self.failures: int = 0
+        self.latency: float = None
+
+
+class HostHealth:
+    """
+    Tracks block status, cooldowns, failures and latency per (proxy, target host).
+    Memory is bounded: at most max_hosts hosts with at most max_proxies_per_host records each are kept,
+    the least recently used host or record is evicted first.
+    Proxies are ranked for a host by their latency towards it, by their overall ranking latency if unknown.
+    """
+    def __init__(self, max_hosts: int = 1024, max_proxies_per_host: int = 4096, latency_weight: float = 0.3):
+        self.max_hosts: int = max_hosts
+        self.max_proxies_per_host: int = max_proxies_per_host
+        self.latency_weight: float = latency_weight
+        self._hosts: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, proxy: ProxyObject, host: str, create: bool = False) -> Optional[HostRecord]:
+        with self._lock:
+            records = self._hosts.get(host)
+            if records is None:
+                if not create:
+                    return None
+                records = self._hosts[host] = OrderedDict()
+                if len(self._hosts) > self.max_hosts:
+                    self._hosts.popitem(last=False)
+            else:
+                self._hosts.move_to_end(host)
+
+            rec = records.get(proxy)
+            if rec is None:
+                if not create:
+                    return None
+                rec = records[proxy] = HostRecord()
+                if len(records) > self.max_proxies_per_host:
+                    records.popitem(last=False)
+            else:
+                records.move_to_end(proxy)
+            return rec
+
+    def is_usable(self, proxy: ProxyObject, host: str) -> bool:
+        """
+        :return: False while the proxy is blocked by the host
+        """
+        if host is None:
+            return True
+        # The LRU order is not refreshed, this is on the path of every selection
+        with self._lock:
+            records = self._hosts.get(host)
+            rec = records.get(proxy) if records is not None else None
+            if rec is None or rec.blocked_until is None:
+                return True
+            if rec.blocked_until <= time.monotonic():
+                rec.blocked_until = None
+                return True
+            return False
+
+    def blocked(self, host: str) -> Set[ProxyObject]:
+        """
+        :return: proxies currently blocked by the host
+        """
+        now = time.monotonic()
+        with self._lock:
+            records = self._hosts.get(host, {})
+            return {p for p, r in records.items() if r.blocked_until is not None and r.blocked_until > now}
+
+    def report_blocked(self, proxy: ProxyObject, host: str, cooldown: float = None):
+        """
+        Marks the proxy as blocked by the host for cooldown seconds
+        :param cooldown: seconds, by default the backoff of the proxy for its consecutive blocks by the host
+        """
+        rec = self.record(proxy, host, create=True)
+        rec.blocks += 1
+        if cooldown is None:
+            cooldown = proxy.backoff.cooldown(FailureKind.BLOCKED, rec.blocks)
+        rec.blocked_until = time.monotonic() + cooldown
+
+    def report_failure(self, proxy: ProxyObject, host: str):
+        self.record(proxy, host, create=True).failures += 1
+
+    def report_success(self, proxy: ProxyObject, host: str, latency: float):
+        rec = self.record(proxy, host, create=True)
+        rec.failures = 0
+        rec.blocks = 0
+        if rec.latency is None:
+            rec.latency = latency
+        else:
+            rec.latency += self.latency_weight * (latency - rec.latency)
+
+    def latency(self, proxy: ProxyObject, host: str) -> Optional[float]:
+        rec = self.record(proxy, host)
+        return None if rec is None else rec.latency
+
+    def ranking_latency(self, proxy: ProxyObject, host: str) -> float:
+        """
+        :return: latency of the proxy towards the host, its ranking latency if none was recorded yet
+        """
+        with self._lock:
+            records = self._hosts.get(host)
+            rec = records.get(proxy) if records is not None else None
+            latency = rec.latency if rec is not None else None
+        return proxy.ranking_latency if latency is None else latency
+
+    def latency_key(self, host: str) -> Optional[Callable[[ProxyObject], float]]:
+        """
+        :return: function ranking proxies for the host or None if nothing is known about the host
+        """
+        if host is None or host not in self._hosts:
+            return None
+        return functools.partial(self.ranking_latency, host=host)
+
+    def blocked_proxies(self, host: str) -> int:
+        now = time.monotonic()
+        with self._lock:
+            records = self._hosts.get(host, {})
+            return sum(1 for r in records.values() if r.blocked_until is not None and r.blocked_until > now)
+
+    def hosts(self) -> Dict[str, int]:
+        with self._lock:
+            return {h: len(r) for h, r in self._hosts.items()}
@@ -0,0 +1,180 @@
+from .proxy import ProxyObject, ProxyState
+import heapq
+import itertools
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class IndexSnapshot:
+    """
+    Immutable view of the index: all members and the ranked_size fastest of them by ranking latency.
+    The ranking is computed on first use, strategies which only sample never pay for it
+    """
+    __slots__ = ('members', 'built', '_ranked_size', '_ranked')
+
+    def __init__(self, members: Tuple[ProxyObject, ...], built: float, ranked_size: int = 64):
+        self.members: Tuple[ProxyObject, ...] = members
+        self.built: float = built
+        self._ranked_size: int = ranked_size
+        self._ranked: Tuple[ProxyObject, ...] = None
+
+    @property
+    def ranked(self) -> Tuple[ProxyObject, ...]:
+        if self._ranked is None:
+            # Threads racing here compute the same ranking, the last one wins
+            self._ranked = tuple(heapq.nsmallest(self._ranked_size, self.members, key=lambda p: p.ranking_latency))
+        return self._ranked
+
+
+class ProxyIndex:
+    """
+    Index of the active proxies. Writers keep a member list (uniform samples in O(1)) under a lock,
+    readers never take it: they read an immutable IndexSnapshot which is rebuilt and swapped atomically
+    once the index changed, at most every refresh_interval seconds. A reader finding the snapshot outdated
+    rebuilds it, other readers keep using the previous snapshot meanwhile. Only readers which would otherwise
+    find no active proxy wait for an outdated snapshot to be rebuilt.
+    Readers only return proxies which are still ACTIVE, so a slightly outdated snapshot never hands out
+    a proxy which failed in the meantime.
+    """
+    def __init__(self, refresh_interval: float = 0.25, ranked_size: int = 64):
+        self.refresh_interval: float = refresh_interval
+        self.ranked_size: int = ranked_size
+        self._members: List[ProxyObject] = []
+        self._positions: Dict[ProxyObject, int] = {}
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self._snapshot: IndexSnapshot = IndexSnapshot((), 0.0)
+        # Members were added or removed or response times changed since the snapshot was built
+        self._changed: bool = False
+
+    def add(self, proxy: ProxyObject):
+        """
+        Adds the proxy to the index or marks the ranking as outdated if it is already indexed
+        :param proxy: proxy object
+        """
+        with self._lock:
+            if proxy not in self._positions:
+                self._positions[proxy] = len(self._members)
+                self._members.append(proxy)
+            self._changed = True
+
+    def update(self, proxy: ProxyObject):
+        """
+        Marks the ranking as outdated if the proxy is part of the index. Proxies not in the index are ignored
+        :param proxy: proxy object
+        """
+        if proxy in self._positions:
+            self._changed = True
+
+    def discard(self, proxy: ProxyObject):
+        with self._lock:
+            self._remove(proxy)
+
+    def snapshot(self, force: bool = False) -> IndexSnapshot:
+        """
+        :param force: rebuild an outdated snapshot regardless of the refresh_interval and wait for a rebuild
+        running in another thread
+        :return: current snapshot, rebuilt first if it is outdated and no other thread rebuilds it already
+        """
+        snapshot = self._snapshot
+        if force:
+            outdated = self._changed or self._rebuild_lock.locked()
+        else:
+            outdated = self._changed and snapshot.built + self.refresh_interval <= time.monotonic()
+        if outdated and self._rebuild_lock.acquire(blocking=force):
+            try:
+                if self._snapshot is not snapshot:
+                    # Rebuilt by another thread while this one waited
+                    snapshot = self._snapshot
+                elif self._changed:
+                    snapshot = self._rebuild()
+            finally:
+                self._rebuild_lock.release()
+        return snapshot
+
+    def best(self, latency: Callable[[ProxyObject], float] = None) -> Optional[ProxyObject]:
+        """
+        Returns the proxy with the lowest ranking latency in the snapshot which is in state ACTIVE.
+        :param latency: if given, the ranked proxies of the snapshot are ordered by this latency instead.
+        Only the shortlist of the snapshot is re-ordered, a full scan per selection is avoided
+        :return: proxy object or None if no active proxy is indexed
+        """
+        key = latency if latency is not None else (lambda p: p.ranking_latency)
+        for force in (False, True):
+            snapshot = self.snapshot(force)
+            if latency is None:
+                for proxy in snapshot.ranked:
+                    if proxy.state == ProxyState.ACTIVE:
+                        return proxy
+            else:
+                active = [p for p in snapshot.ranked if p.state == ProxyState.ACTIVE]
+                if active:
+                    return min(active, key=key)
+        if len(snapshot.members) > len(snapshot.ranked):
+            # All ranked proxies left the active state since the snapshot was built
+            active = [p for p in snapshot.members if p.state == ProxyState.ACTIVE]
+            if active:
+                return min(active, key=key)
+        return None
+
+    def scan(self, accept: Callable[[ProxyObject], bool], limit: int) -> List[ProxyObject]:
+        """
+        Walks all members of the snapshot from a random position, O(n)
+        :param accept: filter of the proxies
+        :param limit: stop after this many proxies were found
+        :return: up to limit accepted proxies in state ACTIVE
+        """
+        members = self.snapshot(force=True).members
+        if len(members) == 0:
+            return []
+        start = random.randrange(len(members))
+        found = []
+        for proxy in itertools.chain(members[start:], members[:start]):
+            if proxy.state == ProxyState.ACTIVE and accept(proxy):
+                found.append(proxy)
+                if len(found) >= limit:
+                    break
+        return found
+
+    def sample(self, k: int) -> List[ProxyObject]:
+        """
+        Draws up to k distinct proxies uniformly from the snapshot. Only proxies in state ACTIVE are returned
+        :param k: number of proxies to draw
+        """
+        snapshot = self.snapshot()
+        drawn = self._draw(snapshot, k)
+        if len(drawn) == 0:
+            fresh = self.snapshot(force=True)
+            if fresh is not snapshot:
+                drawn = self._draw(fresh, k)
+        return drawn
+
+    @staticmethod
+    def _draw(snapshot: IndexSnapshot, k: int) -> List[ProxyObject]:
+        drawn = random.sample(snapshot.members, min(k, len(snapshot.members)))
+        return [p for p in drawn if p.state == ProxyState.ACTIVE]
+
+    def _rebuild(self) -> IndexSnapshot:
+        with self._lock:
+            self._changed = False
+            members = tuple(self._members)
+        self._snapshot = IndexSnapshot(members, time.monotonic(), self.ranked_size)
+        return self._snapshot
+
+    def _remove(self, proxy: ProxyObject):
+        pos = self._positions.pop(proxy, None)
+        if pos is None:
+            return
+        last = self._members.pop()
+        if last is not proxy:
+            self._members[pos] = last
+            self._positions[last] = pos
+        self._changed = True
+
+    def __contains__(self, proxy: ProxyObject) -> bool:
+        return proxy in self._positions
+
+    def __len__(self) -> int:
+        return len(self._positions)
@@ -0,0 +1,204 @@
+import bisect
+import threading
+import logging
+import weakref
+from typing import Callable, Dict, List, Sequence
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+FAST_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 1)
+RETRY_BUCKETS = (0, 1, 2, 3, 5, 10, 20)
+
+
+def _format_value(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """
+    Monotonic counter, optionally split by the value of one label
+    """
+    def __init__(self, name: str, documentation: str, label: str = None):
+        self.name: str = name
+        self.documentation: str = documentation
+        self.label: str = label
+        self._values: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, label_value: str = None):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def value(self, label_value: str = None) -> float:
+        return self._values.get(label_value, 0)
+
+    def snapshot(self):
+        with self._lock:
+            if self.label is None:
+                return self._values.get(None, 0)
+            return dict(self._values)
+
+    def prometheus(self, prefix: str) -> List[str]:
+        name = f"{prefix}_{self.name}_total"
+        lines = [f"# HELP {name} {self.documentation}", f"# TYPE {name} counter"]
+        with self._lock:
+            items = sorted(self._values.items(), key=lambda i: str(i[0]))
+        if not items and self.label is None:
+            items = [(None, 0)]
+        for label_value, value in items:
+            labels = "" if self.label is None else f'{{{self.label}="{label_value}"}}'
+            lines.append(f"{name}{labels} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed bucket bounds
+    """
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name: str = name
+        self.documentation: str = documentation
+        self.buckets: Sequence[float] = tuple(buckets)
+        self._counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.sum: float = 0.0
+        self.count: int = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            cumulative, total = {}, 0
+            for bound, count in zip(self.buckets, self._counts):
+                total += count
+                cumulative[bound] = total
+            return {'buckets': cumulative, 'sum': self.sum, 'count': self.count}
+
+    def prometheus(self, prefix: str) -> List[str]:
+        name = f"{prefix}_{self.name}"
+        snapshot = self.snapshot()
+        lines = [f"# HELP {name} {self.documentation}", f"# TYPE {name} histogram"]
+        for bound, count in snapshot['buckets'].items():
+            lines.append(f'{name}_bucket{{le="{_format_value(bound)}"}} {count}')
+        lines.append(f'{name}_bucket{{le="+Inf"}} {snapshot["count"]}')
+        lines.append(f"{name}_sum {_format_value(snapshot['sum'])}")
+        lines.append(f"{name}_count {snapshot['count']}")
+        return lines
+
+
+class Gauge:
+    """
+    Value read from a function when exported. The function returns a number, or a dict of numbers
+    per label value if a label is given
+    """
+    def __init__(self, name: str, documentation: str, func: Callable, label: str = None):
+        self.name: str = name
+        self.documentation: str = documentation
+        self.label: str = label
+        self._func: Callable = func
+
+    def snapshot(self):
+        return self._func()
+
+    def prometheus(self, prefix: str) -> List[str]:
+        name = f"{prefix}_{self.name}"
+        lines = [f"# HELP {name} {self.documentation}", f"# TYPE {name} gauge"]
+        value = self.snapshot()
+        if self.label is None:
+            lines.append(f"{name} {_format_value(value)}")
+        else:
+            for label_value, v in sorted(value.items(), key=lambda i: str(i[0])):
+                lines.append(f'{name}{{{self.label}="{label_value}"}} {_format_value(v)}')
+        return lines
+
+
+class Metrics:
+    """
+    Counters and histograms of the request path, the checker and the pool.
+    Disabled by default: every instrumented code path only tests `enabled` until enable() is called.
+    Functions in on_attempt are called after every request attempt while enabled with
+    (method, host, proxy, outcome, latency), outcome is "ok", "rejected" or the name of the raised error.
+    """
+    def __init__(self, prefix: str = "pyproxyroulette"):
+        self.prefix: str = prefix
+        self.enabled: bool = False
+        self.on_attempt: List[Callable] = []
+
+        self.request_attempts = Counter("request_attempts", "Request attempts by outcome", label="outcome")
+        self.request_attempt_seconds = Histogram("request_attempt_seconds", "Duration of single request attempts")
+        self.request_retries = Histogram("request_retries", "Retries needed per request", buckets=RETRY_BUCKETS)
+        self.validator_rejections = Counter("validator_rejections", "Responses rejected by the response validator")
+        self.checks = Counter("checks", "Proxy checks by outcome", label="outcome")
+        self.check_seconds = Histogram("check_seconds", "Duration of proxy checks")
+        self.lock_wait_seconds = Histogram("lock_wait_seconds", "Time spent waiting for the pool lock",
+                                           buckets=FAST_BUCKETS)
+        self.selection_seconds = Histogram("selection_seconds", "Time spent selecting a proxy",
+                                           buckets=FAST_BUCKETS)
+        self._gauges: List[Gauge] = []
+        # Response caches of all ProxyRoulette instances sharing this registry, exported as one gauge
+        self._response_caches: weakref.WeakSet = weakref.WeakSet()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def gauge(self, name: str, documentation: str, func: Callable, label: str = None) -> Gauge:
+        g = Gauge(name, documentation, func, label=label)
+        self._gauges.append(g)
+        return g
+
+    def add_response_cache(self, cache):
+        """
+        Exports the statistics of the cache, summed up with the other caches added to this registry
+        """
+        if not any(g.name == "response_cache" for g in self._gauges):
+            self.gauge("response_cache", "Response cache statistics", self._response_cache_stats, label="stat")
+        self._response_caches.add(cache)
+
+    def _response_cache_stats(self) -> Dict:
+        totals = {}
+        for cache in list(self._response_caches):
+            for stat, value in cache.stats.items():
+                totals[stat] = totals.get(stat, 0) + value
+        return totals
+
+    def _metrics(self) -> List:
+        return [self.request_attempts, self.request_attempt_seconds, self.request_retries,
+                self.validator_rejections, self.checks, self.check_seconds,
+                self.lock_wait_seconds, self.selection_seconds] + self._gauges
+
+    def attempt(self, method: str, host: str, proxy, outcome: str, latency: float):
+        """
+        Records one request attempt, only called while enabled
+        """
+        self.request_attempts.inc(label_value=outcome)
+        self.request_attempt_seconds.observe(latency)
+        if outcome == "rejected":
+            self.validator_rejections.inc()
+        for f in self.on_attempt:
+            try:
+                f(method, host, proxy, outcome, latency)
+            except Exception as e:
+                logger.error(f"An unexpected error occured in request attempt hook. {e}")
+
+    def as_dict(self) -> Dict:
+        return {m.name: m.snapshot() for m in self._metrics()}
+
+    def prometheus(self) -> str:
+        """
+        :return: all metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for m in self._metrics():
+            lines.extend(m.prometheus(self.prefix))
+        return "\n".join(lines) + "\n"
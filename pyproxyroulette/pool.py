@@ -1,6 +1,17 @@
 from .defaults import defaults
 from .proxy import ProxyObject, ProxyState
-import concurrent.futures
+from .index import ProxyIndex
+from .checker import ProxyChecker, LANE_NEW, LANE_RECHECK
+from .validation import AnonymityCache
+from .timers import DeadlineScheduler
+from .selection import SelectionStrategy, PowerOfTwoChoices
+from .hosts import HostHealth
+from .metrics import Metrics
+from .backoff import FailureKind
+from collections import OrderedDict
+import asyncio
+import heapq
+import itertools
 import time
 import threading
 import requests
@@ -8,95 +19,431 @@ import datetime
 import random
 import logging
 import queue
-from typing import Callable, List
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
 
 logger = logging.getLogger(__name__)
-mutex = threading.Lock()
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _batches(iterable: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
 
 
 class ProxyPool:
     def __init__(self,
-                 func_proxy_validator: Callable = defaults.proxy_is_working,
-                 max_timeout: int = 8):
-        self.pool_active: List[ProxyObject] = []
-        self.pool_inactive: List[ProxyObject] = []
+                 func_proxy_validator: Callable = defaults.proxy_echo_check,
+                 max_timeout: int = 8,
+                 check_concurrency: int = 50,
+                 max_checks_per_second: float = None,
+                 selection_strategy: SelectionStrategy = None):
+        # Guards pool_active, pool_inactive and the bookkeeping of running checks of this pool
+        self._lock = threading.Lock()
+        # Ordered sets of proxies, the values are unused
+        self.pool_active: OrderedDict = OrderedDict()
+        self.pool_inactive: OrderedDict = OrderedDict()
+        # Selection index over the ACTIVE proxies of pool_active
+        self._index: ProxyIndex = ProxyIndex()
+        self.selection: SelectionStrategy = selection_strategy or PowerOfTwoChoices()
+        # Block status and latency of proxies per target host
+        self.host_health: HostHealth = HostHealth()
         self.proxy_is_valid: Callable = func_proxy_validator
         self._max_timeout: int = max_timeout
 
-        self.cleaning_instance = None
+        self.deadlines: DeadlineScheduler = DeadlineScheduler()
         self.checking_instance = None
+        self.revalidation_instance = None
+        self.checker: ProxyChecker = ProxyChecker(self.proxy_liveliness_check,
+                                                  self._publish_check_result,
+                                                  concurrency=check_concurrency,
+                                                  max_checks_per_second=max_checks_per_second)
         self.keyboard_interrupt: bool = False
         self.anonymity_check: bool = True
+        # Anonymity verdicts per proxy address, re-checks of known proxies skip the leak check
+        self.anonymity_verdicts: AnonymityCache = AnonymityCache()
+
+        # Counters and histograms, disabled until metrics.enable() is called
+        self.metrics: Metrics = Metrics()
+        self.metrics.gauge("proxies", "Proxies in the pool by state", self._state_counts, label="state")
+        self.metrics.gauge("checks_per_second", "Completed proxy checks per second",
+                           lambda: self.checks_per_second)
+        self.metrics.gauge("checks_in_flight", "Proxy checks currently running", lambda: self.checker.in_flight)
+        self.metrics.gauge("checker_setpoints", "Current setpoints of the check controller",
+                           lambda: {k: v for k, v in self.checker.setpoints.items() if v is not None},
+                           label="setpoint")
+
+        # Functions called with a proxy when it leaves the active pool or is deleted
+        self.on_proxy_dropped: List[Callable] = []
 
         # Period to keep dead proxies in dead list
         self.death_keep_period: datetime = datetime.timedelta(hours=12)
+        # Dead proxies are checked again at most once per dead_recheck_period
+        self.dead_recheck_period: datetime = datetime.timedelta(hours=1)
+
+        # Active proxies are checked again once their last check is older than the revalidation_period.
+        # At most revalidation_rate re-checks per second are started
+        self.revalidation_period: datetime = datetime.timedelta(minutes=10)
+        self.revalidation_rate: float = 2.0
+        self._revalidation_queue: List = []
+        self._revalidation_counter = itertools.count()
+        self._revalidation_lock = threading.Lock()
+        self._revalidating: set = set()
+        # Proxies taken from the inactive pool which are currently being checked
+        self._checking: set = set()
+        # Inactive proxies due for a check in the order they are fed to the checker. Proxies in cooldown and dead
+        # proxies checked recently are not queued, the deadline scheduler queues them once they are due
+        self._due: OrderedDict = OrderedDict()
+        # Set when proxies are queued, wakes the feed of the checker
+        self._inactive_added = threading.Event()
+
+        # Callers waiting for an active proxy are woken as soon as one enters the active pool. The timeout
+        # only covers proxies becoming usable without entering it, like the end of a block by a host
+        self._activated = threading.Condition()
+        self._activations: int = 0
+        self._async_waiters: set = set()
+        self.wait_timeout: float = 5.0
 
         # Start Proxy getter instance
         self.start()
 
     def start(self):
-        if self.cleaning_instance is None or not self.cleaning_instance.is_alive():
-            self.cleaning_instance = threading.Thread(target=self._cleaning_worker)
-            self.cleaning_instance.setDaemon(True)
-            self.cleaning_instance.start()
+        self.deadlines.start()
 
         if self.checking_instance is None or not self.checking_instance.is_alive():
+            self.checker.start()
             self.checking_instance = threading.Thread(target=self._checking_worker)
             self.checking_instance.setDaemon(True)
             self.checking_instance.start()
 
+        if self.revalidation_instance is None or not self.revalidation_instance.is_alive():
+            self.revalidation_instance = threading.Thread(target=self._revalidation_worker)
+            self.revalidation_instance.setDaemon(True)
+            self.revalidation_instance.start()
+
     def stop(self):
         self.keyboard_interrupt = True
         logger.warning("Termination signal set")
-        for i in [self.cleaning_instance, self.checking_instance]:
+        for i in [self.checking_instance, self.revalidation_instance]:
             i.join()
+        self.checker.stop()
+        self.deadlines.stop()
 
     def add(self, ip: str, port: int, init_responsetime: int = 0):
-        inst = ProxyObject(ip, port, max_timeout=self._max_timeout)
-        if init_responsetime != 0:
-            inst.response_time = float(init_responsetime)
-        if inst not in self.pool_active and inst not in self.pool_inactive:
-            self.pool_inactive.append(inst)
+        self.add_many([(ip, port, init_responsetime)])
+
+    def add_many(self, proxies: Iterable[Tuple], batch_size: int = 4096) -> int:
+        """
+        Adds proxies given as (ip, port) or (ip, port, init_responsetime) tuples. Known proxies are skipped.
+        The iterable is consumed lazily, the pool is locked once per batch
+        :return: number of added proxies
+        """
+        added = 0
+        for batch in _batches(proxies, batch_size):
+            instances = []
+            for p in batch:
+                try:
+                    inst = ProxyObject(p[0], p[1], max_timeout=self._max_timeout)
+                except (ValueError, TypeError, IndexError, AssertionError):
+                    logger.debug(f"Skipping malformed proxy entry {p}")
+                    continue
+                if len(p) > 2 and p[2]:
+                    inst.response_time = float(p[2])
+                instances.append(inst)
+
+            self._acquire()
+            try:
+                for inst in instances:
+                    if not self._is_known(inst):
+                        inst._observer = self._proxy_changed
+                        self.pool_inactive[inst] = None
+                        self._due[inst] = None
+                        added += 1
+            finally:
+                self._lock.release()
+            self._inactive_added.set()
+        return added
+
+    def proxies(self) -> List[ProxyObject]:
+        """
+        :return: all proxies of the pool, active ones first
+        """
+        self._acquire()
+        try:
+            return list(self.pool_active) + list(self.pool_inactive)
+        finally:
+            self._lock.release()
+
+    def restore(self, records: Iterable[Tuple[str, int, Dict]], max_age: float = 6 * 3600) -> int:
+        """
+        Adds proxies together with previously recorded statistics. Proxies already in the pool are skipped.
+        Proxies which are ACTIVE and were checked within max_age seconds are served immediately and
+        re-validated in the background, all others are checked first
+        :param records: (ip, port, fields) tuples, fields maps ProxyObject attributes to their values
+        :param max_age: seconds since the last check
+        :return: number of restored proxies
+        """
+        restored = 0
+        now = time.monotonic()
+        for proxy, fields in self._restored_proxies(records):
+            for name, value in fields.items():
+                setattr(proxy, name, value)
+            proxy._tail = proxy.latency_percentile(95)
+            proxy._update_state()
+            state = proxy.state
+            usable = state == ProxyState.ACTIVE and \
+                proxy.last_checked is not None and now - proxy.last_checked <= max_age
+
+            self._acquire()
+            try:
+                if self._is_known(proxy):
+                    continue
+                proxy._observer = self._proxy_changed
+                if usable:
+                    self.pool_active[proxy] = None
+                else:
+                    self.pool_inactive[proxy] = None
+            finally:
+                self._lock.release()
+
+            if usable:
+                self._index.add(proxy)
+                self._schedule_revalidation(proxy)
+                self._notify_activated()
+            else:
+                if state in (ProxyState.COOLDOWN, ProxyState.DEAD):
+                    # Schedules the end of the cooldown or of the death retention period
+                    self._proxy_changed(proxy)
+                self._schedule_check(proxy)
+            restored += 1
+        return restored
+
+    def _acquire(self):
+        if self.metrics.enabled:
+            started = time.perf_counter()
+            self._lock.acquire()
+            self.metrics.lock_wait_seconds.observe(time.perf_counter() - started)
+        else:
+            self._lock.acquire()
+
+    def _state_counts(self) -> Dict[str, int]:
+        counts = {s.name: 0 for s in ProxyState}
+        for p in self.proxies():
+            counts[p.state.name] += 1
+        return counts
+
+    def _is_known(self, proxy: ProxyObject) -> bool:
+        return proxy in self.pool_active or proxy in self.pool_inactive or proxy in self._checking
+
+    def _restored_proxies(self, records: Iterable[Tuple[str, int, Dict]]):
+        for ip, port, fields in records:
+            yield ProxyObject(ip, port, max_timeout=self._max_timeout), fields
 
     def _active_proxies(self) -> List[ProxyObject]:
-        return [p for p in self.pool_active if p.state == ProxyState.ACTIVE]
+        return [p for p in self._index.snapshot().members if p.state == ProxyState.ACTIVE]
 
-    def get_best_proxy(self) -> ProxyObject:
+    def get_best_proxy(self, host: str = None) -> ProxyObject:
+        """
+        Returns an active proxy chosen by the selection strategy. Blocks until one is available,
+        the caller is woken as soon as a proxy enters the active pool
+        :param host: target host, proxies currently blocked by this host are skipped
+        """
         self.start()
-        self.pool_active.sort(key=lambda i: i.response_time)
-        while not self.has_active_proxy:
+        while True:
+            activations = self._activations
+            best = self._select(host)
+            if best is not None:
+                return best
             logger.debug("Currently no Usable proxy to get in the system. Waiting")
-            time.sleep(2)
-        mutex.acquire()
-        try:
-            active_proxies = self._active_proxies()
-        finally:
-            mutex.release()
-        return active_proxies[0]
+            with self._activated:
+                if self._activations == activations:
+                    self._activated.wait(self.wait_timeout)
+
+    async def get_best_proxy_async(self, host: str = None) -> ProxyObject:
+        """
+        Coroutine counterpart of get_best_proxy. Waiting does not block the event loop
+        """
+        self.start()
+        loop = asyncio.get_running_loop()
+        while True:
+            activations = self._activations
+            best = self._select(host)
+            if best is not None:
+                return best
+            logger.debug("Currently no Usable proxy to get in the system. Waiting")
+            waiter = (loop, loop.create_future())
+            with self._activated:
+                if self._activations != activations:
+                    continue
+                self._async_waiters.add(waiter)
+            try:
+                await asyncio.wait([waiter[1]], timeout=self.wait_timeout)
+            finally:
+                with self._activated:
+                    self._async_waiters.discard(waiter)
+
+    def _notify_activated(self):
+        """
+        Wakes all callers waiting for an active proxy
+        """
+        with self._activated:
+            self._activations += 1
+            self._activated.notify_all()
+            waiters, self._async_waiters = self._async_waiters, set()
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                # Event loop of the waiter was closed in the meantime
+                pass
+
+    def get_proxy_nowait(self, host: str = None, exclude: ProxyObject = None) -> ProxyObject:
+        """
+        Returns an active proxy other than exclude or None if none is available right now
+        :param host: target host, proxies currently blocked by this host are skipped
+        :param exclude: proxy which must not be returned
+        """
+        return self._select(host, exclude=exclude)
+
+    def _select(self,
+                host: str = None,
+                exclude: ProxyObject = None,
+                attempts: int = 4,
+                fallback_candidates: int = 32) -> ProxyObject:
+        if self.metrics.enabled:
+            started = time.perf_counter()
+            proxy = self._select_proxy(host, exclude, attempts, fallback_candidates)
+            self.metrics.selection_seconds.observe(time.perf_counter() - started)
+            return proxy
+        return self._select_proxy(host, exclude, attempts, fallback_candidates)
+
+    def _select_proxy(self, host: str, exclude: ProxyObject, attempts: int, fallback_candidates: int) -> ProxyObject:
+        # Proxies are compared by their latency towards the host once it is known
+        latency = self.host_health.latency_key(host) or (lambda p: p.ranking_latency)
+        for _ in range(attempts):
+            proxy = self.selection.select(self._index, latency)
+            if proxy is None:
+                return None
+            if proxy != exclude and proxy.has_capacity() and self.host_health.is_usable(proxy, host):
+                return proxy
+        # The strategy keeps choosing unusable or saturated proxies, fall back to the fastest of a random sample.
+        # Saturated proxies are only returned if the whole sample is saturated
+        candidates = [p for p in self._index.sample(fallback_candidates)
+                      if p != exclude and self.host_health.is_usable(p, host)]
+        if len(candidates) == 0 and host is not None:
+            # Most proxies are blocked by the host, look through all of them before waiting for a new one
+            blocked = self.host_health.blocked(host)
+            candidates = self._index.scan(lambda p: p != exclude and p not in blocked, fallback_candidates)
+        if len(candidates) == 0:
+            return None
+        return min(candidates, key=lambda p: (not p.has_capacity(), latency(p)))
 
     @property
     def has_active_proxy(self) -> bool:
-        for p in self.pool_active:
-            if p.state == ProxyState.ACTIVE:
-                return True
-        return False
+        return self._index.best() is not None
+
+    def take_unchecked(self, count: int) -> List[ProxyObject]:
+        """
+        Takes up to count unchecked proxies out of the inactive pool, so a request can be sent through them directly
+        while no proxy is active. The outcome of each request must be handed back with report_unchecked
+        :param count: number of proxies to take
+        :return: proxies in state UNKNOWN, the checker does not pick them up meanwhile
+        """
+        taken = []
+        self._acquire()
+        try:
+            for p in list(itertools.islice(self._due, 4 * count)):
+                if len(taken) >= count:
+                    break
+                if p.state != ProxyState.UNKNOWN:
+                    continue
+                del self._due[p]
+                del self.pool_inactive[p]
+                taken.append(p)
+            self._checking.update(taken)
+        finally:
+            self._lock.release()
+        return taken
+
+    def report_unchecked(self, proxy: ProxyObject, alive: bool, response_time: float = None):
+        """
+        Hands back a proxy taken with take_unchecked, the outcome of the request sent through it counts as its check.
+        A working proxy with an unknown anonymity verdict is queued for a check with priority instead of being
+        served right away
+        :param proxy: proxy object
+        :param alive: the request returned a response through the proxy, None if the outcome says nothing about
+        the proxy. The proxy is then returned unchecked
+        :param response_time: seconds until the response arrived
+        """
+        if alive is None:
+            self._return_unchecked(proxy)
+            return
+        proxy.last_checked = time.monotonic()
+        if alive:
+            proxy.response_time = response_time
+            verdict = self.anonymity_verdicts.get(proxy.ip) if self.anonymity_check else True
+            if verdict is None:
+                if not self.checker.submit(proxy, timeout=0, lane=LANE_NEW):
+                    # The checker is busy, its feed picks the proxy up first
+                    self._return_unchecked(proxy)
+                return
+            if verdict:
+                proxy.report_success()
+            else:
+                logger.debug(f"Leaking proxy {proxy} detected. Removing proxy.")
+                proxy.mark_for_removal()
+        else:
+            proxy.report_request_failed(FailureKind.CHECK_FAILED)
+        if self.metrics.enabled:
+            self.metrics.checks.inc(label_value="ok" if alive else "failed")
+        self._publish_check_result(proxy)
+
+    def _return_unchecked(self, proxy: ProxyObject):
+        self._acquire()
+        try:
+            self._checking.discard(proxy)
+            self.pool_inactive[proxy] = None
+            self._due[proxy] = None
+            self._due.move_to_end(proxy, last=False)
+        finally:
+            self._lock.release()
+        self._inactive_added.set()
 
     def proxy_liveliness_check(self, proxy: ProxyObject) -> bool:
+        if not self.metrics.enabled:
+            return self._liveliness_check(proxy)
+        started = time.perf_counter()
+        check_result = self._liveliness_check(proxy)
+        self.metrics.check_seconds.observe(time.perf_counter() - started)
+        if proxy.to_be_removed:
+            self.metrics.checks.inc(label_value="leaking")
+        else:
+            self.metrics.checks.inc(label_value="ok" if check_result else "failed")
+        return check_result
+
+    def _liveliness_check(self, proxy: ProxyObject) -> bool:
         try:
-            proxy.last_checked = datetime.datetime.now()
+            proxy.last_checked = time.monotonic()
             check_result = self.proxy_is_valid(proxy, self._max_timeout)
             if check_result:
-                if self.anonymity_check:
-                    if defaults.is_anonymous_proxy(proxy, self._max_timeout):
-                        proxy.report_success()
-                    else:
-                        logger.debug(f"Leaking proxy {proxy} detected. Removing proxy.")
-                        proxy.mark_for_removal()
+                if proxy.state == ProxyState.UNKNOWN:
+                    # The validator did not record a response time, the duration of the check is the closest one
+                    proxy.response_time = time.monotonic() - proxy.last_checked
+                if self.anonymity_check and not self._is_anonymous(proxy, getattr(check_result, 'anonymous', None)):
+                    logger.debug(f"Leaking proxy {proxy} detected. Removing proxy.")
+                    proxy.mark_for_removal()
                 else:
                     proxy.report_success()
             else:
-                proxy.report_request_failed()
-            return check_result
+                proxy.report_request_failed(FailureKind.CHECK_FAILED)
+            return bool(check_result)
 
         except (requests.exceptions.ConnectTimeout,
                 requests.exceptions.ProxyError,
@@ -105,19 +452,38 @@ class ProxyPool:
                 requests.exceptions.ConnectionError,
                 ConnectionResetError,
                 requests.exceptions.TooManyRedirects):
-            proxy.report_request_failed()
+            proxy.report_request_failed(FailureKind.CHECK_FAILED)
             return False
 
         except Exception as e:
             logger.error(f"An unexpected error occured while lifeliness check. {e}")
-            proxy.report_request_failed()
+            proxy.report_request_failed(FailureKind.CHECK_FAILED)
             return False
 
+    def _is_anonymous(self, proxy: ProxyObject, verdict: bool = None) -> bool:
+        """
+        Decides whether the proxy hides the own address, cheapest source first: the verdict of the validator,
+        a cached verdict for the address of the proxy and only then a separate leak check
+        :param verdict: verdict of the validator, None if it did not decide
+        """
+        if verdict is None:
+            verdict = self.anonymity_verdicts.get(proxy.ip)
+            if verdict is not None:
+                return verdict
+            verdict = defaults.is_anonymous_proxy(proxy, self._max_timeout)
+        self.anonymity_verdicts.put(proxy.ip, verdict)
+        return verdict
+
     def state(self):
         unchecked_proxies = 0
         dead_proxies = 0
         cooldown_proxies = 0
-        for p in self.pool_inactive:
+        self._acquire()
+        try:
+            inactive = list(self.pool_inactive)
+        finally:
+            self._lock.release()
+        for p in inactive:
             if p.state == ProxyState.UNKNOWN:
                 unchecked_proxies += 1
             elif p.state == ProxyState.COOLDOWN:
@@ -128,61 +494,219 @@ class ProxyPool:
                f"Active: {len(self.pool_active)} | " + \
                f"Dead: {dead_proxies} | " + \
                f"Cooldown: {cooldown_proxies} | " + \
-               f"Unknown: {unchecked_proxies}"
+               f"Unknown: {unchecked_proxies} | " + \
+               f"Checks/s: {self.checker.checks_per_second:.2f}"
 
-    def _cleaning_worker(self):
-        last_round = datetime.datetime.now() - datetime.timedelta(minutes=1)
-        while True and not self.keyboard_interrupt:
-            while last_round + datetime.timedelta(minutes=1) > datetime.datetime.now():
-                time.sleep(5)
-                if self.keyboard_interrupt:
-                    exit(0)
+    def _proxy_changed(self, proxy: ProxyObject):
+        """
+        Called by a proxy whenever its response time or state changes. Moves proxies which are no longer ACTIVE
+        out of the active pool and schedules the moment their cooldown or death retention period expires
+        """
+        state = proxy.state
+        if state == ProxyState.ACTIVE:
+            self._index.update(proxy)
+            return
+
+        self._index.discard(proxy)
+        dropped = False
+        self._acquire()
+        try:
+            if proxy in self.pool_active:
+                del self.pool_active[proxy]
+                if state != ProxyState.REMOVAL:
+                    self.pool_inactive[proxy] = None
+                dropped = True
+            elif state == ProxyState.REMOVAL and proxy in self.pool_inactive:
+                del self.pool_inactive[proxy]
+                self._due.pop(proxy, None)
+                dropped = True
+        finally:
+            self._lock.release()
+        if dropped:
+            logger.debug(f"moved proxy {proxy} out of the active pool")
+            if state == ProxyState.REMOVAL:
+                self._delete(proxy)
+                return
+            self._proxy_dropped(proxy)
+            self._schedule_check(proxy)
+
+        cooldown_until, died_at = proxy.cooldown_until, proxy.died_at
+        if state == ProxyState.COOLDOWN and cooldown_until is not None:
+            self.deadlines.schedule(cooldown_until - time.monotonic(),
+                                    self._cooldown_expired, proxy)
+        elif state == ProxyState.DEAD and died_at is not None:
+            self.deadlines.schedule(died_at + self.death_keep_period.total_seconds() - time.monotonic(),
+                                    self._death_expired, proxy)
+
+    def _cooldown_expired(self, proxy: ProxyObject):
+        """
+        Half-opens the circuit breaker of the proxy: it is moved to the front of the inactive pool, so the checker
+        probes it next. It only serves requests again once the probe succeeded
+        """
+        if proxy.state in (ProxyState.COOLDOWN, ProxyState.DEAD, ProxyState.REMOVAL):
+            # Cooldown was extended or the proxy died in the meantime
+            return
+        self._acquire()
+        try:
+            if proxy not in self.pool_inactive:
+                return
+            self._due[proxy] = None
+            self._due.move_to_end(proxy, last=False)
+        finally:
+            self._lock.release()
+        self._inactive_added.set()
+        logger.debug(f"cooldown of proxy {proxy} expired, probing it")
 
-            # Do some garbage collection
-            mutex.acquire()
+    def _schedule_check(self, proxy: ProxyObject):
+        """
+        Queues an inactive proxy for the checker once it is due: proxies in cooldown once their cooldown expired,
+        dead proxies once per dead_recheck_period and all others right away
+        """
+        state = proxy.state
+        if state in (ProxyState.COOLDOWN, ProxyState.REMOVAL):
+            return
+        if state == ProxyState.DEAD and proxy.last_checked is not None:
+            delay = proxy.last_checked + self.dead_recheck_period.total_seconds() - time.monotonic()
+            if delay > 0:
+                self.deadlines.schedule(delay, self._dead_recheck_due, proxy)
+                return
+        self._acquire()
+        try:
+            if proxy not in self.pool_inactive:
+                return
+            self._due[proxy] = None
+        finally:
+            self._lock.release()
+        self._inactive_added.set()
+
+    def _dead_recheck_due(self, proxy: ProxyObject):
+        if proxy.state == ProxyState.DEAD:
+            self._schedule_check(proxy)
+
+    def _death_expired(self, proxy: ProxyObject):
+        if proxy.died_at is None or proxy.died_at + self.death_keep_period.total_seconds() > time.monotonic():
+            # Revived or died again in the meantime
+            return
+        self._delete(proxy)
+
+    def _delete(self, proxy: ProxyObject):
+        self._index.discard(proxy)
+        self._acquire()
+        try:
+            self.pool_active.pop(proxy, None)
+            self.pool_inactive.pop(proxy, None)
+            self._due.pop(proxy, None)
+        finally:
+            self._lock.release()
+        self._proxy_dropped(proxy)
+        logger.debug(f"deleted proxy {proxy}")
+
+    def _proxy_dropped(self, proxy: ProxyObject):
+        for f in self.on_proxy_dropped:
             try:
-                last_round = datetime.datetime.now()
-
-                # Clean Active proxies pool of dead or otherwise deactivated proxies
-                for p in [b for b in self.pool_active if b.state is not ProxyState.ACTIVE]:
-                    self.pool_active.remove(p)
-                    self.pool_inactive.append(p)
-                    logger.debug(f"moved proxy {p} to inactive pool")
-
-                # Delete all proxies which are dead longer than the death_keep_period
-                for p in [x for x in self.pool_inactive if (x.death_date is not None and
-                                                            x.death_date + self.death_keep_period < datetime.datetime.now())
-                                                           or x.state == ProxyState.REMOVAL]:
-                    self.pool_inactive.remove(p)
-                    logger.debug(f"deleted proxy {p}")
-            finally:
-                mutex.release()
+                f(proxy)
+            except Exception as e:
+                logger.error(f"An unexpected error occured in proxy drop hook. {e}")
 
     def _checking_worker(self):
+        """
+        Feeds the proxies due for a check to the checker whenever its lanes have room. Unchecked proxies and
+        probes after a cooldown go to the priority lane, re-checks of dead proxies to the re-check lane.
+        The feed waits for free lane space and for newly queued proxies instead of polling
+        """
         while True and not self.keyboard_interrupt:
-            check_at_once = 30
-            mutex.acquire()
+            free_slots = self.checker.wait_for_space(1)
+            if free_slots == 0:
+                continue
+            self._inactive_added.clear()
+            due_proxies = []
+            self._acquire()
             try:
-                unchecked_proxies = self.pool_inactive[:check_at_once]
-                self.pool_inactive = self.pool_inactive[check_at_once:]
+                while self._due and len(due_proxies) < free_slots:
+                    p, _ = self._due.popitem(last=False)
+                    state = p.state
+                    if p not in self.pool_inactive or state in (ProxyState.COOLDOWN, ProxyState.REMOVAL):
+                        # Gone or queued again by the end of its cooldown
+                        continue
+                    del self.pool_inactive[p]
+                    due_proxies.append((p, state))
+                self._checking.update(p for p, _ in due_proxies)
             finally:
-                mutex.release()
-            with concurrent.futures.ThreadPoolExecutor(max_workers=15) as executor:
-                instances = {executor.submit(self.proxy_liveliness_check, p): p for p in unchecked_proxies}
-                for future in concurrent.futures.as_completed(instances):
-                    future.result()
-            mutex.acquire()
+                self._lock.release()
+
+            if len(due_proxies) == 0:
+                self._inactive_added.wait(1)
+                continue
+            for p, state in due_proxies:
+                self.checker.submit(p, lane=LANE_NEW if state in (ProxyState.UNKNOWN, ProxyState.ACTIVE)
+                                    else LANE_RECHECK)
+
+    def _publish_check_result(self, proxy: ProxyObject):
+        self._acquire()
+        try:
+            state = proxy.state
+            self._checking.discard(proxy)
+            if proxy in self._revalidating:
+                # Re-checked proxies never left the active pool, failed ones were moved out on the state change
+                self._revalidating.discard(proxy)
+                if state == ProxyState.ACTIVE and proxy in self.pool_active:
+                    self._index.add(proxy)
+                    self._schedule_revalidation(proxy)
+                return
+            if state == ProxyState.ACTIVE:
+                self.pool_active[proxy] = None
+                self._index.add(proxy)
+                self._schedule_revalidation(proxy)
+            elif state != ProxyState.REMOVAL:
+                self.pool_inactive[proxy] = None
+        finally:
+            self._lock.release()
+        if state == ProxyState.ACTIVE:
+            self._notify_activated()
+        elif state == ProxyState.REMOVAL:
+            self._delete(proxy)
+        else:
+            self._schedule_check(proxy)
+
+    def _schedule_revalidation(self, proxy: ProxyObject):
+        if proxy.last_checked is None:
+            return
+        with self._revalidation_lock:
+            heapq.heappush(self._revalidation_queue, (proxy.last_checked,
+                                                      proxy.response_time,
+                                                      next(self._revalidation_counter),
+                                                      proxy))
+
+    def _revalidation_worker(self):
+        """
+        Re-checks active proxies in the order of their last check, oldest and slowest first,
+        before a failing request has to discover that they stopped working
+        """
+        while True and not self.keyboard_interrupt:
+            with self._revalidation_lock:
+                entry = None
+                if self._revalidation_queue and \
+                        self._revalidation_queue[0][0] + self.revalidation_period.total_seconds() <= time.monotonic():
+                    entry = heapq.heappop(self._revalidation_queue)
+            if entry is None:
+                time.sleep(1)
+                continue
+
+            last_checked, _, _, proxy = entry
+            if proxy.last_checked != last_checked or proxy not in self._index:
+                # Checked again in the meantime or no longer in the active pool
+                continue
+            self._acquire()
             try:
-                for p in unchecked_proxies:
-                    if p.state == ProxyState.ACTIVE:
-                        self.pool_active.append(p)
-                    else:
-                        self.pool_inactive.append(p)
+                self._revalidating.add(proxy)
             finally:
-                mutex.release()
-            # TODO: maybe check proxies again after some period in the active pool
-            if len(self.pool_active) > 100 or len(self.pool_inactive) == 0:
-                time.sleep(5)
+                self._lock.release()
+            self.checker.submit(proxy, lane=LANE_RECHECK)
+            time.sleep(1 / self.revalidation_rate)
+
+    @property
+    def checks_per_second(self) -> float:
+        return self.checker.checks_per_second
 
     @property
     def function_proxy_validator(self) -> Callable:
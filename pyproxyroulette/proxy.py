@@ -1,6 +1,16 @@
+import array
 import datetime
+import threading
+import time
 from enum import Enum
-from typing import Dict
+from .backoff import BackoffPolicy, FailureKind
+from .admission import AdmissionPolicy
+from typing import Dict, Callable
+
+
+_in_flight_lock = threading.Lock()
+# Notified whenever a request through any proxy ended
+_capacity = threading.Condition(_in_flight_lock)
 
 
 class ProxyState(Enum):
@@ -12,31 +22,78 @@ class ProxyState(Enum):
 
 
 class ProxyObject:
+    """
+    All points in time are kept on the monotonic clock (time.monotonic()).
+    The state is derived whenever a value it depends on is written, reading it only
+    consults the clock while the proxy is in cooldown.
+
+    The response time is an exponentially weighted moving average whose weights decay with the time
+    between samples (half-life latency_half_life seconds). The last latency_samples samples are kept
+    for the percentile estimates as milliseconds + 1 in an unsigned short array, 0 marks an empty slot.
+    Proxies are ranked by the average raised by tail_weight towards the p95 of the samples, failures are
+    not latency samples, they only count towards the circuit breaker.
+    """
+    __slots__ = ('ip', 'port', '_max_timeout', 'last_checked',
+                 'counter_consequtive_request_fails', 'max_c_request_fails',
+                 'cooldown_until', 'died_at', 'to_be_removed',
+                 '_response_counter', '_ewma', '_ewma_updated', '_samples', '_sample_pos', '_tail',
+                 'in_flight', '_tokens', '_tokens_updated', '_state', '_observer')
+
+    latency_half_life: float = 300.0
+    latency_min_weight: float = 0.1
+    latency_samples: int = 32
+    tail_weight: float = 0.5
+
+    # Cooldowns after failures, shared by all proxies
+    backoff: BackoffPolicy = BackoffPolicy()
+
+    # Limits of concurrent requests and request rate per proxy, shared by all proxies
+    admission: AdmissionPolicy = AdmissionPolicy()
+
+    # Requests currently sent through any proxy
+    requests_in_flight: int = 0
+
     def __init__(self, _ip: str, _port: int, average_response_time: float = None, max_timeout: int = 8):
         self.ip: str = str(_ip).strip(" ")
         self.port: int = int(_port)
         self._max_timeout: int = max_timeout
-        self.last_checked: datetime = None
+        self.last_checked: float = None
 
         # Counter for statistics
         self.counter_consequtive_request_fails: int = 0  # Consequtive failures to respond to requests.
 
-        # Cooldown variables
-        self._cooldown: bool = None
+        # End of the cooldown
+        self.cooldown_until: float = None
 
         # Death Date
-        self.death_date: datetime = None
+        self.died_at: float = None
 
         # Criteria: usability config
-        self.max_c_request_fails: int = 2
+        self.max_c_request_fails: int = self.backoff.max_failures
 
-        self.__response_time_total: int = 0
-        self.__response_counter: int = 0
+        self._response_counter: int = 0
+        self._ewma: float = None
+        self._ewma_updated: float = None
+        self._samples: array.array = None
+        self._sample_pos: int = 0
+        # p95 of the samples, updated with every sample
+        self._tail: float = None
 
         self.to_be_removed: bool = False
+
+        # Requests currently sent through the proxy and the token bucket of its rate limit
+        self.in_flight: int = 0
+        self._tokens: float = None
+        self._tokens_updated: float = None
+
+        # Called with the proxy whenever its response time or state changes
+        self._observer: Callable = None
+
         if average_response_time is not None:
-            self.__response_counter: int = 1
-            self.__response_time_total: float = float(average_response_time)
+            self._record_latency(float(average_response_time))
+
+        self._state: ProxyState = None
+        self._update_state()
 
         # Checks
         assert (0 <= self.port <= 65535)
@@ -44,39 +101,58 @@ class ProxyObject:
 
     @property
     def state(self) -> ProxyState:
+        if self._state is ProxyState.COOLDOWN and self.cooldown_until <= time.monotonic():
+            self.cooldown_until = None
+            self._update_state()
+        return self._state
+
+    def _update_state(self):
         if self.to_be_removed:
-            return ProxyState.REMOVAL
-        if self.max_c_request_fails <= self.counter_consequtive_request_fails:
-            if self.death_date is None:
-                self.death_date = datetime.datetime.now()
-            return ProxyState.DEAD
-        if self.is_in_cooldown():
-            return ProxyState.COOLDOWN
-        if self.__response_counter == 0:
-            return ProxyState.UNKNOWN
-        return ProxyState.ACTIVE
+            self._state = ProxyState.REMOVAL
+        elif self.max_c_request_fails <= self.counter_consequtive_request_fails:
+            if self.died_at is None:
+                self.died_at = time.monotonic()
+            self._state = ProxyState.DEAD
+        elif self.is_in_cooldown():
+            self._state = ProxyState.COOLDOWN
+        elif self._response_counter == 0:
+            self._state = ProxyState.UNKNOWN
+        else:
+            self._state = ProxyState.ACTIVE
 
     def is_in_cooldown(self) -> bool:
-        if self._cooldown is None:
+        if self.cooldown_until is None:
             return False
-        if self._cooldown >= datetime.datetime.now():
+        if self.cooldown_until >= time.monotonic():
             return True
-        self._cooldown = None
+        self.cooldown_until = None
         return False
 
     @property
-    def cooldown(self) -> bool:
-        if self._cooldown is not None:
-            return self._cooldown
+    def cooldown(self) -> datetime.datetime:
+        if self.cooldown_until is not None:
+            return datetime.datetime.now() + datetime.timedelta(seconds=self.cooldown_until - time.monotonic())
         return False
 
     @cooldown.setter
     def cooldown(self, _cooldown_timeperiod: datetime.timedelta):
         assert (isinstance(_cooldown_timeperiod, datetime.timedelta) or _cooldown_timeperiod is None)
         if _cooldown_timeperiod is None:
-            self._cooldown = None
-            return
-        self._cooldown = datetime.datetime.now() + _cooldown_timeperiod
+            self.cooldown_until = None
+        else:
+            self.cooldown_until = time.monotonic() + _cooldown_timeperiod.total_seconds()
+        self._changed()
+
+    @property
+    def death_date(self) -> datetime.datetime:
+        if self.died_at is None:
+            return None
+        return datetime.datetime.now() - datetime.timedelta(seconds=time.monotonic() - self.died_at)
+
+    def _changed(self):
+        self._update_state()
+        if self._observer is not None:
+            self._observer(self)
 
     def __eq__(self, other) -> bool:
         return isinstance(other, self.__class__) and other.ip == self.ip and other.port == self.port
@@ -91,29 +167,147 @@ class ProxyObject:
         return {"http": f"{self.ip}:{self.port}",
                 "https": f"{self.ip}:{self.port}"}
 
-    def report_request_failed(self):
-        self.response_time = self._max_timeout
+    def begin_request(self):
+        with _in_flight_lock:
+            self.in_flight += 1
+            ProxyObject.requests_in_flight += 1
+
+    def end_request(self):
+        with _in_flight_lock:
+            self.in_flight -= 1
+            ProxyObject.requests_in_flight -= 1
+            _capacity.notify_all()
+
+    def _available_tokens(self, now: float) -> float:
+        if self._tokens_updated is None:
+            return self.admission.burst
+        return min(self.admission.burst, self._tokens + (now - self._tokens_updated) * self.admission.rate)
+
+    def has_capacity(self) -> bool:
+        """
+        :return: True if a request could be sent through the proxy right now without exceeding its admission limits
+        """
+        policy = self.admission
+        if policy.max_in_flight is not None and self.in_flight >= policy.max_in_flight:
+            return False
+        return policy.rate is None or self._available_tokens(time.monotonic()) >= 1
+
+    def try_begin_request(self) -> bool:
+        """
+        Admits a request if the proxy has capacity for it. Admitted requests must be finished with end_request
+        :return: True if the request was admitted
+        """
+        policy = self.admission
+        with _in_flight_lock:
+            if policy.max_in_flight is not None and self.in_flight >= policy.max_in_flight:
+                return False
+            if policy.rate is not None:
+                now = time.monotonic()
+                tokens = self._available_tokens(now)
+                if tokens < 1:
+                    return False
+                self._tokens, self._tokens_updated = tokens - 1, now
+            self.in_flight += 1
+            ProxyObject.requests_in_flight += 1
+        return True
+
+    @staticmethod
+    def wait_for_capacity(timeout: float):
+        """
+        Blocks until a request through any proxy ended or the timeout passed
+        """
+        with _capacity:
+            _capacity.wait(timeout)
+
+    def report_request_failed(self, kind: FailureKind = FailureKind.PROXY_ERROR):
+        """
+        Opens the circuit breaker: the proxy cools down for a period growing with its consecutive failures
+        :param kind: kind of the failure, which determines the base cooldown
+        """
         self.counter_consequtive_request_fails += 1
-        self.cooldown = datetime.timedelta(hours=1)
+        self.cooldown_until = time.monotonic() + self.backoff.cooldown(kind, self.counter_consequtive_request_fails)
+        self._changed()
 
     def report_success(self):
         self.counter_consequtive_request_fails = 0
-        self.death_date = None
+        self.died_at = None
+        self._changed()
 
     def mark_for_removal(self):
         self.to_be_removed = True
+        self._changed()
 
     @property
     def response_time(self) -> float:
-        if self.__response_counter == 0:
+        """
+        Time-decayed average response time in seconds, 0 if no response was recorded yet
+        """
+        if self._response_counter == 0:
             return 0
-        return float(self.__response_time_total) / self.__response_counter
+        return self._ewma
 
     @response_time.setter
-    def response_time(self, value: int):
-        self.__response_time_total += value
-        self.__response_counter += 1
+    def response_time(self, value: float):
+        self._record_latency(float(value))
+        self._changed()
+
+    @property
+    def ranking_latency(self) -> float:
+        """
+        Latency the proxy is ranked by: the response time raised by tail_weight towards the p95 of the recent
+        response times, so a proxy with occasional very slow responses ranks behind a steady one
+        """
+        if self._response_counter == 0:
+            return 0
+        ewma, tail = self._ewma, self._tail
+        if tail is None or tail <= ewma:
+            return ewma
+        return ewma + self.tail_weight * (tail - ewma)
+
+    @property
+    def latency_p50(self) -> float:
+        return self.latency_percentile(50)
+
+    @property
+    def latency_p95(self) -> float:
+        return self.latency_percentile(95)
+
+    def latency_percentile(self, percentile: float) -> float:
+        """
+        Percentile of the most recent response times
+        :param percentile: 0 to 100
+        :return: response time in seconds or None if no response was recorded yet
+        """
+        if self._samples is None:
+            return None
+        samples = sorted(v for v in self._samples if v != 0)
+        if len(samples) == 0:
+            return None
+        return (int(samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]) - 1) / 1000
+
+    def _record_latency(self, value: float):
+        now = time.monotonic()
+        if self._response_counter == 0 or self._ewma is None:
+            self._ewma = value
+        else:
+            weight = max(self.latency_min_weight,
+                         1 - 0.5 ** ((now - self._ewma_updated) / self.latency_half_life))
+            self._ewma += weight * (value - self._ewma)
+        self._ewma_updated = now
+        self._response_counter += 1
+
+        if self._samples is None:
+            self._samples = array.array('H', bytes(2 * self.latency_samples))
+        pos = self._sample_pos
+        self._samples[pos] = min(65535, int(value * 1000) + 1)
+        self._sample_pos = (pos + 1) % len(self._samples)
+        self._tail = self.latency_percentile(95)
 
     def reset_response_time(self):
-        self.__response_counter = 0
-        self.__response_time_total = 0
+        self._response_counter = 0
+        self._ewma = None
+        self._ewma_updated = None
+        self._samples = None
+        self._sample_pos = 0
+        self._tail = None
+        self._changed()
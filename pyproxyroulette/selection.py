@@ -0,0 +1,78 @@
+from .proxy import ProxyObject
+from .index import ProxyIndex
+import random
+from typing import Callable, Optional
+
+
+def _ranking_latency(proxy: ProxyObject) -> float:
+    return proxy.ranking_latency
+
+
+class SelectionStrategy:
+    """
+    Decides which active proxy is handed out next. Strategies only read the index and the proxies,
+    they are shared by all threads of a pool.
+    """
+    def select(self, index: ProxyIndex, latency: Callable[[ProxyObject], float] = None) -> Optional[ProxyObject]:
+        """
+        :param index: index over the active pool
+        :param latency: latency to compare proxies by, e.g. towards the target host. ProxyObject.ranking_latency
+        if None
+        :return: the selected proxy or None if no active proxy is available
+        """
+        raise NotImplementedError
+
+    def __repr__(self) -> str:
+        return self.__class__.__name__
+
+
+class FastestFirst(SelectionStrategy):
+    """
+    Always returns the proxy with the lowest ranking latency (see ProxyObject.ranking_latency)
+    """
+    def select(self, index: ProxyIndex, latency: Callable[[ProxyObject], float] = None) -> Optional[ProxyObject]:
+        return index.best(latency)
+
+
+class PowerOfTwoChoices(SelectionStrategy):
+    """
+    Draws two random active proxies and returns the one with the lower ranking latency
+    """
+    def select(self, index: ProxyIndex, latency: Callable[[ProxyObject], float] = None) -> Optional[ProxyObject]:
+        candidates = index.sample(2)
+        if len(candidates) == 0:
+            return index.best(latency)
+        return min(candidates, key=latency or _ranking_latency)
+
+
+class WeightedRandom(SelectionStrategy):
+    """
+    Draws `candidates` random active proxies and picks one of them with a probability
+    inversely proportional to its ranking latency
+    """
+    def __init__(self, candidates: int = 8):
+        self.candidates: int = candidates
+
+    def select(self, index: ProxyIndex, latency: Callable[[ProxyObject], float] = None) -> Optional[ProxyObject]:
+        candidates = index.sample(self.candidates)
+        if len(candidates) == 0:
+            return index.best(latency)
+        key = latency or _ranking_latency
+        weights = [1 / max(key(p), 0.001) for p in candidates]
+        return random.choices(candidates, weights=weights)[0]
+
+
+class LeastInFlight(SelectionStrategy):
+    """
+    Draws `candidates` random active proxies and returns the one with the fewest outstanding requests,
+    ties are broken by ranking latency
+    """
+    def __init__(self, candidates: int = 4):
+        self.candidates: int = candidates
+
+    def select(self, index: ProxyIndex, latency: Callable[[ProxyObject], float] = None) -> Optional[ProxyObject]:
+        candidates = index.sample(self.candidates)
+        if len(candidates) == 0:
+            return index.best(latency)
+        key = latency or _ranking_latency
+        return min(candidates, key=lambda p: (p.in_flight, key(p)))
@@ -0,0 +1,143 @@
+from .proxy import ProxyObject
+import requests
+import socket
+import threading
+import logging
+import urllib3
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Handle of the attempt running in the current thread, connections register with it when they send a request
+_current = threading.local()
+
+
+class AttemptHandle:
+    """
+    Allows to abort a request running in another thread. While the handle is entered, connections of the
+    SessionPool used by the current thread register with it, cancel() shuts their socket down so the blocked
+    request fails with a ConnectionError. Requests through SOCKS proxies can not be aborted.
+    """
+    def __init__(self):
+        self.cancelled: bool = False
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        _current.handle = self
+        return self
+
+    def __exit__(self, *exc):
+        _current.handle = None
+        with self._lock:
+            self._connection = None
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            sock = getattr(self._connection, 'sock', None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _bind(self, connection):
+        with self._lock:
+            if self.cancelled:
+                raise ConnectionAbortedError("attempt was cancelled")
+            self._connection = connection
+
+
+class _TrackedHTTPConnection(urllib3.connection.HTTPConnection):
+    def request(self, *args, **kwargs):
+        handle = getattr(_current, 'handle', None)
+        if handle is not None:
+            handle._bind(self)
+        return super().request(*args, **kwargs)
+
+
+class _TrackedHTTPSConnection(urllib3.connection.HTTPSConnection):
+    def request(self, *args, **kwargs):
+        handle = getattr(_current, 'handle', None)
+        if handle is not None:
+            handle._bind(self)
+        return super().request(*args, **kwargs)
+
+
+class _TrackedHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = _TrackedHTTPConnection
+
+
+class _TrackedHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = _TrackedHTTPSConnection
+
+
+class _TrackingAdapter(requests.adapters.HTTPAdapter):
+    """
+    HTTPAdapter whose connections to HTTP proxies register with the AttemptHandle of the current thread
+    """
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        if not proxy.lower().startswith("socks"):
+            manager.pool_classes_by_scheme = {'http': _TrackedHTTPConnectionPool,
+                                              'https': _TrackedHTTPSConnectionPool}
+        return manager
+
+
+class SessionPool:
+    """
+    Keeps one requests.Session per proxy so that connections to the proxy are kept alive and reused.
+    The pool is bounded, the least recently used session is closed once max_size is exceeded.
+    """
+    def __init__(self, max_size: int = 256, connections_per_proxy: int = 10):
+        self.max_size: int = max_size
+        self.connections_per_proxy: int = connections_per_proxy
+        self._sessions: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, proxy: ProxyObject) -> requests.Session:
+        """
+        Returns the session of the proxy. A new session is created if the proxy has none yet
+        :param proxy: proxy object
+        :return: session routing all requests through the proxy
+        """
+        evicted = None
+        with self._lock:
+            session = self._sessions.get(proxy)
+            if session is not None:
+                self._sessions.move_to_end(proxy)
+                return session
+            session = self._create_session(proxy)
+            self._sessions[proxy] = session
+            if len(self._sessions) > self.max_size:
+                evicted = self._sessions.popitem(last=False)
+        if evicted is not None:
+            logger.debug(f"Evicted session of proxy {evicted[0]}")
+            evicted[1].close()
+        return session
+
+    def close(self, proxy: ProxyObject):
+        with self._lock:
+            session = self._sessions.pop(proxy, None)
+        if session is not None:
+            session.close()
+
+    def close_all(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for s in sessions:
+            s.close()
+
+    def _create_session(self, proxy: ProxyObject) -> requests.Session:
+        session = requests.Session()
+        adapter = _TrackingAdapter(pool_connections=self.connections_per_proxy,
+                                   pool_maxsize=self.connections_per_proxy)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.proxies.update(proxy.to_dict())
+        return session
+
+    def __len__(self) -> int:
+        return len(self._sessions)
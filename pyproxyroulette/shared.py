@@ -0,0 +1,415 @@
+from .proxy import ProxyObject, ProxyState
+from .pool import ProxyPool
+from .selection import SelectionStrategy
+from .backoff import FailureKind
+import collections
+import datetime
+import hmac
+import ipaddress
+import json
+import socket
+import socketserver
+import threading
+import time
+import logging
+from typing import Dict, Iterable, List, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# A TCP address as (host, port) or the path of a Unix socket
+Address = Union[Tuple[str, int], str]
+
+# Reply of the server to a connection without the right token, the connection is closed afterwards
+AUTH_FAILED = "authentication failed"
+
+
+def _apply_event(proxy: ProxyObject, event: str, value):
+    if event == "failed":
+        # Kinds unknown to this version, e.g. sent by a newer client, count as proxy errors
+        proxy.report_request_failed(FailureKind.__members__.get(value, FailureKind.PROXY_ERROR))
+    elif event == "success":
+        proxy.report_success()
+    elif event == "latency":
+        proxy.response_time = value
+    elif event == "cooldown":
+        proxy.cooldown = None if value is None else datetime.timedelta(seconds=value)
+    elif event == "removal":
+        proxy.mark_for_removal()
+
+
+class _PoolRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        pool_server = self.server.pool_server
+        authenticated = pool_server.token is None
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if not authenticated:
+                    # The first request of a connection has to present the token
+                    authenticated = request.get("op") == "hello" and pool_server.authenticate(request.get("token"))
+                    reply = {"hello": True} if authenticated else {"error": AUTH_FAILED}
+                else:
+                    reply = pool_server.dispatch(request)
+            except Exception as e:
+                logger.error(f"Pool server could not handle request. {e}")
+                reply = {"error": str(e)}
+            self.wfile.write(json.dumps(reply).encode() + b"\n")
+            self.wfile.flush()
+            if not authenticated:
+                logger.warning(f"Rejected pool client {self.client_address}")
+                return
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class _UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+else:
+    _UnixServer = None
+
+
+class PoolServer:
+    """
+    Serves one ProxyPool to many worker processes over a TCP or Unix socket, so proxies are
+    downloaded and checked once for all workers. Requests and replies are JSON, one object per line.
+    Feedback of the workers is applied to the served pool, the workers pick up the resulting
+    active set with their next sync.
+
+    Clients may add proxies, so the server only listens on the loopback interface by default. If a token is set,
+    every connection has to present it with its first request before it is served.
+    """
+    def __init__(self, pool: ProxyPool, address: Address = ("127.0.0.1", 7711), token: str = None):
+        self.pool: ProxyPool = pool
+        self.address: Address = address
+        self.token: str = token
+        self._proxies: Dict[Tuple[str, int], ProxyObject] = {}
+        self._proxies_refreshed: float = 0.0
+        self._lock = threading.Lock()
+        if isinstance(address, str):
+            if _UnixServer is None:
+                raise ValueError("Unix sockets are not supported on this platform")
+            self._server = _UnixServer(address, _PoolRequestHandler)
+        else:
+            self._server = _TCPServer(address, _PoolRequestHandler)
+            self.address = self._server.server_address
+            if token is None and not _is_loopback(address[0]):
+                logger.warning(f"Pool server listens on {address[0]} without a token, any client may add proxies")
+        self._server.pool_server = self
+        self._instance: threading.Thread = None
+
+    def start(self):
+        """
+        Serves from a background thread
+        """
+        if self._instance is None or not self._instance.is_alive():
+            self._instance = threading.Thread(target=self._server.serve_forever)
+            self._instance.setDaemon(True)
+            self._instance.start()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def authenticate(self, token: str) -> bool:
+        if self.token is None:
+            return True
+        return isinstance(token, str) and hmac.compare_digest(token.encode(), self.token.encode())
+
+    def dispatch(self, request: Dict) -> Dict:
+        op = request.get("op")
+        if op == "sync":
+            for ip, port, event, value in request.get("events", []):
+                proxy = self._lookup(ip, port)
+                if proxy is not None:
+                    _apply_event(proxy, event, value)
+            return {"active": [[p.ip, p.port, p.response_time] for p in self.pool._active_proxies()]}
+        if op == "add":
+            return {"added": self.pool.add_many(request.get("proxies", []))}
+        if op == "state":
+            return {"state": self.pool.state()}
+        return {"error": f"unknown operation {op}"}
+
+    def _lookup(self, ip: str, port: int) -> ProxyObject:
+        key = (ip, port)
+        with self._lock:
+            proxy = self._proxies.get(key)
+            if proxy is None and time.monotonic() - self._proxies_refreshed > 1:
+                # Unknown proxies are rare, the lookup table is rebuilt at most once per second
+                self._proxies = {(p.ip, p.port): p for p in self.pool.proxies()}
+                self._proxies_refreshed = time.monotonic()
+                proxy = self._proxies.get(key)
+            return proxy
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class RemoteProxy(ProxyObject):
+    """
+    Local mirror of a proxy of a PoolServer. Feedback is applied locally and forwarded to the server
+    """
+    __slots__ = ('_pool', '_remote_active')
+
+    def __init__(self, pool: 'RemoteProxyPool', _ip: str, _port: int, max_timeout: int = 8):
+        self._pool: RemoteProxyPool = pool
+        self._remote_active: bool = False
+        super().__init__(_ip, _port, max_timeout=max_timeout)
+
+    def _update_state(self):
+        super()._update_state()
+        if self._state is ProxyState.ACTIVE and not self._remote_active:
+            self._state = ProxyState.UNKNOWN
+
+    def report_request_failed(self, kind: FailureKind = FailureKind.PROXY_ERROR):
+        super().report_request_failed(kind)
+        self._pool._forward(self, "failed", kind.name, urgent=True)
+
+    def report_success(self):
+        super().report_success()
+        self._pool._forward(self, "success")
+
+    def mark_for_removal(self):
+        super().mark_for_removal()
+        self._pool._forward(self, "removal", urgent=True)
+
+    @ProxyObject.cooldown.setter
+    def cooldown(self, _cooldown_timeperiod: datetime.timedelta):
+        ProxyObject.cooldown.fset(self, _cooldown_timeperiod)
+        self._pool._forward(self, "cooldown",
+                            None if _cooldown_timeperiod is None else _cooldown_timeperiod.total_seconds(),
+                            urgent=True)
+
+    @ProxyObject.response_time.setter
+    def response_time(self, value: float):
+        ProxyObject.response_time.fset(self, value)
+        self._pool._forward(self, "latency", float(value))
+
+
+class RemoteProxyPool(ProxyPool):
+    """
+    ProxyPool of a worker process backed by a PoolServer. The active set of the server is mirrored locally
+    every sync_interval seconds, selection and per-host health stay local. Failures are forwarded immediately,
+    other feedback with the next sync. Nothing is checked locally.
+    While the server is unreachable at most max_pending_events events are kept, the oldest ones are dropped.
+    """
+    def __init__(self,
+                 address: Address = ("127.0.0.1", 7711),
+                 sync_interval: float = 0.5,
+                 max_timeout: int = 8,
+                 selection_strategy: SelectionStrategy = None,
+                 connect_timeout: float = 5,
+                 token: str = None,
+                 max_pending_events: int = 10000):
+        self.address: Address = address
+        self.sync_interval: float = sync_interval
+        self.connect_timeout: float = connect_timeout
+        self.token: str = token
+        self._mirror: Dict[Tuple[str, int], RemoteProxy] = {}
+        self._events: collections.deque = collections.deque(maxlen=max_pending_events)
+        self._urgent = threading.Event()
+        self._socket: socket.socket = None
+        self._connection = None
+        self._connection_lock = threading.Lock()
+        self.sync_instance: threading.Thread = None
+        self.last_sync: float = None
+        super().__init__(func_proxy_validator=None,
+                         max_timeout=max_timeout,
+                         check_concurrency=0,
+                         selection_strategy=selection_strategy)
+
+    def start(self):
+        if self.sync_instance is None or not self.sync_instance.is_alive():
+            self.keyboard_interrupt = False
+            self.sync_instance = threading.Thread(target=self._sync_worker)
+            self.sync_instance.setDaemon(True)
+            self.sync_instance.start()
+
+    def stop(self):
+        self.keyboard_interrupt = True
+        self._urgent.set()
+        if self.sync_instance is not None:
+            self.sync_instance.join()
+        self._close()
+
+    def add_many(self, proxies: Iterable[Tuple], batch_size: int = 4096) -> int:
+        """
+        Forwards the proxies to the server
+        :return: number of proxies new to the server
+        """
+        added = 0
+        batch = []
+        for p in proxies:
+            batch.append([p[0], int(p[1]), p[2] if len(p) > 2 else 0])
+            if len(batch) >= batch_size:
+                added += self._call({"op": "add", "proxies": batch}).get("added", 0)
+                batch = []
+        if batch:
+            added += self._call({"op": "add", "proxies": batch}).get("added", 0)
+        return added
+
+    def restore(self, records, max_age: float = 6 * 3600) -> int:
+        """
+        Does nothing, the state of a shared pool is kept by its server. A snapshot is restored on the server
+        :return: 0
+        """
+        return 0
+
+    def proxies(self) -> List[ProxyObject]:
+        return list(self._mirror.values())
+
+    def state(self):
+        return self._call({"op": "state"}).get("state", "")
+
+    def sync(self):
+        """
+        Sends the pending feedback and mirrors the active set of the server
+        """
+        events = []
+        while self._events:
+            events.append(self._events.popleft())
+        try:
+            reply = self._call({"op": "sync", "events": events})
+        except (OSError, ValueError):
+            # Feedback is kept for the next attempt as far as there is room, newer events take precedence
+            room = self._events.maxlen - len(self._events) if self._events.maxlen is not None else len(events)
+            if room > 0:
+                self._events.extendleft(reversed(events[-room:]))
+            raise
+
+        active = set()
+        for ip, port, response_time in reply.get("active", []):
+            key = (ip, port)
+            active.add(key)
+            proxy = self._mirror.get(key)
+            if proxy is None:
+                proxy = self._mirror[key] = RemoteProxy(self, ip, port, max_timeout=self._max_timeout)
+                proxy._observer = self._proxy_changed
+            # The statistics of the server replace the local ones, local samples are kept for the percentiles
+            proxy._remote_active = True
+            proxy.counter_consequtive_request_fails = 0
+            proxy.cooldown_until = None
+            proxy._ewma = response_time
+            proxy._ewma_updated = time.monotonic()
+            proxy._response_counter = max(1, proxy._response_counter)
+            proxy._update_state()
+            self._index.add(proxy)
+
+        for key in [k for k in self._mirror if k not in active]:
+            proxy = self._mirror.pop(key)
+            proxy._remote_active = False
+            proxy._update_state()
+            self._index.discard(proxy)
+            self._proxy_dropped(proxy)
+        self.last_sync = time.monotonic()
+        if active:
+            self._notify_activated()
+
+    def _proxy_changed(self, proxy: ProxyObject):
+        if proxy.state == ProxyState.ACTIVE:
+            self._index.update(proxy)
+        else:
+            self._index.discard(proxy)
+
+    def _forward(self, proxy: RemoteProxy, event: str, value=None, urgent: bool = False):
+        self._events.append((proxy.ip, proxy.port, event, value))
+        if urgent:
+            self._urgent.set()
+
+    def _sync_worker(self):
+        while not self.keyboard_interrupt:
+            try:
+                self.sync()
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not sync with pool server {self.address}. {e}")
+            self._urgent.wait(self.sync_interval)
+            self._urgent.clear()
+
+    def _call(self, request: Dict) -> Dict:
+        with self._connection_lock:
+            try:
+                if self._connection is None:
+                    self._connection = self._connect()
+                self._connection.write(json.dumps(request).encode() + b"\n")
+                self._connection.flush()
+                line = self._connection.readline()
+                if not line:
+                    raise ConnectionResetError("Pool server closed the connection")
+                reply = json.loads(line)
+                if reply.get("error") == AUTH_FAILED:
+                    raise ConnectionRefusedError("Pool server rejected the token")
+                return reply
+            except (OSError, ValueError):
+                self._close()
+                raise
+
+    def _connect(self):
+        if isinstance(self.address, str):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.connect_timeout)
+            sock.connect(self.address)
+        else:
+            sock = socket.create_connection(self.address, timeout=self.connect_timeout)
+        sock.settimeout(None)
+        self._socket = sock
+        self._connection = sock.makefile("rwb")
+        if self.token is not None:
+            self._connection.write(json.dumps({"op": "hello", "token": self.token}).encode() + b"\n")
+            self._connection.flush()
+            if not json.loads(self._connection.readline() or b"{}").get("hello"):
+                raise ConnectionRefusedError("Pool server rejected the token")
+        return self._connection
+
+    def _close(self):
+        for c in (self._connection, self._socket):
+            if c is not None:
+                try:
+                    c.close()
+                except OSError:
+                    pass
+        self._connection = None
+        self._socket = None
+
+    @property
+    def checks_per_second(self) -> float:
+        return 0.0
+
+
+def main():
+    import argparse
+    import os
+    from .app import registered_pool_updater
+    from .core import ProxyRouletteCore
+
+    parser = argparse.ArgumentParser(description="Serves one proxy pool to many ProxyRoulette workers")
+    parser.add_argument("--bind", default="127.0.0.1:7711", help="host:port or path of a Unix socket")
+    parser.add_argument("--snapshot", default=None, help="SQLite snapshot file of the pool")
+    parser.add_argument("--token", default=os.environ.get("PYPROXYROULETTE_TOKEN"),
+                        help="token clients have to present, defaults to $PYPROXYROULETTE_TOKEN")
+    args = parser.parse_args()
+
+    address = args.bind
+    if ":" in address:
+        host, port = address.rsplit(":", 1)
+        address = (host, int(port))
+    logging.basicConfig(level=logging.INFO)
+    core = ProxyRouletteCore(func_proxy_pool_updater=registered_pool_updater(), snapshot_path=args.snapshot)
+    server = PoolServer(core.proxy_pool, address, token=args.token)
+    logger.info(f"Serving proxy pool on {server.address}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
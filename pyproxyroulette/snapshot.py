@@ -0,0 +1,149 @@
+import array
+import datetime
+import logging
+import sqlite3
+import threading
+import time
+from .proxy import ProxyObject
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS proxies (
+    ip TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    fails INTEGER NOT NULL,
+    response_counter INTEGER NOT NULL,
+    ewma REAL,
+    ewma_updated REAL,
+    samples BLOB,
+    sample_pos INTEGER NOT NULL,
+    last_checked REAL,
+    cooldown_until REAL,
+    died_at REAL,
+    PRIMARY KEY (ip, port)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value REAL
+);
+"""
+
+# Points in time of a proxy which are kept on the monotonic clock
+_CLOCK_FIELDS = ('_ewma_updated', 'last_checked', 'cooldown_until', 'died_at')
+
+
+class PoolSnapshot:
+    """
+    Persists the proxies of a ProxyPool with their latency statistics, failure counters, cooldown and
+    death deadlines in a SQLite file. Points in time are stored on the wall clock and converted back to
+    the monotonic clock when loading, so a snapshot survives restarts.
+
+    Proxies which were ACTIVE and checked within max_age are served right after loading and re-validated
+    by the pool in the background, all other proxies are queued for the checker.
+    """
+    def __init__(self,
+                 path: str,
+                 interval: datetime.timedelta = datetime.timedelta(minutes=5),
+                 max_age: datetime.timedelta = datetime.timedelta(hours=6)):
+        self.path: str = path
+        self.interval: datetime.timedelta = interval
+        self.max_age: datetime.timedelta = max_age
+        self.saved_at: float = None
+        self._instance: threading.Thread = None
+        self._stopped = threading.Event()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path)
+        connection.executescript(_SCHEMA)
+        return connection
+
+    def save(self, pool) -> int:
+        """
+        Writes all proxies of the pool, replacing the previous snapshot
+        :return: number of proxies written
+        """
+        offset = time.time() - time.monotonic()
+        rows = []
+        for p in pool.proxies():
+            if p.to_be_removed:
+                continue
+            clock = [None if getattr(p, f) is None else getattr(p, f) + offset for f in _CLOCK_FIELDS]
+            samples = None if p._response_counter == 0 else array.array('H', p._samples).tobytes()
+            rows.append((p.ip, p.port, p.counter_consequtive_request_fails, p._response_counter, p._ewma,
+                         clock[0], samples, p._sample_pos, clock[1], clock[2], clock[3]))
+
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute("DELETE FROM proxies")
+                connection.executemany("INSERT OR REPLACE INTO proxies VALUES (?,?,?,?,?,?,?,?,?,?,?)", rows)
+                connection.execute("INSERT OR REPLACE INTO meta VALUES ('saved_at', ?)", (time.time(),))
+        finally:
+            connection.close()
+        self.saved_at = time.time()
+        logger.debug(f"Saved {len(rows)} proxies to {self.path}")
+        return len(rows)
+
+    def load(self, pool) -> int:
+        """
+        Adds the proxies of the snapshot to the pool. Proxies already known to the pool are skipped
+        :return: number of proxies restored
+        """
+        connection = self._connect()
+        try:
+            rows = connection.execute("SELECT * FROM proxies").fetchall()
+        finally:
+            connection.close()
+
+        offset = time.monotonic() - time.time()
+        records = []
+        for ip, port, fails, response_counter, ewma, ewma_updated, samples, sample_pos, \
+                last_checked, cooldown_until, died_at in rows:
+            fields = {
+                'counter_consequtive_request_fails': fails,
+                '_response_counter': response_counter,
+                '_ewma': ewma,
+                '_sample_pos': sample_pos,
+            }
+            for f, value in zip(_CLOCK_FIELDS, (ewma_updated, last_checked, cooldown_until, died_at)):
+                fields[f] = None if value is None else value + offset
+            if samples is not None and len(samples) == 2 * ProxyObject.latency_samples:
+                fields['_samples'] = array.array('H', samples)
+            elif response_counter != 0:
+                # Statistics without samples are unusable, the proxy is checked again
+                fields['_response_counter'] = 0
+                fields['_ewma'] = None
+            records.append((ip, port, fields))
+
+        restored = pool.restore(records, max_age=self.max_age.total_seconds())
+        logger.info(f"Restored {restored} of {len(records)} proxies from {self.path}")
+        return restored
+
+    def start(self, pool):
+        """
+        Saves the pool every interval from a background thread
+        """
+        if self._instance is not None and self._instance.is_alive():
+            return
+        self._stopped.clear()
+        self._instance = threading.Thread(target=self._worker, args=(pool,))
+        self._instance.setDaemon(True)
+        self._instance.start()
+
+    def stop(self, pool=None):
+        """
+        Stops the background thread and saves the pool a last time if given
+        """
+        self._stopped.set()
+        if self._instance is not None:
+            self._instance.join()
+        if pool is not None:
+            self.save(pool)
+
+    def _worker(self, pool):
+        while not self._stopped.wait(self.interval.total_seconds()):
+            try:
+                self.save(pool)
+            except sqlite3.Error as e:
+                logger.error(f"Could not save proxy snapshot {self.path}. {e}")
@@ -0,0 +1,67 @@
+import heapq
+import itertools
+import threading
+import time
+import logging
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineScheduler:
+    """
+    Min-heap of deadlines served by a single thread. Each callback is invoked once its deadline passed,
+    the thread sleeps until the earliest deadline or until an earlier one is scheduled.
+    """
+    def __init__(self):
+        self._heap: List = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._instance: threading.Thread = None
+        self._stopped: bool = False
+
+    def start(self):
+        if self._instance is None or not self._instance.is_alive():
+            self._stopped = False
+            self._instance = threading.Thread(target=self._worker)
+            self._instance.setDaemon(True)
+            self._instance.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._instance is not None:
+            self._instance.join()
+
+    def is_alive(self) -> bool:
+        return self._instance is not None and self._instance.is_alive()
+
+    def schedule(self, delay: float, func: Callable, *args):
+        """
+        Calls func(*args) from the scheduler thread after delay seconds
+        :param delay: seconds from now, negative values fire immediately
+        :param func: callback
+        """
+        deadline = time.monotonic() + max(0.0, delay)
+        with self._condition:
+            heapq.heappush(self._heap, (deadline, next(self._counter), func, args))
+            if self._heap[0][0] == deadline:
+                self._condition.notify()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while not self._stopped and (not self._heap or self._heap[0][0] > time.monotonic()):
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._condition.wait(timeout)
+                if self._stopped:
+                    return
+                _, _, func, args = heapq.heappop(self._heap)
+            try:
+                func(*args)
+            except Exception as e:
+                logger.error(f"An unexpected error occured in scheduled callback {func}. {e}")
@@ -0,0 +1,145 @@
+import requests as requests_original
+from .proxy import ProxyObject
+import re
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+_IP_ADDRESS = re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}\b")
+
+
+class CheckResult:
+    """
+    Result of a proxy validator. Evaluates to `alive`, so it can be returned wherever a bool is expected.
+    anonymous is None if the validator did not find out whether the proxy leaks the own address
+    """
+    __slots__ = ('alive', 'anonymous')
+
+    def __init__(self, alive: bool, anonymous: bool = None):
+        self.alive: bool = alive
+        self.anonymous: bool = anonymous
+
+    def __bool__(self) -> bool:
+        return self.alive
+
+    def __repr__(self) -> str:
+        return f"CheckResult[alive: {self.alive}|anonymous: {self.anonymous}]"
+
+
+class AnonymityCache:
+    """
+    Anonymity verdicts per proxy IP address, valid for ttl seconds.
+    At most max_size verdicts are kept, the least recently used one is evicted first
+    """
+    def __init__(self, ttl: float = 24 * 3600, max_size: int = 65536):
+        self.ttl: float = ttl
+        self.max_size: int = max_size
+        self.hits: int = 0
+        self.misses: int = 0
+        self._verdicts: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, ip: str) -> Optional[bool]:
+        """
+        :return: the cached verdict or None if there is no valid one
+        """
+        with self._lock:
+            entry = self._verdicts.get(ip)
+            if entry is None or entry[1] <= time.monotonic():
+                self.misses += 1
+                return None
+            self._verdicts.move_to_end(ip)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, ip: str, anonymous: bool):
+        with self._lock:
+            self._verdicts[ip] = (anonymous, time.monotonic() + self.ttl)
+            self._verdicts.move_to_end(ip)
+            if len(self._verdicts) > self.max_size:
+                self._verdicts.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._verdicts)
+
+
+class EchoValidator:
+    """
+    Validates a proxy with a single request to an echo endpoint, which answers with the address of its client and
+    the request headers it received as JSON (the format of httpbin.org/get). The answer decides whether the proxy
+    works and, by looking for the own public address in the reported origin and headers, whether it leaks it.
+    The own address is looked up with a direct request to the same endpoint and kept for own_ip_ttl seconds,
+    as long as it is unknown the anonymity of the proxies is left undecided
+    """
+    def __init__(self, url: str = "http://httpbin.org/get", own_ip: str = None, own_ip_ttl: float = 3600):
+        self.url: str = url
+        self.own_ip_ttl: float = own_ip_ttl
+        self._own_ip: str = own_ip
+        # A given address is never looked up
+        self._own_ip_expires: float = float('inf') if own_ip is not None else 0.0
+        self._own_ip_lock = threading.Lock()
+
+    def __call__(self, proxy: ProxyObject, timeout: int = 5) -> CheckResult:
+        try:
+            res = requests_original.get(self.url, proxies=proxy.to_dict(), timeout=timeout)
+            proxy.response_time = res.elapsed.total_seconds()
+        except (requests_original.exceptions.ProxyError,
+                requests_original.exceptions.ConnectTimeout):
+            return CheckResult(False)
+        echo = self._parse(res)
+        if echo is None:
+            return CheckResult(False)
+        own_ip = self.own_ip(timeout)
+        if own_ip is None:
+            return CheckResult(True)
+        return CheckResult(True, anonymous=own_ip not in self._addresses(echo))
+
+    def own_ip(self, timeout: int = 5) -> Optional[str]:
+        """
+        :return: the own public address as seen by the echo endpoint or None if it could not be looked up
+        """
+        if self._own_ip_expires > time.monotonic():
+            return self._own_ip
+        with self._own_ip_lock:
+            if self._own_ip_expires > time.monotonic():
+                return self._own_ip
+            own_ip = None
+            try:
+                echo = self._parse(requests_original.get(self.url, timeout=timeout))
+                if echo is not None:
+                    addresses = _IP_ADDRESS.findall(echo['origin'])
+                    own_ip = addresses[0] if addresses else None
+            except requests_original.exceptions.RequestException as e:
+                logger.warning(f"Could not look up the own address at {self.url}. {e}")
+            self._own_ip = own_ip
+            # A failed lookup is retried after a minute
+            self._own_ip_expires = time.monotonic() + (self.own_ip_ttl if own_ip is not None else 60)
+            return own_ip
+
+    @staticmethod
+    def _parse(res) -> Optional[Dict]:
+        if res.status_code != 200:
+            return None
+        try:
+            echo = res.json()
+        except ValueError:
+            return None
+        if not isinstance(echo, dict) or not isinstance(echo.get('origin'), str):
+            return None
+        return echo
+
+    @staticmethod
+    def _addresses(echo: Dict) -> set:
+        """
+        :return: all IP addresses in the origin and in the header values of an echo answer. The Host header is
+        skipped, it holds the address of the echo endpoint if its url contains one
+        """
+        values = [echo['origin']]
+        headers = echo.get('headers')
+        if isinstance(headers, dict):
+            values.extend(str(v) for k, v in headers.items() if k.lower() != 'host')
+        return set(_IP_ADDRESS.findall(" ".join(values)))
@@ -30,6 +30,10 @@ setup(
     install_requires=[
         'Requests'
     ],
+    extras_require={
+        'async': ['aiohttp'],
+        'columnar': ['numpy'],
+    },
     keywords = ['PROXY', 'REQUESTS', 'PYPROXY', 'ROULETTE','CRAWLER', 'SCRAPER', 'PROXIFY'],
     classifiers=[
     'Development Status :: 4 - Beta',
@@ -0,0 +1,99 @@
+import asyncio
+import socket
+
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web
+
+from pyproxyroulette import AsyncProxyRoulette, FastestFirst, ProxyRoulette
+from pyproxyroulette.core import ProxyRouletteCore
+from pyproxyroulette.proxy import ProxyState
+
+
+async def start_proxy(name: str):
+    """
+    Local stand-in for an HTTP proxy: answers every proxied request itself with its name and the requested url
+    """
+    async def handle(request):
+        await asyncio.sleep(0.01)
+        return web.Response(text=f"{name} {request.url}")
+
+    server = web.Server(handle)
+    runner = web.ServerRunner(server)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, site._server.sockets[0].getsockname()[1]
+
+
+def unused_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_core(proxies, latencies):
+    def validator(proxy, timeout):
+        proxy.response_time = latencies[proxy.port]
+        return True
+
+    core = ProxyRouletteCore(func_proxy_pool_updater=lambda: proxies,
+                             func_proxy_validator=validator,
+                             selection_strategy=FastestFirst())
+    core.proxy_pool.anonymity_check = False
+    return core
+
+
+def test_proxies_are_assigned_per_task():
+    async def main():
+        runners, ports = zip(*[await start_proxy(name) for name in ("a", "b")])
+        core = make_core([("127.0.0.1", p, 0) for p in ports], {p: 0.01 for p in ports})
+        try:
+            async with AsyncProxyRoulette(proxy_core=core, max_retries=2) as apr:
+                async def crawl(task_id):
+                    seen = set()
+                    for i in range(5):
+                        res = await apr.get(f"http://example.test/{task_id}/{i}")
+                        text = await res.text()
+                        assert text.endswith(f"http://example.test/{task_id}/{i}")
+                        seen.add(text.split()[0])
+                    assigned = await core.current_proxy_async(return_obj=True)
+                    return seen, assigned, asyncio.current_task()
+
+                results = await asyncio.gather(*[crawl(t) for t in range(8)])
+            for seen, assigned, task in results:
+                # Every task keeps its own proxy for all of its requests
+                assert len(seen) == 1
+                assert assigned.port in ports
+                assert core._task_proxy.get(task) is assigned
+        finally:
+            core.proxy_pool.stop()
+            for r in runners:
+                await r.cleanup()
+
+    asyncio.run(main())
+
+
+def test_feedback_reaches_the_shared_pool():
+    async def main():
+        runner, good = await start_proxy("good")
+        broken = unused_port()
+        # The broken proxy looks faster, so it is assigned first
+        core = make_core([("127.0.0.1", broken, 0), ("127.0.0.1", good, 0)], {broken: 0.001, good: 0.01})
+        pr = ProxyRoulette(proxy_core=core)
+        try:
+            async with AsyncProxyRoulette(proxy_core=core, max_retries=2) as apr:
+                res = await apr.get("http://example.test/")
+                assert (await res.text()).startswith("good ")
+
+            proxies = {p.port: p for p in core.proxy_pool.proxies()}
+            # The failure seen by the async wrapper is visible to the sync wrapper sharing the pool
+            assert proxies[broken].state == ProxyState.COOLDOWN
+            assert pr.proxy_core.current_proxy(return_obj=True) is proxies[good]
+            assert proxies[good].response_time > 0.01
+        finally:
+            core.proxy_pool.stop()
+            await runner.cleanup()
+
+    asyncio.run(main())
@@ -0,0 +1,101 @@
+import socket
+import time
+
+import pytest
+
+from pyproxyroulette.pool import ProxyPool
+from pyproxyroulette.proxy import ProxyObject, ProxyState
+from pyproxyroulette.shared import PoolServer, RemoteProxy, RemoteProxyPool, _apply_event
+
+TOKEN = "secret"
+
+
+def wait_until(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+def mirrored(pool: RemoteProxyPool):
+    return {p.ip: p for p in pool.proxies() if p.state == ProxyState.ACTIVE}
+
+
+@pytest.fixture
+def server():
+    pool = ProxyPool(func_proxy_validator=lambda proxy, timeout: True)
+    pool.anonymity_check = False
+    server = PoolServer(pool, ("127.0.0.1", 0), token=TOKEN)
+    server.start()
+    yield server
+    server.stop()
+    pool.stop()
+
+
+@pytest.fixture
+def clients(server):
+    pools = [RemoteProxyPool(server.address, sync_interval=0.05, token=TOKEN) for _ in range(2)]
+    yield pools
+    for p in pools:
+        p.stop()
+
+
+def test_feedback_reaches_both_clients(server, clients):
+    a, b = clients
+    assert a.add_many([("10.0.0.1", 8080), ("10.0.0.2", 8080)]) == 2
+    assert wait_until(lambda: len(mirrored(a)) == 2 and len(mirrored(b)) == 2)
+
+    # A failure seen by one worker takes the proxy out of rotation on the server and for the other worker
+    mirrored(a)["10.0.0.1"].report_request_failed()
+    assert wait_until(lambda: "10.0.0.1" not in mirrored(b))
+    assert "10.0.0.1" not in mirrored(a)
+    served = {p.ip: p for p in server.pool.proxies()}
+    assert served["10.0.0.1"].state == ProxyState.COOLDOWN
+
+    # Latencies observed by one worker reach the other with its next sync
+    before = served["10.0.0.2"].response_time
+    mirrored(b)["10.0.0.2"].response_time = 5.0
+    assert wait_until(lambda: served["10.0.0.2"].response_time > before)
+    assert wait_until(lambda: mirrored(a)["10.0.0.2"].response_time == served["10.0.0.2"].response_time)
+
+
+def test_rejects_clients_without_token(server):
+    anonymous = RemoteProxyPool(server.address, sync_interval=60)
+    wrong = RemoteProxyPool(server.address, sync_interval=60, token="wrong")
+    try:
+        for client in (anonymous, wrong):
+            with pytest.raises(OSError):
+                client.add_many([("10.0.0.3", 8080)])
+        assert len(server.pool.proxies()) == 0
+    finally:
+        anonymous.stop()
+        wrong.stop()
+
+
+def test_pending_feedback_is_bounded():
+    # Nothing listens on the address, every sync fails
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        address = s.getsockname()
+    pool = RemoteProxyPool(address, sync_interval=60, connect_timeout=0.1, max_pending_events=100)
+    try:
+        proxy = RemoteProxy(pool, "10.0.0.4", 8080)
+        for i in range(1000):
+            pool._forward(proxy, "latency", float(i))
+            with pytest.raises(OSError):
+                pool.sync()
+        assert len(pool._events) == 100
+        assert pool._events[-1][3] == 999.0
+        assert pool.restore([]) == 0
+    finally:
+        pool.stop()
+
+
+def test_unknown_failure_kind_counts_as_proxy_error():
+    # Kinds of newer clients must not break the server
+    proxy = ProxyObject("10.0.0.5", 8080)
+    _apply_event(proxy, "failed", "NEWER_KIND")
+    assert proxy.state == ProxyState.COOLDOWN
+    assert proxy.counter_consequtive_request_fails == 1